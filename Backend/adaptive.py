@@ -0,0 +1,118 @@
+import os
+
+# =====================
+# Adaptive live quality
+# =====================
+# Each live stream steps through QUALITY_LEVELS to stay inside its frame
+# budget (1 / target fps) and latency budget (capture to frame sent). When
+# the smoothed per-frame cost or lag goes over budget the stream drops one
+# level at once; it climbs back only after ADAPT_UPGRADE_HOLD seconds
+# comfortably under budget, so it doesn't oscillate between levels.
+LIVE_TARGET_FPS = float(os.getenv('LIVE_TARGET_FPS', '0'))  # 0 uses the stream's max_fps
+LIVE_TARGET_LATENCY = float(os.getenv('LIVE_TARGET_LATENCY', '0.25'))  # seconds
+ADAPTIVE_QUALITY = os.getenv('ADAPTIVE_QUALITY', '1') != '0'
+ADAPT_INTERVAL = 1.0  # seconds between downgrades
+ADAPT_UPGRADE_HOLD = 5.0  # seconds under budget before an upgrade
+ADAPT_HEADROOM = 0.6  # "comfortably under budget": below this fraction of it
+ADAPT_SMOOTHING = 0.2  # weight of the newest sample in the moving averages
+# (inference stride, max frame width, JPEG quality cap), best first; 0/None: unchanged
+QUALITY_LEVELS = (
+    (1, 0, None),
+    (1, 960, 75),
+    (2, 960, 70),
+    (2, 640, 60),
+    (3, 640, 50),
+    (4, 480, 40),
+)
+
+
+def _smooth(average, sample):
+    return sample if average is None else average + ADAPT_SMOOTHING * (sample - average)
+
+
+class AdaptiveController:
+    """Picks inference stride, frame width and preview quality for one stream.
+
+    Feed it every frame the stream delivers with frame_done(); the level it
+    settles on is read back through stride, max_width and jpeg_quality.
+    """
+
+    def __init__(self, target_fps, target_latency=LIVE_TARGET_LATENCY, enabled=ADAPTIVE_QUALITY):
+        self.target_fps = target_fps
+        self.target_latency = target_latency
+        self.enabled = enabled
+        self.level = 0
+        self.fps = 0.0
+        self.lag = None
+        self.cost = None
+        self._last_frame = None
+        self._last_change = 0.0
+        self._good_since = None
+        self._frames_since_inference = 0
+
+    @property
+    def stride(self):
+        return QUALITY_LEVELS[self.level][0]
+
+    @property
+    def max_width(self):
+        return QUALITY_LEVELS[self.level][1]
+
+    @property
+    def jpeg_quality(self):
+        return QUALITY_LEVELS[self.level][2]
+
+    def should_infer(self):
+        """Every stride-th frame goes to the models"""
+        self._frames_since_inference += 1
+        if self._frames_since_inference >= self.stride:
+            self._frames_since_inference = 0
+            return True
+        return False
+
+    def frame_done(self, now, lag, cost):
+        """Record one delivered frame; returns True if the level changed.
+
+        lag is capture to send for this frame, cost the processing time spent
+        on it (its share of the batched step plus encoding).
+        """
+        if self._last_frame is not None and now > self._last_frame:
+            self.fps = _smooth(self.fps or None, 1.0 / (now - self._last_frame))
+        self._last_frame = now
+        self.lag = _smooth(self.lag, lag)
+        self.cost = _smooth(self.cost, cost)
+        if not self.enabled:
+            return False
+
+        budget = 1.0 / (LIVE_TARGET_FPS or self.target_fps)
+        over = self.cost > budget or self.lag > self.target_latency
+        under = self.cost < ADAPT_HEADROOM * budget and self.lag < ADAPT_HEADROOM * self.target_latency
+        if over:
+            self._good_since = None
+            if self.level + 1 < len(QUALITY_LEVELS) and now - self._last_change >= ADAPT_INTERVAL:
+                return self._set_level(self.level + 1, now)
+        elif under and self.level > 0:
+            if self._good_since is None:
+                self._good_since = now
+            elif now - self._good_since >= ADAPT_UPGRADE_HOLD:
+                return self._set_level(self.level - 1, now)
+        else:
+            self._good_since = None
+        return False
+
+    def _set_level(self, level, now):
+        self.level = level
+        self._last_change = now
+        self._good_since = None
+        # Costs measured at the old level no longer apply
+        self.cost = None
+        self.lag = None
+        return True
+
+    def describe(self):
+        return {
+            'fps': round(self.fps, 1),
+            'lag_ms': round((self.lag or 0.0) * 1000),
+            'quality_level': self.level,
+            'inference_stride': self.stride,
+        }
@@ -0,0 +1,221 @@
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from metrics import ALERTS_DROPPED, ALERTS_SENT
+
+logger = logging.getLogger(__name__)
+
+# =====================
+# Asynchronous alert dispatch
+# =====================
+# Detections are handed to a bounded queue and delivered by one background
+# thread, so a slow SMS API never holds up inference. Detections for the same
+# recipient, stream and type are coalesced into one message per cooldown,
+# each recipient is rate limited, and failed sends are retried with backoff.
+ALERT_TRANSPORT = os.getenv('ALERT_TRANSPORT', 'twilio')  # twilio, stub
+ALERT_QUEUE_SIZE = int(os.getenv('ALERT_QUEUE_SIZE', '256'))
+ALERT_COALESCE_SECONDS = float(os.getenv('ALERT_COALESCE_SECONDS', '2'))  # wait for the rest of a burst
+ALERT_COOLDOWN = float(os.getenv('ALERT_COOLDOWN', '60'))  # seconds between messages per recipient/stream/type
+ALERT_RATE_LIMIT = int(os.getenv('ALERT_RATE_LIMIT', '10'))  # messages per recipient per window
+ALERT_RATE_WINDOW = float(os.getenv('ALERT_RATE_WINDOW', '3600'))
+ALERT_MAX_RETRIES = int(os.getenv('ALERT_MAX_RETRIES', '4'))
+ALERT_RETRY_BASE = float(os.getenv('ALERT_RETRY_BASE', '2'))  # seconds, doubled per attempt
+ALERT_RETRY_MAX = 300
+
+
+class AlertDeliveryError(RuntimeError):
+    """Raised by transports; retry=False marks errors that won't go away (bad number, auth)"""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class TwilioTransport:
+    name = 'twilio'
+
+    def __init__(self, account_sid=None, auth_token=None, from_number=None):
+        from twilio.rest import Client
+
+        self.client = Client(account_sid or os.getenv('TWILIO_ACCOUNT_SID'),
+                             auth_token or os.getenv('TWILIO_AUTH_TOKEN'))
+        self.from_number = from_number or os.getenv('TWILIO_PHONE_NUMBER')
+
+    def send(self, recipient, body):
+        try:
+            message = self.client.messages.create(body=body, from_=self.from_number, to=recipient)
+        except Exception as e:
+            status = getattr(e, 'status', None)
+            if hasattr(e, 'more_info'):
+                logger.error(f"Twilio Error Details: {e.more_info}")
+            # Client errors other than throttling fail the same way on retry
+            retry = not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+            raise AlertDeliveryError(f"Twilio API Error: {e}", retry=retry)
+        logger.info(f"Twilio response: SID: {message.sid}, Status: {message.status}")
+        return message.sid
+
+
+class StubTransport:
+    """Records messages instead of sending them; fail_next makes the next sends raise"""
+    name = 'stub'
+
+    def __init__(self):
+        self.sent = []
+        self.fail_next = 0
+        self._lock = threading.Lock()
+
+    def send(self, recipient, body):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise AlertDeliveryError("Stub transport failure")
+            self.sent.append({'to': recipient, 'body': body, 'time': time.time()})
+            logger.info(f"Stub alert to {recipient}: {body}")
+            return f"stub-{len(self.sent)}"
+
+
+def create_transport(name=ALERT_TRANSPORT):
+    if name == 'twilio':
+        return TwilioTransport()
+    if name == 'stub':
+        return StubTransport()
+    raise RuntimeError(f"Unknown alert transport: {name}")
+
+
+class Alert:
+    """Detections of one type on one stream, waiting to go to one recipient"""
+
+    def __init__(self, recipient, detection_type, stream_id, filename, confidence, now):
+        self.recipient = recipient
+        self.detection_type = detection_type
+        self.stream_id = stream_id
+        self.filename = filename
+        self.confidence = confidence
+        self.count = 1
+        self.first_seen = now
+        self.last_seen = now
+        self.attempts = 0
+        self.due = now
+
+    @property
+    def key(self):
+        return (self.recipient, self.stream_id, self.detection_type)
+
+    def merge(self, confidence, now):
+        self.count += 1
+        self.confidence = max(self.confidence, confidence)
+        self.last_seen = now
+
+    def body(self):
+        lines = ["🚨 SECURITY ALERT 🚨",
+                 f"Type: {self.detection_type.upper()}",
+                 f"Time: {datetime.fromtimestamp(self.first_seen).strftime('%Y-%m-%d %H:%M:%S')}"]
+        if self.stream_id:
+            lines.append(f"Stream: {self.stream_id}")
+        if self.filename:
+            lines.append(f"File: {self.filename}")
+        if self.count > 1:
+            lines.append(f"Detections: {self.count} until "
+                         f"{datetime.fromtimestamp(self.last_seen).strftime('%H:%M:%S')}")
+        return '\n'.join(lines)
+
+
+class AlertDispatcher:
+    """Bounded alert queue drained by a single delivery thread.
+
+    submit() never blocks: it returns False if the queue is full. The first
+    detection for a recipient/stream/type goes out after the coalescing delay;
+    anything after that is folded into one follow-up once the cooldown ends.
+    """
+
+    def __init__(self, transport=None, queue_size=ALERT_QUEUE_SIZE, coalesce_seconds=ALERT_COALESCE_SECONDS,
+                 cooldown=ALERT_COOLDOWN, rate_limit=ALERT_RATE_LIMIT, rate_window=ALERT_RATE_WINDOW,
+                 max_retries=ALERT_MAX_RETRIES, retry_base=ALERT_RETRY_BASE):
+        self.transport = transport or create_transport()
+        self.coalesce_seconds = coalesce_seconds
+        self.cooldown = cooldown
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = {}
+        self._last_sent = {}
+        self._recent = {}
+        self._worker = threading.Thread(target=self._work, name='alert-dispatcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, recipient, detection_type, confidence, stream_id=None, filename=None):
+        if not recipient:
+            logger.warning("No phone number provided for alert")
+            return False
+        try:
+            self._queue.put_nowait((recipient, detection_type, float(confidence), stream_id, filename, time.time()))
+        except queue.Full:
+            ALERTS_DROPPED.inc(reason='queue_full')
+            logger.warning(f"Alert queue full, dropped {detection_type} alert for {stream_id or filename}")
+            return False
+        return True
+
+    def pending(self):
+        return len(self._pending) + self._queue.qsize()
+
+    def _work(self):
+        while True:
+            now = time.time()
+            next_due = min((alert.due for alert in self._pending.values()), default=now + 1)
+            try:
+                self._add(*self._queue.get(timeout=min(1.0, max(0.0, next_due - now))))
+            except queue.Empty:
+                pass
+            now = time.time()
+            for alert in [alert for alert in self._pending.values() if alert.due <= now]:
+                self._deliver(alert, now)
+
+    def _add(self, recipient, detection_type, confidence, stream_id, filename, now):
+        key = (recipient, stream_id, detection_type)
+        alert = self._pending.get(key)
+        if alert is not None:
+            alert.merge(confidence, now)
+            return
+        alert = Alert(recipient, detection_type, stream_id, filename, confidence, now)
+        alert.due = max(now + self.coalesce_seconds, self._last_sent.get(key, 0) + self.cooldown)
+        self._pending[key] = alert
+
+    def _deliver(self, alert, now):
+        recent = self._recent.setdefault(alert.recipient, deque())
+        while recent and recent[0] <= now - self.rate_window:
+            recent.popleft()
+        if len(recent) >= self.rate_limit:
+            alert.due = recent[0] + self.rate_window
+            return
+
+        alert.attempts += 1
+        try:
+            logger.info(f"Attempting to send alert to {alert.recipient}")
+            self.transport.send(alert.recipient, alert.body())
+        except Exception as e:
+            retry = getattr(e, 'retry', True)
+            if not retry or alert.attempts > self.max_retries:
+                del self._pending[alert.key]
+                ALERTS_DROPPED.inc(reason='delivery_failed')
+                logger.error(f"Giving up on {alert.detection_type} alert to {alert.recipient}: {e}")
+            else:
+                backoff = min(ALERT_RETRY_MAX, self.retry_base * 2 ** (alert.attempts - 1))
+                alert.due = now + backoff * random.uniform(0.5, 1.5)
+                logger.warning(f"Alert delivery failed (attempt {alert.attempts}), retrying: {e}")
+            return
+
+        del self._pending[alert.key]
+        self._last_sent[alert.key] = now
+        recent.append(now)
+        if len(self._last_sent) > 1024:
+            self._last_sent = {key: sent for key, sent in self._last_sent.items()
+                               if sent > now - self.cooldown}
+        ALERTS_SENT.inc(type=alert.detection_type)
@@ -0,0 +1,288 @@
+import importlib
+import os
+import time
+
+import numpy as np
+
+# =====================
+# Inference backends
+# =====================
+# Violence backends expose encode(frames) -> embeddings and head(windows) ->
+# class probabilities when the model is split into a per-frame encoder and a
+# temporal head (split == True), and predict_sequence(sequences) otherwise.
+# Weapon backends expose predict(rgb_frames) -> [(xyxy, conf, cls), ...] with
+# one tuple of numpy arrays per frame.
+VIOLENCE_BACKEND = os.getenv('VIOLENCE_BACKEND', 'keras')  # keras, onnx, openvino, stub, remote
+WEAPON_BACKEND = os.getenv('WEAPON_BACKEND', 'pt')  # pt, onnx, openvino, stub, remote
+EXPORT_FOLDER = os.getenv('EXPORT_FOLDER', 'exported')
+QUANTIZED = os.getenv('INFERENCE_QUANTIZED', '0') == '1'  # use the INT8 exports
+ORT_THREADS = int(os.getenv('ORT_THREADS', '0'))  # 0 lets ONNX Runtime decide
+SPLIT_TOLERANCE = 1e-4
+# Simulated cost of the stub backends: per model call and per frame
+STUB_CALL_MS = float(os.getenv('STUB_CALL_MS', '0'))
+STUB_FRAME_MS = float(os.getenv('STUB_FRAME_MS', '0'))
+
+# Packages each backend needs beyond requirements.txt, and where they are pinned
+BACKEND_PACKAGES = {
+    'keras': ('tensorflow', 'requirements-export.txt'),
+    'onnx': ('onnxruntime', 'requirements-backends.txt'),
+    'openvino': ('openvino', 'requirements-backends.txt'),
+}
+
+VIOLENCE_ENCODER_ONNX = 'violence_encoder'
+VIOLENCE_HEAD_ONNX = 'violence_head'
+VIOLENCE_FULL_ONNX = 'violence_full'
+
+
+def import_backend_package(backend, module=None):
+    """Import the package a backend runs on, naming it (and how to install it) if it's missing"""
+    package, requirements = BACKEND_PACKAGES[backend]
+    try:
+        return importlib.import_module(module or package)
+    except ImportError as e:
+        raise RuntimeError(f"The {backend} backend needs the {package} package, which is not installed "
+                           f"(pip install -r {requirements}): {e}")
+
+
+def export_path(name, quantized=False, folder=None):
+    suffix = '_int8' if quantized else ''
+    return os.path.join(folder or EXPORT_FOLDER, f"{name}{suffix}.onnx")
+
+
+def split_violence_model(model, sequence_length, img_size):
+    # Leading TimeDistributed layers form the per-frame encoder, the rest is the
+    # temporal head. Returns (None, None) if the model doesn't split cleanly or
+    # the split path doesn't reproduce the full model's output.
+    import tensorflow as tf
+
+    layers = [layer for layer in model.layers
+              if not isinstance(layer, tf.keras.layers.InputLayer)]
+    frame_layers = []
+    for layer in layers:
+        if not isinstance(layer, tf.keras.layers.TimeDistributed):
+            break
+        frame_layers.append(layer.layer)
+    if not frame_layers or len(frame_layers) == len(layers):
+        return None, None
+
+    try:
+        frame_input = tf.keras.Input(shape=model.input_shape[2:])
+        x = frame_input
+        for layer in frame_layers:
+            x = layer(x)
+        encoder = tf.keras.Model(frame_input, x)
+
+        head_input = tf.keras.Input(shape=(sequence_length,) + tuple(encoder.output_shape[1:]))
+        x = head_input
+        for layer in layers[len(frame_layers):]:
+            x = layer(x)
+        head = tf.keras.Model(head_input, x)
+
+        rng = np.random.default_rng(0)
+        sample = rng.random((1, sequence_length, img_size, img_size, 3), dtype=np.float32)
+        expected = model.predict(sample, verbose=0)
+        embeddings = encoder(sample[0], training=False).numpy()
+        actual = head(embeddings[np.newaxis], training=False).numpy()
+    except Exception:
+        return None, None
+
+    if not np.allclose(expected, actual, atol=SPLIT_TOLERANCE):
+        return None, None
+    return encoder, head
+
+
+class KerasViolenceBackend:
+    name = 'keras'
+
+    def __init__(self, model_path, sequence_length, img_size):
+        tf = import_backend_package('keras')
+
+        self.model = tf.keras.models.load_model(model_path)
+        self.encoder, self.head_model = split_violence_model(self.model, sequence_length, img_size)
+
+    @property
+    def split(self):
+        return self.encoder is not None
+
+    def encode(self, inputs):
+        return self.encoder(inputs, training=False).numpy()
+
+    def head(self, windows):
+        return self.head_model(windows, training=False).numpy()
+
+    def predict_sequence(self, sequences):
+        return self.model.predict(sequences, verbose=0)
+
+
+class OnnxViolenceBackend:
+    """Exported encoder/head (or full model) run with ONNX Runtime on CPU"""
+    name = 'onnx'
+
+    def __init__(self, folder=None, quantized=QUANTIZED):
+        ort = import_backend_package('onnx')
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ORT_THREADS:
+            options.intra_op_num_threads = ORT_THREADS
+        providers = ['CPUExecutionProvider']
+
+        def session(name):
+            path = export_path(name, quantized, folder)
+            return ort.InferenceSession(path, options, providers=providers) if os.path.exists(path) else None
+
+        self.encoder = session(VIOLENCE_ENCODER_ONNX)
+        self.head_model = session(VIOLENCE_HEAD_ONNX)
+        self.model = None if self.split else session(VIOLENCE_FULL_ONNX)
+        if not self.split and self.model is None:
+            raise RuntimeError(f"No exported violence model in {folder or EXPORT_FOLDER}")
+
+    @property
+    def split(self):
+        return self.encoder is not None and self.head_model is not None
+
+    @staticmethod
+    def _run(session, inputs):
+        return session.run(None, {session.get_inputs()[0].name: np.ascontiguousarray(inputs, np.float32)})[0]
+
+    def encode(self, inputs):
+        return self._run(self.encoder, inputs)
+
+    def head(self, windows):
+        return self._run(self.head_model, windows)
+
+    def predict_sequence(self, sequences):
+        return self._run(self.model, sequences)
+
+
+class OpenVinoViolenceBackend(OnnxViolenceBackend):
+    """Same exported ONNX files, compiled for CPU with OpenVINO"""
+    name = 'openvino'
+
+    def __init__(self, folder=None, quantized=QUANTIZED):
+        ov = import_backend_package('openvino')
+
+        core = ov.Core()
+
+        def compiled(name):
+            path = export_path(name, quantized, folder)
+            return core.compile_model(path, 'CPU') if os.path.exists(path) else None
+
+        self.encoder = compiled(VIOLENCE_ENCODER_ONNX)
+        self.head_model = compiled(VIOLENCE_HEAD_ONNX)
+        self.model = None if self.split else compiled(VIOLENCE_FULL_ONNX)
+        if not self.split and self.model is None:
+            raise RuntimeError(f"No exported violence model in {folder or EXPORT_FOLDER}")
+
+    @staticmethod
+    def _run(model, inputs):
+        return model([np.ascontiguousarray(inputs, np.float32)])[model.output(0)]
+
+
+class UltralyticsWeaponBackend:
+    """YOLO through ultralytics; the weights path picks the runtime (.pt, .onnx, _openvino_model/)"""
+
+    def __init__(self, weights):
+        from ultralytics import YOLO
+
+        self.weights = weights
+        self.name = os.path.basename(os.path.normpath(weights))
+        self.model = YOLO(weights, task='detect')
+
+    def predict(self, rgb_frames):
+        results = self.model(list(rgb_frames), verbose=False)
+        return [(result.boxes.xyxy.cpu().numpy(),
+                 result.boxes.conf.cpu().numpy(),
+                 result.boxes.cls.cpu().numpy()) for result in results]
+
+
+def _stub_cost(frames):
+    delay = (STUB_CALL_MS + STUB_FRAME_MS * frames) / 1000
+    if delay > 0:
+        time.sleep(delay)
+
+
+class StubViolenceBackend:
+    """Deterministic stand-in that needs no weights, for benchmarks and CI.
+
+    Embeddings are coarse 8x8 colour grids; the head scores a window as a
+    fight in proportion to how much the grid changes between frames.
+    """
+    name = 'stub'
+    split = True
+
+    def encode(self, inputs):
+        inputs = np.asarray(inputs, np.float32)
+        _stub_cost(len(inputs))
+        n, height, width, channels = inputs.shape
+        grid = inputs[:, :height // 8 * 8, :width // 8 * 8]
+        grid = grid.reshape(n, 8, height // 8, 8, width // 8, channels).mean(axis=(2, 4))
+        return grid.reshape(n, -1)
+
+    def head(self, windows):
+        windows = np.asarray(windows, np.float32)
+        _stub_cost(len(windows))
+        change = np.abs(np.diff(windows, axis=1)).mean(axis=(1, 2))
+        fight = np.clip(change * 20, 0, 1)
+        return np.stack([fight, 1 - fight], axis=1)
+
+    def predict_sequence(self, sequences):
+        return self.head(np.stack([self.encode(sequence) for sequence in sequences]))
+
+
+class StubWeaponBackend:
+    """Deterministic stand-in that reports saturated red regions as weapons"""
+    name = 'stub'
+
+    def predict(self, rgb_frames):
+        _stub_cost(len(rgb_frames))
+        results = []
+        for frame in rgb_frames:
+            sample = frame[::8, ::8]
+            mask = (sample[..., 0] > 200) & (sample[..., 1] < 80) & (sample[..., 2] < 80)
+            ys, xs = np.nonzero(mask)
+            if len(xs):
+                xyxy = np.array([[xs.min() * 8, ys.min() * 8, xs.max() * 8 + 8, ys.max() * 8 + 8]], np.float32)
+                results.append((xyxy, np.array([0.9], np.float32), np.array([1.0], np.float32)))
+            else:
+                results.append((np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.float32)))
+        return results
+
+
+def weapon_weights_path(model_path, backend=WEAPON_BACKEND, quantized=QUANTIZED, folder=None):
+    """Where export_models.py puts each YOLO format"""
+    if backend == 'pt':
+        return model_path
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    folder = folder or EXPORT_FOLDER
+    if backend == 'onnx':
+        return os.path.join(folder, f"{stem}{'_int8' if quantized else ''}.onnx")
+    if backend == 'openvino':
+        return os.path.join(folder, f"{stem}{'_int8' if quantized else ''}_openvino_model")
+    raise RuntimeError(f"Unknown weapon backend: {backend}")
+
+
+def create_violence_backend(model_path, sequence_length, img_size, backend=VIOLENCE_BACKEND,
+                            quantized=QUANTIZED):
+    if backend == 'keras':
+        return KerasViolenceBackend(model_path, sequence_length, img_size)
+    if backend == 'onnx':
+        return OnnxViolenceBackend(quantized=quantized)
+    if backend == 'openvino':
+        return OpenVinoViolenceBackend(quantized=quantized)
+    if backend == 'stub':
+        return StubViolenceBackend()
+    if backend == 'remote':
+        # Served by inference_server.py; no weights are loaded in this process
+        from inference_server import RemoteViolenceBackend
+        return RemoteViolenceBackend()
+    raise RuntimeError(f"Unknown violence backend: {backend}")
+
+
+def create_weapon_backend(model_path, backend=WEAPON_BACKEND, quantized=QUANTIZED):
+    if backend == 'stub':
+        return StubWeaponBackend()
+    if backend == 'remote':
+        from inference_server import RemoteWeaponBackend
+        return RemoteWeaponBackend()
+    return UltralyticsWeaponBackend(weapon_weights_path(model_path, backend, quantized))
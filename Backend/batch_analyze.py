@@ -0,0 +1,200 @@
+"""Run detection over video archives without the web server.
+
+Usage: python batch_analyze.py INPUT [INPUT ...] [--workers 4] [--output-dir annotated]
+                               [--skip-annotation] [--report-dir batch_report] [--detail]
+
+INPUT is a video file, a directory (searched recursively) or a glob pattern.
+Without --output-dir (or with --skip-encode) only detection runs: no frames
+are annotated or encoded. Every finished file is appended to
+REPORT_DIR/manifest.jsonl, and files already in the manifest with the same
+size and modification time are skipped, so an interrupted run picks up where
+it stopped. REPORT_DIR/report.json and report.csv cover every file in the
+manifest. Throughput is reported as hours of video per hour of wall time.
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from chunked import _init_worker
+from main import run_detection
+from video_io import open_video_reader
+
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv'}
+MANIFEST_NAME = 'manifest.jsonl'
+CSV_FIELDS = ('file', 'type', 'start_time', 'end_time', 'start_frame', 'end_frame', 'confidence',
+              'detections', 'track_id')
+
+
+def find_videos(inputs):
+    """Video files named by paths, directories and globs, each once, in sorted order"""
+    found = set()
+    for pattern in inputs:
+        paths = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    found.update(os.path.join(root, name) for name in files
+                                 if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS)
+            elif os.path.isfile(path) and os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+                found.add(path)
+    return sorted(os.path.abspath(path) for path in found)
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return {'file': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def load_manifest(path):
+    """Completed entries by file; a later line for the same file wins"""
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by an interrupted run
+            entries[entry['file']] = entry
+    return entries
+
+
+def is_done(entry, key):
+    return (entry is not None and entry.get('status') == 'completed'
+            and entry['size'] == key['size'] and entry['mtime_ns'] == key['mtime_ns'])
+
+
+def output_paths(path, args):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    # The path hash keeps same-named files from different folders apart
+    tag = f"{stem}_{hashlib.sha1(os.path.dirname(path).encode()).hexdigest()[:8]}"
+    output_path = os.path.join(args.output_dir, f"{tag}.mp4") if args.output_dir and not args.skip_encode else None
+    detail_path = os.path.join(args.report_dir, 'detail', f"{tag}.ndjson") if args.detail else None
+    return output_path, detail_path
+
+
+def analyze(path, output_path, detail_path, annotate, reader):
+    """Runs in a worker process; returns the manifest entry for one file"""
+    entry = file_key(path)
+    started = time.time()
+    try:
+        cap = open_video_reader(path, reader)
+        if not cap.isOpened():
+            raise RuntimeError("Could not open video file")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        cap.release()
+        stats = {}
+        incidents = run_detection(path, output_path, stats=stats, detail_path=detail_path,
+                                  reader=reader, annotate=annotate)
+        entry.update(status='completed', incidents=incidents, frame_stats=stats,
+                     duration=stats['frames_total'] / fps if fps else 0.0,
+                     output=output_path, detail=detail_path)
+    except Exception as e:
+        entry.update(status='failed', error=str(e))
+    entry['elapsed'] = time.time() - started
+    return entry
+
+
+def write_reports(entries, report_dir, this_run):
+    """report.json with a summary and every file, report.csv with one row per incident"""
+    completed = [entry for entry in entries if entry['status'] == 'completed']
+    summary = {
+        'files': len(entries),
+        'completed': len(completed),
+        'failed': len(entries) - len(completed),
+        'incidents': sum(len(entry['incidents']) for entry in completed),
+        'video_hours': round(sum(entry['duration'] for entry in completed) / 3600, 3),
+        # Files skipped through the manifest don't count toward throughput
+        'this_run': this_run,
+    }
+    with open(os.path.join(report_dir, 'report.json'), 'w') as f:
+        json.dump({'summary': summary, 'files': entries}, f, indent=2, default=float)
+    with open(os.path.join(report_dir, 'report.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for entry in completed:
+            for incident in entry['incidents']:
+                writer.writerow(dict(incident, file=entry['file']))
+    return summary
+
+
+def run(args):
+    os.makedirs(args.report_dir, exist_ok=True)
+    if args.output_dir and not args.skip_encode:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if args.detail:
+        os.makedirs(os.path.join(args.report_dir, 'detail'), exist_ok=True)
+    manifest_path = os.path.join(args.report_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    videos = find_videos(args.inputs)
+    todo = [path for path in videos if not is_done(manifest.get(path), file_key(path))]
+    print(f"{len(videos)} videos, {len(videos) - len(todo)} already done, {len(todo)} to process")
+
+    started = time.time()
+    video_seconds = 0.0
+    workers = max(1, min(args.workers, len(todo) or 1))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # spawn: TensorFlow and PyTorch are not fork-safe
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(threads,)) as pool, \
+            open(manifest_path, 'a') as manifest_file:
+        futures = {pool.submit(analyze, path, *output_paths(path, args), not args.skip_annotation, args.reader): path
+                   for path in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = future.result()
+            manifest[entry['file']] = entry
+            manifest_file.write(json.dumps(entry, default=float) + '\n')
+            manifest_file.flush()
+            if entry['status'] == 'completed':
+                video_seconds += entry['duration']
+                result = f"{len(entry['incidents'])} incidents"
+            else:
+                result = f"failed: {entry['error']}"
+            wall = time.time() - started
+            print(f"[{done}/{len(todo)}] {entry['file']}: {result} "
+                  f"({video_seconds / wall:.1f} h video/h)", flush=True)
+
+    wall_seconds = time.time() - started
+    this_run = {
+        'files': len(todo),
+        'workers': workers,
+        'video_hours': round(video_seconds / 3600, 3),
+        'wall_hours': round(wall_seconds / 3600, 3),
+        'video_hours_per_hour': round(video_seconds / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+    }
+    summary = write_reports([manifest[path] for path in videos if path in manifest], args.report_dir, this_run)
+    print(f"Processed {this_run['video_hours']:.2f} h of video in {this_run['wall_hours']:.2f} h: "
+          f"{this_run['video_hours_per_hour']} hours of video per hour ({workers} workers)")
+    print(f"Reports: {os.path.join(args.report_dir, 'report.json')}, {os.path.join(args.report_dir, 'report.csv')}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('inputs', nargs='+', help='video files, directories or glob patterns')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help='worker processes, each with its own copy of the models')
+    parser.add_argument('--output-dir', help='write annotated videos here (default: detection only)')
+    parser.add_argument('--skip-encode', action='store_true', help='detection only, even with --output-dir')
+    parser.add_argument('--skip-annotation', action='store_true', help='encode frames without boxes and labels')
+    parser.add_argument('--report-dir', default='batch_report', help='manifest and reports (default: batch_report)')
+    parser.add_argument('--detail', action='store_true', help='also write per-frame detections as NDJSON')
+    parser.add_argument('--reader', choices=('opencv', 'ffmpeg'),
+                        help='frame reader (default: VIDEO_READER); ffmpeg honours DECODE_MAX_WIDTH/DECODE_FPS')
+    summary = run(parser.parse_args())
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
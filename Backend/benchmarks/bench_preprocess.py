@@ -0,0 +1,73 @@
+"""Per-frame preprocessing cost: legacy live path against FramePreprocessor.
+
+Usage: python benchmarks/bench_preprocess.py [--width 1280 --height 720 --frames 300]
+Needs no model weights.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import FramePreprocessor  # noqa: E402
+
+IMG_SIZE = 224
+
+
+def legacy(frame):
+    # What detection_loop/handle_video_frame used to do per frame
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    frame_violence = (cv2.resize(frame_rgb, (640, 640)) / 255.0).astype(np.float32)
+    frame_weapon = cv2.resize(frame, (640, 640))
+    violence_input = cv2.resize(frame_violence, (IMG_SIZE, IMG_SIZE)).astype('float32') / 255.0
+    weapon_input = cv2.cvtColor(frame_weapon, cv2.COLOR_BGR2RGB)
+    return violence_input, weapon_input
+
+
+def measure(fn, frames):
+    fn(frames[0])
+    start = time.perf_counter()
+    for frame in frames:
+        fn(frame)
+    per_frame_ms = (time.perf_counter() - start) * 1000 / len(frames)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    snapshot_start = tracemalloc.take_snapshot()
+    for frame in frames:
+        fn(frame)
+    snapshot_end = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in snapshot_end.compare_to(snapshot_start, 'filename')
+                    if stat.size_diff > 0)
+    return per_frame_ms, peak, allocated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+              for _ in range(min(args.frames, 16))]
+    frames = (frames * (args.frames // len(frames) + 1))[:args.frames]
+    preprocessor = FramePreprocessor(IMG_SIZE)
+
+    print(f"{args.frames} frames at {args.width}x{args.height}")
+    print(f"{'path':>14} {'ms/frame':>10} {'peak MB':>9} {'retained KB':>12}")
+    for name, fn in (('legacy', legacy), ('preallocated', preprocessor.prepare)):
+        per_frame_ms, peak, allocated = measure(fn, frames)
+        print(f"{name:>14} {per_frame_ms:>10.3f} {peak / 1e6:>9.2f} {allocated / 1e3:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
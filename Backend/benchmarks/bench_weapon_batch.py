@@ -0,0 +1,65 @@
+"""Weapon detection throughput against YOLO batch size.
+
+Usage: python benchmarks/bench_weapon_batch.py [video] [--frames N] [--sizes 1,2,4,8,16]
+Run from the Backend folder so the model weights resolve.
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from main import detect_weapons_batch  # noqa: E402
+
+DEFAULT_VIDEO = os.path.join(os.path.dirname(__file__), '..', '..', 'fight.mp4')
+
+
+def read_frames(video_path, limit):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video file: {video_path}")
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise RuntimeError("Video contains no frames")
+    return frames
+
+
+def bench(frames, batch_size, repeats):
+    # One warm-up pass so the first batch doesn't pay model setup cost
+    detect_weapons_batch(frames[:batch_size])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(frames), batch_size):
+            detect_weapons_batch(frames[i:i + batch_size])
+    elapsed = time.perf_counter() - start
+    return len(frames) * repeats / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('video', nargs='?', default=DEFAULT_VIDEO)
+    parser.add_argument('--frames', type=int, default=64)
+    parser.add_argument('--sizes', default='1,2,4,8,16')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames)
+    print(f"{len(frames)} frames from {args.video}")
+    print(f"{'batch':>6} {'fps':>10} {'speedup':>8}")
+    baseline = None
+    for batch_size in (int(size) for size in args.sizes.split(',')):
+        fps = bench(frames, batch_size, args.repeats)
+        baseline = baseline or fps
+        print(f"{batch_size:>6} {fps:>10.2f} {fps / baseline:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+"""Reproducible performance benchmarks for the detection pipeline.
+
+Usage: python benchmarks/run_benchmarks.py [--stub] [--output results.json]
+                                           [--compare baseline.json] [--trace-allocations]
+
+Benchmarks run_detection, detect_violence, detect_weapons and the live
+StreamManager path (what detection_loop drives) on the bundled fight.mp4 and
+on generated synthetic clips of several resolutions and lengths. Each
+scenario runs in a fresh process and reports per-stage latency percentiles,
+end-to-end fps and peak RSS, plus traced allocations with --trace-allocations.
+
+--stub swaps both models for the deterministic stub backends, so the suite
+runs offline and in CI without the .h5/.pt weights. STUB_CALL_MS and
+STUB_FRAME_MS simulate model cost.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+FIGHT_VIDEO = os.path.join(REPO_DIR, 'fight.mp4')
+DEFAULT_SYNTHETIC = '640x360x10,1280x720x10,1920x1080x5'
+SYNTHETIC_FPS = 25
+REGRESSION_THRESHOLD = 0.10
+
+
+# =====================
+# Synthetic input
+# =====================
+def make_synthetic_video(path, width, height, seconds, fps=SYNTHETIC_FPS, seed=0):
+    """Moving block for the first half, a red 'weapon' in the middle third, static tail"""
+    rng = np.random.default_rng(seed)
+    background = np.tile(np.linspace(40, 160, width, dtype=np.uint8), (height, 1))
+    background = np.dstack([background] * 3)
+    background = np.clip(background.astype(np.int16) + rng.integers(-8, 8, background.shape), 0, 255).astype(np.uint8)
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    total = int(seconds * fps)
+    block = max(8, height // 6)
+    for i in range(total):
+        frame = background.copy()
+        if i < total // 2:
+            x = int((width - block) * (i / max(1, total // 2 - 1)))
+            cv2.rectangle(frame, (x, height // 3), (x + block, height // 3 + block), (255, 255, 255), -1)
+        if total // 3 <= i < 2 * total // 3:
+            cv2.rectangle(frame, (width // 2, height // 2), (width // 2 + block, height // 2 + block // 2),
+                          (0, 0, 255), -1)
+        out.write(frame)
+    out.release()
+    return path
+
+
+def parse_synthetic(spec):
+    clips = []
+    for item in filter(None, spec.split(',')):
+        width, height, seconds = item.split('x')
+        clips.append((int(width), int(height), float(seconds)))
+    return clips
+
+
+# =====================
+# Measurement helpers
+# =====================
+def percentiles(samples):
+    if not samples:
+        return None
+    values = np.array(samples) * 1000
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max()),
+    }
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def wrap(self, stage, fn):
+        samples = self.samples[stage]
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        return {stage: percentiles(samples) for stage, samples in self.samples.items() if samples}
+
+
+class TimedWriter:
+    def __init__(self, writer, timer):
+        self.writer = writer
+        self.write = timer.wrap('encode', writer.write)
+
+    def release(self):
+        self.writer.release()
+
+
+def read_frames(video_path, limit):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def decode_only(video_path, timer):
+    cap = cv2.VideoCapture(video_path)
+    read = timer.wrap('decode', cap.read)
+    while read()[0]:
+        pass
+    cap.release()
+
+
+# =====================
+# Scenarios (run in a child process)
+# =====================
+def bench_run_detection(main, spec, timer):
+    import motion
+    import preprocessing
+
+    decode_only(spec['video'], timer)
+    main.infer_violence_sequence = timer.wrap('violence', main.infer_violence_sequence)
+    main.infer_weapons_batch = timer.wrap('weapons', main.infer_weapons_batch)
+    main.annotate_frame = timer.wrap('annotate', main.annotate_frame)
+    preprocessing.FramePreprocessor.prepare_batch = timer.wrap(
+        'preprocess', preprocessing.FramePreprocessor.prepare_batch)
+    motion.MotionGate.should_infer = timer.wrap('motion_gate', motion.MotionGate.should_infer)
+    open_writer = main.open_video_writer
+    main.open_video_writer = lambda *args, **kwargs: TimedWriter(open_writer(*args, **kwargs), timer)
+
+    output_dir = tempfile.mkdtemp(prefix='bench_out_')
+    try:
+        stats = {}
+        start = time.perf_counter()
+        main.run_detection(spec['video'], os.path.join(output_dir, 'out.mp4'),
+                           stats=stats, encoder=spec['encoder'])
+        wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return stats.get('frames_total', 0), wall, stats
+
+
+def bench_detect_violence(main, spec, timer):
+    frames = read_frames(spec['video'], spec['frames'])
+    state = main.ViolenceState()
+    detect = timer.wrap('detect_violence', main.detect_violence)
+    start = time.perf_counter()
+    for frame in frames:
+        detect(frame, state=state)
+    return len(frames), time.perf_counter() - start, {}
+
+
+def bench_detect_weapons(main, spec, timer):
+    frames = read_frames(spec['video'], spec['frames'])
+    detect = timer.wrap('detect_weapons', main.detect_weapons)
+    start = time.perf_counter()
+    for frame in frames:
+        detect(frame)
+    return len(frames), time.perf_counter() - start, {}
+
+
+def bench_live(main, spec, timer):
+    from frame_transport import FRAME_JPEG_QUALITY, encode_jpeg
+    from streams import StreamManager
+
+    manager = StreamManager()
+    for i in range(spec['streams']):
+        session = manager.open_stream(f"bench-{i}", spec['video'], max_fps=1000)
+        if not session.open():
+            raise RuntimeError(f"Could not open {spec['video']}")
+        session.detectors.add('bench')
+    step = timer.wrap('scheduler_step', manager.step)
+    encode = timer.wrap('jpeg_encode', encode_jpeg)
+
+    frames = 0
+    finished = set()
+    start = time.perf_counter()
+    # Streams report a read error once their file runs out
+    while frames < spec['frames'] * spec['streams'] and len(finished) < spec['streams']:
+        results = step()
+        for result in results:
+            if result['error'] is not None:
+                finished.add(result['session'].stream_id)
+                continue
+            encode(result['frame'], FRAME_JPEG_QUALITY)
+            frames += 1
+        if not results:
+            time.sleep(manager.seconds_until_due())
+    wall = time.perf_counter() - start
+    for i in range(spec['streams']):
+        manager.close_stream(f"bench-{i}")
+    return frames, wall, {'streams': spec['streams']}
+
+
+SCENARIOS = {
+    'run_detection': bench_run_detection,
+    'detect_violence': bench_detect_violence,
+    'detect_weapons': bench_detect_weapons,
+    'live': bench_live,
+}
+
+
+def run_scenario(spec):
+    if spec['stub']:
+        os.environ['VIOLENCE_BACKEND'] = 'stub'
+        os.environ['WEAPON_BACKEND'] = 'stub'
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    if spec['trace']:
+        tracemalloc.start()
+
+    import main
+
+    # Load and warm up outside the timed region
+    main.model_registry.load_all()
+    timer = StageTimer()
+    frames, wall, extra = SCENARIOS[spec['kind']](main, spec, timer)
+
+    result = {
+        'name': spec['name'],
+        'kind': spec['kind'],
+        'video': os.path.basename(spec['video']),
+        'frames': frames,
+        'wall_s': wall,
+        'fps': frames / wall if wall > 0 else 0.0,
+        'stages': timer.summary(),
+        # ru_maxrss is KB on Linux, bytes on macOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 ** 2),
+        'extra': extra,
+    }
+    if spec['trace']:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['traced_peak_mb'] = peak / 1e6
+        result['traced_current_mb'] = current / 1e6
+    return result
+
+
+# =====================
+# Driver
+# =====================
+def metadata(stub):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'stub': stub,
+        'stub_call_ms': os.getenv('STUB_CALL_MS', '0'),
+        'stub_frame_ms': os.getenv('STUB_FRAME_MS', '0'),
+    }
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {scenario['name']: scenario for scenario in json.load(f)['scenarios']}
+    regressions = []
+    print(f"\n{'scenario':<40} {'base fps':>10} {'fps':>10} {'change':>8}")
+    for scenario in results['scenarios']:
+        base = baseline.get(scenario['name'])
+        if not base or not base['fps']:
+            continue
+        change = scenario['fps'] / base['fps'] - 1
+        flag = '  REGRESSION' if change < -threshold else ''
+        print(f"{scenario['name']:<40} {base['fps']:>10.2f} {scenario['fps']:>10.2f} {change:>+7.1%}{flag}")
+        if flag:
+            regressions.append(scenario['name'])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stub', action='store_true', help="use deterministic stub models (no weights)")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--synthetic', default=DEFAULT_SYNTHETIC,
+                        help="comma-separated WIDTHxHEIGHTxSECONDS clips to generate")
+    parser.add_argument('--no-fight', action='store_true', help="skip the bundled fight.mp4")
+    parser.add_argument('--frames', type=int, default=200, help="frame cap for per-call scenarios")
+    parser.add_argument('--streams', type=int, default=4, help="concurrent streams in the live scenario")
+    parser.add_argument('--encoder', default=None, help="run_detection writer: ffmpeg or opencv")
+    parser.add_argument('--trace-allocations', action='store_true')
+    parser.add_argument('--output', help="write results as JSON")
+    parser.add_argument('--compare', help="baseline JSON to compare fps against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    encoder = args.encoder or ('ffmpeg' if shutil.which('ffmpeg') else 'opencv')
+    work_dir = tempfile.mkdtemp(prefix='bench_videos_')
+    videos = [] if args.no_fight or not os.path.exists(FIGHT_VIDEO) else [FIGHT_VIDEO]
+    for i, (width, height, seconds) in enumerate(parse_synthetic(args.synthetic)):
+        path = os.path.join(work_dir, f"synthetic_{width}x{height}_{seconds:g}s.mp4")
+        videos.append(make_synthetic_video(path, width, height, seconds, seed=i))
+
+    specs = [{
+        'name': f"{kind}:{os.path.basename(video)}",
+        'kind': kind,
+        'video': video,
+        'stub': args.stub,
+        'trace': args.trace_allocations,
+        'frames': args.frames,
+        'streams': args.streams,
+        'encoder': encoder,
+    } for kind in args.scenarios.split(',') for video in videos]
+
+    results = {'meta': metadata(args.stub), 'scenarios': []}
+    context = multiprocessing.get_context('spawn')
+    try:
+        for spec in specs:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_scenario, (spec,))
+            results['scenarios'].append(result)
+            print(f"{result['name']:<40} {result['frames']:>6} frames {result['fps']:>9.2f} fps "
+                  f"{result['peak_rss_mb']:>8.1f} MB RSS")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Check exported inference backends against the original Keras/PyTorch models.
+
+Usage: python check_parity.py --violence-backend onnx --weapon-backend onnx [--int8]
+                              [--video ../fight.mp4] [--frames 300] [--output parity.json]
+
+Runs the same preprocessed frames of a reference clip through both sets of
+models and compares violence probabilities/verdicts and weapon boxes.
+Exits with status 1 if any threshold is missed. Needs the packages in
+requirements-export.txt.
+"""
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+from backends import KerasViolenceBackend, UltralyticsWeaponBackend, create_violence_backend, create_weapon_backend
+from main import IMG_SIZE, SEQUENCE_LENGTH, VIOLENCE_MODEL_PATH, WEAPON_MODEL_PATH, classify_violence
+from preprocessing import FramePreprocessor
+
+DEFAULT_VIDEO = os.path.join('..', 'fight.mp4')
+ENCODE_CHUNK = 32
+
+
+def read_inputs(video_path, limit):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video file: {video_path}")
+    preprocessor = FramePreprocessor(IMG_SIZE)
+    violence_inputs, weapon_inputs = [], []
+    while len(violence_inputs) < limit:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        violence_input, weapon_input = preprocessor.prepare(frame)
+        violence_inputs.append(violence_input.copy())
+        weapon_inputs.append(weapon_input.copy())
+    cap.release()
+    if len(violence_inputs) < SEQUENCE_LENGTH:
+        raise RuntimeError("Reference clip is shorter than one sequence window")
+    return np.stack(violence_inputs), weapon_inputs
+
+
+def violence_probabilities(backend, inputs):
+    """Class probabilities for every full sliding window over inputs"""
+    starts = range(len(inputs) - SEQUENCE_LENGTH + 1)
+    if backend.split:
+        embeddings = np.concatenate([backend.encode(inputs[i:i + ENCODE_CHUNK])
+                                     for i in range(0, len(inputs), ENCODE_CHUNK)])
+        windows = np.stack([embeddings[i:i + SEQUENCE_LENGTH] for i in starts])
+        return np.concatenate([backend.head(windows[i:i + ENCODE_CHUNK])
+                               for i in range(0, len(windows), ENCODE_CHUNK)])
+    return np.concatenate([backend.predict_sequence(inputs[np.newaxis, i:i + SEQUENCE_LENGTH])
+                           for i in starts])
+
+
+def weapon_boxes(backend, rgb_frames):
+    boxes = []
+    for i in range(0, len(rgb_frames), ENCODE_CHUNK):
+        for xyxy, conf, cls in backend.predict(rgb_frames[i:i + ENCODE_CHUNK]):
+            keep = (cls.astype(int) == 1) & (conf > 0.5)
+            boxes.append((xyxy[keep], conf[keep]))
+    return boxes
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compare_weapons(reference, candidate, iou_threshold):
+    matched, conf_diffs = 0, []
+    reference_total = sum(len(conf) for _, conf in reference)
+    candidate_total = sum(len(conf) for _, conf in candidate)
+    for (ref_boxes, ref_conf), (cand_boxes, cand_conf) in zip(reference, candidate):
+        used = set()
+        for ref_box, ref_c in zip(ref_boxes, ref_conf):
+            scores = [(iou(ref_box, box), j) for j, box in enumerate(cand_boxes) if j not in used]
+            best = max(scores, default=(0.0, None))
+            if best[0] >= iou_threshold:
+                used.add(best[1])
+                matched += 1
+                conf_diffs.append(abs(float(ref_c) - float(cand_conf[best[1]])))
+    return {
+        'reference_boxes': reference_total,
+        'candidate_boxes': candidate_total,
+        'recall': matched / reference_total if reference_total else 1.0,
+        'precision': matched / candidate_total if candidate_total else 1.0,
+        'max_confidence_diff': max(conf_diffs, default=0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--video', default=DEFAULT_VIDEO)
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--violence-backend', default='onnx')
+    parser.add_argument('--weapon-backend', default='onnx')
+    parser.add_argument('--int8', action='store_true', help="check the INT8 exports")
+    parser.add_argument('--prob-tolerance', type=float, default=0.05,
+                        help="max absolute difference in violence probabilities")
+    parser.add_argument('--min-agreement', type=float, default=0.98,
+                        help="min fraction of windows with the same violence verdict")
+    parser.add_argument('--min-box-recall', type=float, default=0.95)
+    parser.add_argument('--min-box-precision', type=float, default=0.95)
+    parser.add_argument('--iou', type=float, default=0.5)
+    parser.add_argument('--output', help="write the report as JSON")
+    args = parser.parse_args()
+
+    violence_inputs, weapon_inputs = read_inputs(args.video, args.frames)
+
+    reference_probs = violence_probabilities(
+        KerasViolenceBackend(VIOLENCE_MODEL_PATH, SEQUENCE_LENGTH, IMG_SIZE), violence_inputs)
+    candidate_probs = violence_probabilities(
+        create_violence_backend(VIOLENCE_MODEL_PATH, SEQUENCE_LENGTH, IMG_SIZE,
+                                args.violence_backend, args.int8), violence_inputs)
+    agreement = np.mean([classify_violence(ref)[0] == classify_violence(cand)[0]
+                         for ref, cand in zip(reference_probs, candidate_probs)])
+
+    weapons = compare_weapons(
+        weapon_boxes(UltralyticsWeaponBackend(WEAPON_MODEL_PATH), weapon_inputs),
+        weapon_boxes(create_weapon_backend(WEAPON_MODEL_PATH, args.weapon_backend, args.int8), weapon_inputs),
+        args.iou)
+
+    report = {
+        'video': args.video,
+        'frames': len(violence_inputs),
+        'violence_backend': args.violence_backend,
+        'weapon_backend': args.weapon_backend,
+        'int8': args.int8,
+        'violence': {
+            'windows': len(reference_probs),
+            'max_prob_diff': float(np.max(np.abs(reference_probs - candidate_probs))),
+            'verdict_agreement': float(agreement),
+        },
+        'weapons': weapons,
+    }
+    failures = []
+    if report['violence']['max_prob_diff'] > args.prob_tolerance:
+        failures.append('violence probability difference')
+    if agreement < args.min_agreement:
+        failures.append('violence verdict agreement')
+    if weapons['recall'] < args.min_box_recall:
+        failures.append('weapon box recall')
+    if weapons['precision'] < args.min_box_precision:
+        failures.append('weapon box precision')
+    report['passed'] = not failures
+    report['failures'] = failures
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+
+import json
+
+import cv2
+
+import backends
+from incidents import INCIDENT_GAP_SECONDS, merge_incidents
+from main import SEQUENCE_LENGTH, DetectionCancelled, run_detection
+from tracking import TRACK_IOU_THRESHOLD, iou
+from video_io import concat_videos, open_video_reader, package_hls
+
+# =====================
+# Parallel chunked detection
+# =====================
+# Long videos are split into frame ranges that run through run_detection in
+# a pool of worker processes, each loading its own models. Every chunk first
+# runs the SEQUENCE_LENGTH frames before its start through the models (not
+# recorded or written) so the violence window is full at the boundary; the
+# annotated segments are then joined in order, weapon tracks that cross a
+# boundary are given one id (stitch_tracks) and the incidents merged.
+# Motion gating and the weapon detection interval depend on everything seen
+# so far, which a chunk can't know; each chunk instead runs the models and
+# full weapon detection on its first frame. Verdicts near chunk starts can
+# therefore differ from a serial run; with MOTION_GATING=0 and
+# WEAPON_DETECT_INTERVAL=1 the per-frame verdicts are the same.
+CHUNK_WORKERS = int(os.getenv('CHUNK_WORKERS', '0'))  # 0 disables chunked processing
+CHUNK_MIN_SECONDS = float(os.getenv('CHUNK_MIN_SECONDS', '60'))  # shorter chunks aren't worth a worker
+CHUNKS_PER_WORKER = 2  # a few chunks per worker evens out uneven chunk costs
+CHUNK_TRACK_IDS = 10000  # weapon track ids reserved per chunk, so unstitched ids stay unique
+
+_pool = None
+_manager = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker(threads):
+    # Split the cores between workers instead of every worker's runtimes
+    # starting one thread per core
+    for name in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    backends.ORT_THREADS = threads
+    cv2.setNumThreads(1)
+
+
+def _get_pool(workers):
+    global _pool, _manager
+    with _pool_lock:
+        if _pool is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # spawn: TensorFlow and PyTorch are not fork-safe
+            context = multiprocessing.get_context('spawn')
+            _pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                        initargs=(threads,))
+            _manager = context.Manager()
+        return _pool, _manager
+
+
+def plan_chunks(frames_total, fps, workers, min_seconds=CHUNK_MIN_SECONDS):
+    """(start, end) frame ranges; the last one runs to the end of the video"""
+    min_frames = max(SEQUENCE_LENGTH, int(min_seconds * (fps or 25)))
+    count = max(1, min(workers * CHUNKS_PER_WORKER, frames_total // min_frames))
+    size = math.ceil(frames_total / count) if frames_total else 0
+    starts = [i * size for i in range(count)]
+    return [(start, starts[i + 1] if i + 1 < count else None) for i, start in enumerate(starts)]
+
+
+def _detect_chunk(index, video_path, segment_path, detail_path, frame_range, encoder,
+                  progress_queue, cancel_event, report_incidents):
+    stats = {}
+    incidents = run_detection(
+        video_path, segment_path, stats=stats,
+        progress=lambda done, total: progress_queue.put(('progress', index, done)),
+        cancel_event=cancel_event, encoder=encoder, detail_path=detail_path,
+        frame_range=frame_range, warmup_frames=SEQUENCE_LENGTH,
+        first_track_id=index * CHUNK_TRACK_IDS + 1,
+        on_incident=(lambda event, incident: progress_queue.put(('incident', event, incident)))
+        if report_incidents else None)
+    return incidents, stats
+
+
+def stitch_tracks(chunk_incidents, boundaries, gap_seconds=INCIDENT_GAP_SECONDS):
+    """Give a weapon seen on both sides of a chunk boundary a single track id.
+
+    chunk_incidents holds each chunk's incidents (with first/last boxes) and
+    boundaries the first frame of every chunk after the first. An incident
+    ending just before a boundary and one of the same type starting within
+    gap_seconds after it are the same track if their boxes overlap. Incidents
+    are updated in place; returns each chunk's {old id: new id} map.
+    """
+    remaps = [{} for _ in chunk_incidents]
+    for i, boundary in enumerate(boundaries):
+        before = [incident for incident in chunk_incidents[i]
+                  if incident.get('track_id') is not None and 'last_coordinates' in incident]
+        after = [incident for incident in chunk_incidents[i + 1]
+                 if incident.get('track_id') is not None and incident['start_frame'] >= boundary
+                 and 'first_coordinates' in incident]
+        pairs = sorted(((iou(a['last_coordinates'], b['first_coordinates']), a['track_id'], b['track_id'])
+                        for a in before for b in after
+                        if a['type'] == b['type'] and a['end_frame'] < boundary
+                        and 0 <= b['start_time'] - a['end_time'] <= gap_seconds), reverse=True)
+        matched_before, remap = set(), remaps[i + 1]
+        for overlap, before_id, after_id in pairs:
+            if overlap < TRACK_IOU_THRESHOLD:
+                break
+            if before_id in matched_before or after_id in remap:
+                continue
+            matched_before.add(before_id)
+            remap[after_id] = before_id
+        for incident in chunk_incidents[i + 1]:
+            if incident.get('track_id') in remap:
+                incident['track_id'] = remap[incident['track_id']]
+    for incidents in chunk_incidents:
+        for incident in incidents:
+            incident.pop('first_coordinates', None)
+            incident.pop('last_coordinates', None)
+    return remaps
+
+
+def _concat_files(paths, output_path, remaps):
+    with open(output_path, 'wb') as out:
+        for path, remap in zip(paths, remaps):
+            with open(path, 'rb') as f:
+                if not remap:
+                    shutil.copyfileobj(f, out)
+                    continue
+                for line in f:
+                    record = json.loads(line)
+                    if record.get('track_id') in remap:
+                        record['track_id'] = remap[record['track_id']]
+                        line = (json.dumps(record) + '\n').encode()
+                    out.write(line)
+
+
+def run_detection_chunked(video_path, output_path, workers=None, stats=None, progress=None,
+                          cancel_event=None, encoder=None, detail_path=None, hls_dir=None,
+                          on_incident=None):
+    """Same inputs and results as main.run_detection, spread over worker processes.
+
+    on_incident events come from the chunks as they run, so an incident that
+    spans a chunk boundary is opened and closed once per chunk; the returned
+    incidents are merged.
+    """
+    workers = workers or CHUNK_WORKERS or os.cpu_count() or 1
+    # Frame counts in the units of the reader the chunks will use
+    cap = open_video_reader(video_path)
+    if not cap.isOpened():
+        raise RuntimeError("Could not open video file")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    chunks = plan_chunks(frames_total, fps, workers)
+    if len(chunks) == 1:
+        return run_detection(video_path, output_path, stats=stats, progress=progress,
+                             cancel_event=cancel_event, encoder=encoder, detail_path=detail_path,
+                             hls_dir=hls_dir, on_incident=on_incident)
+
+    pool, manager = _get_pool(workers)
+    progress_queue = manager.Queue()
+    shared_cancel = manager.Event()
+    work_dir = tempfile.mkdtemp(prefix='chunks_', dir=os.path.dirname(os.path.abspath(output_path)))
+    segment_paths = [os.path.join(work_dir, f"segment_{i:04d}.mp4") for i in range(len(chunks))]
+    detail_paths = [os.path.join(work_dir, f"detail_{i:04d}.ndjson") if detail_path else None
+                    for i in range(len(chunks))]
+    futures = [pool.submit(_detect_chunk, i, video_path, segment_paths[i], detail_paths[i], chunk, encoder,
+                           progress_queue, shared_cancel, on_incident is not None)
+               for i, chunk in enumerate(chunks)]
+    done_by_chunk = [0] * len(chunks)
+
+    try:
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+            if cancel_event is not None and cancel_event.is_set():
+                shared_cancel.set()
+            for future in finished:
+                if future.exception() is not None:
+                    shared_cancel.set()
+                    raise future.exception()
+            while True:
+                try:
+                    message = progress_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if message[0] == 'incident':
+                    on_incident(*message[1:])
+                    continue
+                _, index, done = message
+                done_by_chunk[index] = max(done_by_chunk[index], done)
+            if progress is not None:
+                progress(sum(done_by_chunk), frames_total)
+        if cancel_event is not None and cancel_event.is_set():
+            raise DetectionCancelled("Detection cancelled")
+
+        results = [future.result() for future in futures]
+        remaps = stitch_tracks([chunk_incidents for chunk_incidents, _ in results],
+                               [start for start, _ in chunks[1:]])
+        concat_videos(segment_paths, output_path, encoder)
+        if hls_dir:
+            # Segments are only playable once joined, so HLS is packaged at the end
+            package_hls(output_path, hls_dir)
+        if detail_path:
+            _concat_files(detail_paths, detail_path, remaps)
+    except BaseException:
+        shared_cancel.set()
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    incidents = merge_incidents([incident for chunk_incidents, _ in results for incident in chunk_incidents],
+                                INCIDENT_GAP_SECONDS)
+    frames_done = sum(chunk_stats['frames_total'] for _, chunk_stats in results)
+    if progress is not None:
+        progress(frames_done, frames_done)
+    if stats is not None:
+        stats['frames_total'] = frames_done
+        stats['frames_inferred'] = sum(chunk_stats['frames_inferred'] for _, chunk_stats in results)
+        stats['frames_skipped'] = sum(chunk_stats['frames_skipped'] for _, chunk_stats in results)
+        stats['chunks'] = len(chunks)
+    return incidents
@@ -0,0 +1,148 @@
+"""Export the violence and weapon models for the ONNX Runtime and OpenVINO backends.
+
+Usage: python export_models.py [--int8] [--calibration ../fight.mp4] [--output exported]
+
+Writes the files backends.py looks for: violence_encoder/violence_head (or
+violence_full) .onnx plus *_int8.onnx variants, and best.onnx /
+best_openvino_model/ plus INT8 variants for YOLO. Check accuracy with
+check_parity.py before switching VIOLENCE_BACKEND/WEAPON_BACKEND.
+Needs the packages in requirements-export.txt.
+"""
+import argparse
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+from backends import (EXPORT_FOLDER, KerasViolenceBackend, VIOLENCE_ENCODER_ONNX,
+                      VIOLENCE_FULL_ONNX, VIOLENCE_HEAD_ONNX, export_path, weapon_weights_path)
+from main import IMG_SIZE, SEQUENCE_LENGTH, VIOLENCE_MODEL_PATH, WEAPON_MODEL_PATH
+from preprocessing import FramePreprocessor
+
+ONNX_OPSET = 13
+DEFAULT_CALIBRATION_VIDEO = os.path.join('..', 'fight.mp4')
+
+
+def calibration_frames(video_path, count):
+    """Evenly spaced preprocessed frames from video_path for INT8 calibration"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open calibration video: {video_path}")
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or count
+    wanted = set(np.linspace(0, total - 1, count).astype(int))
+    preprocessor = FramePreprocessor(IMG_SIZE)
+    frames = []
+    index = 0
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index in wanted:
+            violence_input, _ = preprocessor.prepare(frame)
+            frames.append(violence_input.copy())
+        index += 1
+    cap.release()
+    return np.stack(frames)
+
+
+def to_onnx(model, path):
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name='input')]
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=ONNX_OPSET, output_path=path)
+    print(f"Wrote {path}")
+
+
+def quantize_violence(folder, frames):
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_dynamic, quantize_static)
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self, input_name):
+            self.batches = iter([{input_name: frame[np.newaxis]} for frame in frames])
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    encoder_path = export_path(VIOLENCE_ENCODER_ONNX, folder=folder)
+    if os.path.exists(encoder_path):
+        # Conv encoder: static INT8 calibrated on real frames
+        import onnxruntime as ort
+        input_name = ort.InferenceSession(encoder_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+        quantize_static(encoder_path, export_path(VIOLENCE_ENCODER_ONNX, True, folder), FrameReader(input_name),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        print(f"Wrote {export_path(VIOLENCE_ENCODER_ONNX, True, folder)}")
+
+    # LSTM/dense parts: dynamic quantization of weights
+    for name in (VIOLENCE_HEAD_ONNX, VIOLENCE_FULL_ONNX):
+        path = export_path(name, folder=folder)
+        if os.path.exists(path):
+            quantize_dynamic(path, export_path(name, True, folder), weight_type=QuantType.QInt8)
+            print(f"Wrote {export_path(name, True, folder)}")
+
+
+def export_violence(folder, int8, calibration_video, calibration_count):
+    backend = KerasViolenceBackend(VIOLENCE_MODEL_PATH, SEQUENCE_LENGTH, IMG_SIZE)
+    if backend.split:
+        to_onnx(backend.encoder, export_path(VIOLENCE_ENCODER_ONNX, folder=folder))
+        to_onnx(backend.head_model, export_path(VIOLENCE_HEAD_ONNX, folder=folder))
+    else:
+        print("Violence model does not split into encoder/head; exporting the full model")
+        to_onnx(backend.model, export_path(VIOLENCE_FULL_ONNX, folder=folder))
+    if int8:
+        quantize_violence(folder, calibration_frames(calibration_video, calibration_count))
+
+
+def _move(source, destination):
+    if os.path.isdir(destination):
+        shutil.rmtree(destination)
+    elif os.path.exists(destination):
+        os.remove(destination)
+    shutil.move(source, destination)
+    print(f"Wrote {destination}")
+
+
+def export_weapon(folder, int8, yolo_data):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from ultralytics import YOLO
+
+    model = YOLO(WEAPON_MODEL_PATH)
+    onnx_path = weapon_weights_path(WEAPON_MODEL_PATH, 'onnx', False, folder)
+    _move(model.export(format='onnx', dynamic=True, imgsz=640), onnx_path)
+    _move(model.export(format='openvino', dynamic=True, imgsz=640),
+          weapon_weights_path(WEAPON_MODEL_PATH, 'openvino', False, folder))
+
+    if int8:
+        quantize_dynamic(onnx_path, weapon_weights_path(WEAPON_MODEL_PATH, 'onnx', True, folder),
+                         weight_type=QuantType.QInt8)
+        print(f"Wrote {weapon_weights_path(WEAPON_MODEL_PATH, 'onnx', True, folder)}")
+        # OpenVINO INT8 uses NNCF post-training quantization on the given dataset
+        _move(model.export(format='openvino', int8=True, data=yolo_data, imgsz=640),
+              weapon_weights_path(WEAPON_MODEL_PATH, 'openvino', True, folder))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default=EXPORT_FOLDER)
+    parser.add_argument('--int8', action='store_true', help="also write INT8-quantized variants")
+    parser.add_argument('--calibration', default=DEFAULT_CALIBRATION_VIDEO,
+                        help="video used to calibrate INT8 activations")
+    parser.add_argument('--calibration-frames', type=int, default=128)
+    parser.add_argument('--yolo-data', default='coco8.yaml',
+                        help="ultralytics dataset yaml for OpenVINO INT8 calibration")
+    parser.add_argument('--skip-violence', action='store_true')
+    parser.add_argument('--skip-weapon', action='store_true')
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    if not args.skip_violence:
+        export_violence(args.output, args.int8, args.calibration, args.calibration_frames)
+    if not args.skip_weapon:
+        export_weapon(args.output, args.int8, args.yolo_data)
+
+
+if __name__ == '__main__':
+    main()
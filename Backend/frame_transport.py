@@ -0,0 +1,149 @@
+import base64
+import os
+import threading
+import time
+
+import cv2
+
+from metrics import FRAMES_DROPPED, STAGE_SECONDS
+
+# =====================
+# Live frame transport
+# =====================
+FRAME_TRANSPORT = os.getenv('FRAME_TRANSPORT', 'base64')  # 'base64' or 'binary'
+FRAME_JPEG_QUALITY = int(os.getenv('FRAME_JPEG_QUALITY', '80'))
+FRAME_MAX_WIDTH = int(os.getenv('FRAME_MAX_WIDTH', '0'))  # 0 keeps the source width
+FRAME_ACK_TIMEOUT = 2.0  # seconds before an unacknowledged frame is considered lost
+
+
+def encode_jpeg(frame, quality, max_width=0):
+    if max_width and frame.shape[1] > max_width:
+        height = int(frame.shape[0] * max_width / frame.shape[1])
+        frame = cv2.resize(frame, (max_width, height), interpolation=cv2.INTER_AREA)
+    with STAGE_SECONDS.time(stage='jpeg_encode'):
+        success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise RuntimeError("JPEG encoding failed")
+    return buffer.tobytes()
+
+
+def decode_frame_payload(frame_data):
+    """Client frames are either raw JPEG bytes or a base64 data URL"""
+    if isinstance(frame_data, (bytes, bytearray, memoryview)):
+        return bytes(frame_data)
+    if ',' in frame_data:
+        frame_data = frame_data.split(',', 1)[1]
+    return base64.b64decode(frame_data)
+
+
+class ClientState:
+    def __init__(self):
+        self.binary = FRAME_TRANSPORT == 'binary'
+        self.quality = FRAME_JPEG_QUALITY
+        self.max_width = FRAME_MAX_WIDTH
+        # Clients that acknowledge frames get backpressure; others get every frame
+        self.ack = False
+        # Per channel (event, stream_id): when the frame in flight was sent, and the pending frame
+        self.in_flight_since = {}
+        self.pending = {}
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+
+class FrameSender:
+    """Per-client JPEG frame delivery with latest-frame-wins backpressure.
+
+    Clients that opt in with ack=True have at most one frame in flight per
+    channel (event and stream), so a stream the client never acks doesn't hold
+    up the others. Frames produced while one is in flight replace each other
+    in a single pending slot, so a slow client only ever receives the newest
+    frame. Metadata such as detection_data should be sent separately with a
+    plain emit. A quality passed to send() caps the client's JPEG quality for
+    that frame.
+    """
+
+    def __init__(self, socketio):
+        self.socketio = socketio
+        self.clients = {}
+        self._lock = threading.Lock()
+
+    def _state(self, sid):
+        state = self.clients.get(sid)
+        if state is None:
+            state = self.clients[sid] = ClientState()
+        return state
+
+    def configure(self, sid, settings):
+        with self._lock:
+            state = self._state(sid)
+            if 'binary' in settings:
+                state.binary = bool(settings['binary'])
+            if 'quality' in settings:
+                state.quality = min(100, max(10, int(settings['quality'])))
+            if 'max_width' in settings:
+                state.max_width = max(0, int(settings['max_width']))
+            if 'ack' in settings:
+                state.ack = bool(settings['ack'])
+            return self.describe(state)
+
+    @staticmethod
+    def describe(state):
+        return {
+            'binary': state.binary,
+            'quality': state.quality,
+            'max_width': state.max_width,
+            'ack': state.ack,
+            'frames_sent': state.frames_sent,
+            'frames_dropped': state.frames_dropped,
+        }
+
+    def remove(self, sid):
+        with self._lock:
+            self.clients.pop(sid, None)
+
+    def send(self, sid, event, frame, meta=None, quality=None):
+        """Queue frame for sid; returns False if it replaced a stale pending frame"""
+        channel = (event, (meta or {}).get('stream_id'))
+        with self._lock:
+            state = self._state(sid)
+            sent_at = state.in_flight_since.get(channel)
+            in_flight = sent_at is not None and time.time() - sent_at < FRAME_ACK_TIMEOUT
+            if state.ack and in_flight:
+                dropped = state.pending.get(channel) is not None
+                if dropped:
+                    state.frames_dropped += 1
+                    FRAMES_DROPPED.inc(reason='backpressure')
+                state.pending[channel] = (event, frame, meta, quality)
+                return not dropped
+            if state.ack:
+                # Nothing in flight (or the last ack timed out): send now
+                if state.pending.pop(channel, None) is not None:
+                    state.frames_dropped += 1
+                    FRAMES_DROPPED.inc(reason='backpressure')
+                state.in_flight_since[channel] = time.time()
+        self._emit(sid, state, channel, event, frame, meta, quality)
+        return True
+
+    def _emit(self, sid, state, channel, event, frame, meta, quality=None):
+        data = encode_jpeg(frame, min(state.quality, quality or state.quality), state.max_width)
+        payload = dict(meta or {})
+        payload['frame'] = data if state.binary else base64.b64encode(data).decode('utf-8')
+        payload['format'] = 'jpeg' if state.binary else 'jpeg-base64'
+        state.frames_sent += 1
+        if state.ack:
+            self.socketio.emit(event, payload, to=sid, callback=lambda *args: self._acked(sid, channel))
+        else:
+            self.socketio.emit(event, payload, to=sid)
+
+    def _acked(self, sid, channel):
+        with self._lock:
+            state = self.clients.get(sid)
+            if state is None:
+                return
+            pending = state.pending.pop(channel, None)
+            if pending:
+                state.in_flight_since[channel] = time.time()
+            else:
+                state.in_flight_since.pop(channel, None)
+        if pending:
+            self._emit(sid, state, channel, *pending)
@@ -0,0 +1,168 @@
+import heapq
+import json
+import os
+
+# =====================
+# Incident aggregation
+# =====================
+# Per-frame detections are merged online into incidents: detections of the
+# same type (and weapon track) no more than INCIDENT_GAP_SECONDS apart belong
+# to one incident. Each open incident keeps a fixed amount of state (time
+# span, peak confidence, a few highest-confidence boxes), so memory doesn't
+# grow with video length. Per-frame detail can be streamed to an NDJSON file instead.
+INCIDENT_GAP_SECONDS = float(os.getenv('INCIDENT_GAP_SECONDS', '1.0'))
+INCIDENT_MAX_BOXES = int(os.getenv('INCIDENT_MAX_BOXES', '3'))
+
+
+class Incident:
+    def __init__(self, detection_type, frame_index, frame_time, max_boxes=INCIDENT_MAX_BOXES, track_id=None):
+        self.type = detection_type
+        self.track_id = track_id
+        self.start_frame = self.end_frame = self.peak_frame = frame_index
+        self.start_time = self.end_time = frame_time
+        self.peak_confidence = 0.0
+        self.detections = 0
+        self.max_boxes = max_boxes
+        self._boxes = []  # min-heap of (confidence, frame, coordinates)
+        self.first_coordinates = self.last_coordinates = None
+
+    def add(self, frame_index, frame_time, confidence, coordinates=None):
+        self.end_frame = frame_index
+        self.end_time = frame_time
+        self.detections += 1
+        if confidence > self.peak_confidence:
+            self.peak_confidence = confidence
+            self.peak_frame = frame_index
+        if coordinates is not None:
+            if self.first_coordinates is None:
+                self.first_coordinates = tuple(coordinates)
+            self.last_coordinates = tuple(coordinates)
+            item = (confidence, frame_index, tuple(coordinates))
+            if len(self._boxes) < self.max_boxes:
+                heapq.heappush(self._boxes, item)
+            elif item > self._boxes[0]:
+                heapq.heapreplace(self._boxes, item)
+
+    def to_dict(self, edges=False):
+        # type/timestamp/frame/confidence keep the shape of the old per-frame entries.
+        # edges adds the first and last box, for stitching tracks across chunks.
+        incident = {
+            'type': self.type,
+            'timestamp': f"{self.start_time:.2f}s",
+            'frame': self.peak_frame,
+            'confidence': float(self.peak_confidence),
+            'start_time': round(float(self.start_time), 3),
+            'end_time': round(float(self.end_time), 3),
+            'start_frame': self.start_frame,
+            'end_frame': self.end_frame,
+            'detections': self.detections,
+        }
+        if self.track_id is not None:
+            incident['track_id'] = self.track_id
+        if self._boxes:
+            incident['boxes'] = [{'coordinates': list(map(int, coordinates)), 'confidence': float(confidence),
+                                  'frame': frame}
+                                 for confidence, frame, coordinates in sorted(self._boxes, reverse=True)]
+        if edges and self.first_coordinates is not None:
+            incident['first_coordinates'] = list(map(int, self.first_coordinates))
+            incident['last_coordinates'] = list(map(int, self.last_coordinates))
+        return incident
+
+
+class IncidentAggregator:
+    """Merges detections into incidents as they arrive.
+
+    add() takes the per-frame detection records from main.record_detections;
+    if detail is given (see NdjsonWriter) every record is also written to it.
+    listener(event, incident) hears about incidents as they happen: 'opened'
+    on an incident's first detection and 'closed' once it can't grow any more.
+    Call advance() for every frame, detections or not, so incidents close on
+    time, and close_all() at the end of the video.
+    """
+
+    def __init__(self, gap_seconds=INCIDENT_GAP_SECONDS, max_boxes=INCIDENT_MAX_BOXES, detail=None,
+                 listener=None, edges=False):
+        self.gap_seconds = gap_seconds
+        self.max_boxes = max_boxes
+        self.detail = detail
+        self.listener = listener
+        self.edges = edges
+        self.open = {}
+        self.closed = []
+
+    def add(self, record):
+        if self.detail is not None:
+            self.detail.write(record)
+        # Tracked weapons get an incident each
+        key = (record['type'], record.get('track_id'))
+        frame_time = record['time']
+        incident = self.open.get(key)
+        if incident is None or frame_time - incident.end_time > self.gap_seconds:
+            self._close_stale(frame_time)
+            incident = self.open[key] = Incident(record['type'], record['frame'], frame_time, self.max_boxes,
+                                                 record.get('track_id'))
+            incident.add(record['frame'], frame_time, record['confidence'], record.get('coordinates'))
+            if self.listener is not None:
+                self.listener('opened', incident.to_dict())
+            return
+        incident.add(record['frame'], frame_time, record['confidence'], record.get('coordinates'))
+
+    def advance(self, frame_time):
+        """Close the incidents that a detection at frame_time could no longer extend"""
+        self._close_stale(frame_time)
+
+    def close_all(self):
+        """No more frames: every open incident is closed"""
+        self._close_stale(float('inf'))
+
+    def _close_stale(self, frame_time):
+        for key, incident in list(self.open.items()):
+            if frame_time - incident.end_time > self.gap_seconds:
+                self.closed.append(incident.to_dict(self.edges))
+                del self.open[key]
+                if self.listener is not None:
+                    self.listener('closed', incident.to_dict())
+
+    def incidents(self):
+        """Closed and still open incidents, in start order"""
+        current = self.closed + [incident.to_dict(self.edges) for incident in self.open.values()]
+        return sorted(current, key=lambda incident: (incident['start_time'], incident['type']))
+
+
+def merge_incidents(incidents, gap_seconds=INCIDENT_GAP_SECONDS, max_boxes=INCIDENT_MAX_BOXES):
+    """Join incident lists from consecutive parts of one video (e.g. parallel chunks)"""
+    merged = []
+    open_by_type = {}
+    for incident in sorted(incidents, key=lambda incident: (incident['start_time'], incident['type'])):
+        key = (incident['type'], incident.get('track_id'))
+        current = open_by_type.get(key)
+        if current is None or incident['start_time'] - current['end_time'] > gap_seconds:
+            current = open_by_type[key] = dict(incident)
+            merged.append(current)
+            continue
+        if incident['confidence'] > current['confidence']:
+            current['confidence'] = incident['confidence']
+            current['frame'] = incident['frame']
+        if incident['end_time'] >= current['end_time']:
+            current['end_time'] = incident['end_time']
+            current['end_frame'] = incident['end_frame']
+        current['detections'] += incident['detections']
+        boxes = current.get('boxes', []) + incident.get('boxes', [])
+        if boxes:
+            current['boxes'] = sorted(boxes, key=lambda box: box['confidence'], reverse=True)[:max_boxes]
+    return merged
+
+
+class NdjsonWriter:
+    """One JSON object per line, written as records arrive"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w')
+
+    def write(self, record):
+        self._file.write(json.dumps(record, default=float))
+        self._file.write('\n')
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,408 @@
+"""Standalone inference server that owns the violence and weapon models.
+
+Usage: python inference_server.py [--address 127.0.0.1:50055] [--violence-backend keras]
+                                  [--weapon-backend pt] [--batch-window-ms 5]
+
+INFERENCE_AUTHKEY must be set, to the same secret, for the server and every
+web worker; the server listens on 127.0.0.1 unless --address says otherwise.
+Web workers started with VIOLENCE_BACKEND=remote and WEAPON_BACKEND=remote
+load no models themselves: their model calls go to this process instead, so
+any number of web workers on the node share one copy of the models. Input
+frames travel through a shared-memory block per client and only small
+request/response messages go through the manager queues. Requests that arrive
+within the batching window are run as one model call, whichever worker sent them.
+"""
+import argparse
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.managers import BaseManager
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_SERVER = os.getenv('INFERENCE_SERVER', '127.0.0.1:50055')  # host:port or a unix socket path
+INFERENCE_AUTHKEY = os.getenv('INFERENCE_AUTHKEY', '')  # required; no default
+INFERENCE_SLOTS = int(os.getenv('INFERENCE_SLOTS', '4'))  # requests a client can have in flight
+INFERENCE_SLOT_BYTES = int(os.getenv('INFERENCE_SLOT_BYTES', str(32 * 1024 * 1024)))
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', '60'))
+INFERENCE_BATCH_WINDOW = float(os.getenv('INFERENCE_BATCH_WINDOW_MS', '5')) / 1000
+INFERENCE_MAX_BATCH = int(os.getenv('INFERENCE_MAX_BATCH', '32'))  # items per model call
+ALIGNMENT = 64  # byte alignment of arrays inside a slot
+
+# Batched ops; every input is an array whose first axis is the batch
+ARRAY_OPS = ('encode', 'head', 'predict_sequence')
+
+
+def parse_address(value):
+    host, sep, port = value.rpartition(':')
+    if sep and port.isdigit() and '/' not in value:
+        return host or '127.0.0.1', int(port)
+    return value
+
+
+def require_authkey(authkey):
+    # BaseManager unpickles whatever a client sends once it passes the key
+    # check, so a known key would let anyone who reaches the address run code
+    if not authkey:
+        raise RuntimeError("INFERENCE_AUTHKEY is not set; generate a secret (e.g. "
+                           "python -c 'import secrets; print(secrets.token_hex(32))') and give the "
+                           "inference server and every web worker the same value")
+    return authkey.encode()
+
+
+class InferenceManager(BaseManager):
+    pass
+
+
+InferenceManager.register('get_requests')
+InferenceManager.register('get_responses')
+
+
+def _attach(name):
+    # The client owns the block; keep this process's resource tracker from
+    # unlinking it when we exit
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+# =====================
+# Client (web worker side)
+# =====================
+class InferenceClient:
+    """Connection to the inference server, shared by every thread of a process.
+
+    Each call takes a slot of the client's shared-memory block, copies its
+    inputs there and waits for the matching response. Batches larger than a
+    slot are sent in parts.
+    """
+
+    def __init__(self, address=INFERENCE_SERVER, authkey=INFERENCE_AUTHKEY, slots=INFERENCE_SLOTS,
+                 slot_bytes=INFERENCE_SLOT_BYTES, timeout=INFERENCE_TIMEOUT):
+        self.client_id = uuid.uuid4().hex
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self._manager = InferenceManager(address=parse_address(address), authkey=require_authkey(authkey))
+        try:
+            self._manager.connect()
+        except OSError as e:
+            raise RuntimeError(f"Inference server not reachable at {address}: {e}")
+        self._requests = self._manager.get_requests()
+        self._block = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._receiver = threading.Thread(target=self._receive, name='inference-client', daemon=True)
+        self._receiver.start()
+        atexit.register(self.close)
+        self.info = self._call('info', [])
+
+    def _receive(self):
+        # Manager proxies open a connection per thread, so this one is only read here
+        responses = self._manager.get_responses(self.client_id)
+        while not self._closed:
+            try:
+                request_id, result, error = responses.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                waiter = self._waiting.pop(request_id, None)
+            if waiter is not None:
+                waiter[1:] = [result, error]
+                waiter[0].set()
+
+    def _call(self, op, arrays):
+        try:
+            slot = self._free.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError("No free inference slot; the server stopped answering")
+        release = True
+        try:
+            offset = slot * self.slot_bytes
+            layout = []
+            for array in arrays:
+                array = np.ascontiguousarray(array)
+                if offset + array.nbytes > (slot + 1) * self.slot_bytes:
+                    raise RuntimeError(f"Inference request does not fit a {self.slot_bytes} byte slot")
+                np.ndarray(array.shape, array.dtype, self._block.buf, offset)[...] = array
+                layout.append((offset, array.shape, array.dtype.str))
+                offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+            request_id = uuid.uuid4().hex
+            waiter = [threading.Event(), None, None]
+            with self._lock:
+                self._waiting[request_id] = waiter
+            self._requests.put((self.client_id, request_id, op, self._block.name, layout))
+            if not waiter[0].wait(self.timeout):
+                with self._lock:
+                    self._waiting.pop(request_id, None)
+                # The server may still read this slot, so it is not reused
+                release = False
+                raise RuntimeError(f"Inference server did not answer {op} within {self.timeout}s")
+        finally:
+            if release:
+                self._free.put(slot)
+        _, result, error = waiter
+        if error:
+            raise RuntimeError(f"Inference server error: {error}")
+        return result
+
+    def _parts(self, items):
+        """Split items into consecutive runs that each fit in one slot"""
+        parts, current, size = [], [], 0
+        for item in items:
+            nbytes = -(-item.nbytes // ALIGNMENT) * ALIGNMENT
+            if current and size + nbytes > self.slot_bytes:
+                parts.append(current)
+                current, size = [], 0
+            current.append(item)
+            size += nbytes
+        if current:
+            parts.append(current)
+        return parts
+
+    def run_array(self, op, batch):
+        batch = np.asarray(batch, np.float32)
+        if batch.nbytes <= self.slot_bytes:
+            return self._call(op, [batch])
+        return np.concatenate([self._call(op, [np.stack(part)]) for part in self._parts(list(batch))])
+
+    def run_frames(self, op, frames):
+        results = []
+        for part in self._parts([np.asarray(frame) for frame in frames]):
+            results.extend(self._call(op, part))
+        return results
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._requests.put((self.client_id, None, 'close', self._block.name, []))
+        except Exception:
+            pass
+        self._block.close()
+        self._block.unlink()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = InferenceClient()
+        return _client
+
+
+class RemoteViolenceBackend:
+    """Violence backend interface (see backends.py) served by the inference server"""
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+        info = self.client.info['violence']
+        self.name = f"remote:{info['name']}"
+        self.split = info['split']
+
+    def encode(self, inputs):
+        return self.client.run_array('encode', inputs)
+
+    def head(self, windows):
+        return self.client.run_array('head', windows)
+
+    def predict_sequence(self, sequences):
+        return self.client.run_array('predict_sequence', sequences)
+
+
+class RemoteWeaponBackend:
+    """Weapon backend interface (see backends.py) served by the inference server"""
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+        self.name = f"remote:{self.client.info['weapon']['name']}"
+
+    def predict(self, rgb_frames):
+        return self.client.run_frames('weapons', rgb_frames)
+
+
+# =====================
+# Server
+# =====================
+class InferenceServer:
+    """Drains the request queue, batching requests for the same op across clients"""
+
+    def __init__(self, registry, batch_window=INFERENCE_BATCH_WINDOW, max_batch=INFERENCE_MAX_BATCH):
+        self.registry = registry
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.requests = queue.Queue()
+        self._responses = {}
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def responses_for(self, client_id):
+        with self._lock:
+            responses = self._responses.get(client_id)
+            if responses is None:
+                responses = self._responses[client_id] = queue.Queue()
+            return responses
+
+    def _block(self, name):
+        block = self._blocks.get(name)
+        if block is None:
+            block = self._blocks[name] = _attach(name)
+        return block
+
+    def _inputs(self, name, layout):
+        block = self._block(name)
+        return [np.ndarray(shape, np.dtype(dtype), block.buf, offset) for offset, shape, dtype in layout]
+
+    def _close_client(self, client_id, name):
+        with self._lock:
+            self._responses.pop(client_id, None)
+        block = self._blocks.pop(name, None)
+        if block is not None:
+            block.close()
+        logger.info(f"Client {client_id} disconnected")
+
+    def _respond(self, request, result=None, error=None):
+        client_id, request_id = request[0], request[1]
+        self.responses_for(client_id).put((request_id, result, error))
+
+    def _collect(self):
+        # Block for the first request, then gather whatever arrives within the window
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _groups(self, requests, sizes):
+        # Consecutive requests up to max_batch items; a larger request runs alone
+        group, count = [], 0
+        for request, size in zip(requests, sizes):
+            if group and count + size > self.max_batch:
+                yield group
+                group, count = [], 0
+            group.append(request)
+            count += size
+        if group:
+            yield group
+
+    def _info(self):
+        violence = self.registry.violence()[0]
+        weapon = self.registry.weapon()
+        return {'violence': {'name': violence.name, 'split': violence.split},
+                'weapon': {'name': weapon.name}}
+
+    def _run(self, op, requests):
+        inputs = [self._inputs(request[3], request[4]) for request in requests]
+        if op == 'weapons':
+            sizes = [len(frames) for frames in inputs]
+            results = self.registry.weapon().predict([frame for frames in inputs for frame in frames])
+        else:
+            sizes = [len(arrays[0]) for arrays in inputs]
+            backend = self.registry.violence()[0]
+            batch = inputs[0][0] if len(inputs) == 1 else np.concatenate([arrays[0] for arrays in inputs])
+            results = getattr(backend, op)(batch)
+        start = 0
+        for request, size in zip(requests, sizes):
+            self._respond(request, results[start:start + size])
+            start += size
+
+    def run(self):
+        while True:
+            by_op = {}
+            for request in self._collect():
+                op = request[2]
+                if op == 'close':
+                    self._close_client(request[0], request[3])
+                elif op == 'info':
+                    self._respond(request, self._info())
+                elif op in ARRAY_OPS or op == 'weapons':
+                    by_op.setdefault(op, []).append(request)
+                else:
+                    self._respond(request, error=f"Unknown op: {op}")
+            for op, requests in by_op.items():
+                # Items per request: frames for weapons, the leading axis of the array otherwise
+                sizes = [len(request[4]) if op == 'weapons' else request[4][0][1][0] for request in requests]
+                for group in self._groups(requests, sizes):
+                    try:
+                        self._run(op, group)
+                    except Exception as e:
+                        logger.error(f"Inference {op} failed for {len(group)} requests: {e}")
+                        for request in group:
+                            self._respond(request, error=str(e))
+
+
+def serve(address=INFERENCE_SERVER, authkey=INFERENCE_AUTHKEY, violence_backend=None, weapon_backend=None,
+          batch_window=INFERENCE_BATCH_WINDOW, max_batch=INFERENCE_MAX_BATCH):
+    # The backends are read from the environment when main is imported
+    if violence_backend:
+        os.environ['VIOLENCE_BACKEND'] = violence_backend
+    if weapon_backend:
+        os.environ['WEAPON_BACKEND'] = weapon_backend
+    if 'remote' in (os.getenv('VIOLENCE_BACKEND'), os.getenv('WEAPON_BACKEND')):
+        raise RuntimeError("The inference server needs local backends; set --violence-backend/--weapon-backend")
+    # Checked before the models load, so a misconfigured server fails at once
+    authkey = require_authkey(authkey)
+    bind = parse_address(address)
+    if isinstance(bind, tuple) and bind[0] not in ('127.0.0.1', 'localhost', '::1'):
+        logger.warning(f"Inference server reachable beyond this host at {address}; "
+                       f"anyone with INFERENCE_AUTHKEY can run code in it")
+
+    from main import model_registry
+
+    # Loads both models before listening; watches the weights if MODEL_WATCH_INTERVAL is set
+    model_registry.start('eager')
+    server = InferenceServer(model_registry, batch_window, max_batch)
+
+    class ServerManager(InferenceManager):
+        pass
+
+    ServerManager.register('get_requests', callable=lambda: server.requests)
+    ServerManager.register('get_responses', callable=server.responses_for)
+    threading.Thread(target=server.run, name='inference-server', daemon=True).start()
+    manager = ServerManager(address=bind, authkey=authkey)
+    logger.info(f"Inference server listening on {address} ({server._info()})")
+    manager.get_server().serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--address', default=INFERENCE_SERVER,
+                        help='host:port or unix socket path (default: INFERENCE_SERVER, on 127.0.0.1)')
+    parser.add_argument('--violence-backend', help='keras, onnx, openvino or stub (default: VIOLENCE_BACKEND)')
+    parser.add_argument('--weapon-backend', help='pt, onnx, openvino or stub (default: WEAPON_BACKEND)')
+    parser.add_argument('--batch-window-ms', type=float, default=INFERENCE_BATCH_WINDOW * 1000)
+    parser.add_argument('--max-batch', type=int, default=INFERENCE_MAX_BATCH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    serve(args.address, INFERENCE_AUTHKEY, args.violence_backend, args.weapon_backend,
+          args.batch_window_ms / 1000, args.max_batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import os
+import queue
+import threading
+import time
+import uuid
+
+# =====================
+# Background job queue for uploaded videos
+# =====================
+MAX_CONCURRENT_JOBS = int(os.getenv('MAX_CONCURRENT_JOBS', str(max(1, (os.cpu_count() or 2) // 2))))
+MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', '32'))
+JOB_RETENTION_SECONDS = int(os.getenv('JOB_RETENTION_SECONDS', '3600'))
+PROGRESS_INTERVAL = 0.5  # seconds between progress events per job
+
+
+class JobQueueFull(RuntimeError):
+    pass
+
+
+class Job:
+    def __init__(self, params):
+        self.id = str(uuid.uuid4())
+        self.params = params
+        self.status = 'queued'
+        self.frames_done = 0
+        self.frames_total = 0
+        self.fps = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        self.events = []  # partial results published while the job runs
+        self._events_changed = threading.Condition()
+        self._last_progress = 0.0
+
+    @property
+    def finished(self):
+        return self.status in ('completed', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'fps': round(self.fps, 2),
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+    def wait_events(self, start, timeout=None):
+        """Events from index start on, waiting up to timeout for new ones or the end of the job"""
+        with self._events_changed:
+            if len(self.events) <= start and not self.finished:
+                self._events_changed.wait(timeout)
+            return self.events[start:]
+
+
+class JobManager:
+    """Bounded queue of jobs served by a fixed pool of worker threads.
+
+    handler(job) does the work and returns the job result; it should call
+    update_progress() as it goes and stop once job.cancel_event is set.
+    on_update(job) is called on every status change and throttled progress step.
+    Partial results go through publish(); on_event(job, event) sees each one.
+    on_discard(job) is called for a job cancelled before handler() ran, so
+    whatever the handler would have cleaned up (e.g. the upload) goes too.
+    """
+
+    def __init__(self, handler, max_workers=MAX_CONCURRENT_JOBS, max_pending=MAX_PENDING_JOBS,
+                 on_update=None, on_event=None, on_discard=None):
+        self.handler = handler
+        self.on_update = on_update or (lambda job: None)
+        self.on_event = on_event or (lambda job, event: None)
+        self.on_discard = on_discard or (lambda job: None)
+        self.jobs = {}
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                         for i in range(max(1, max_workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, **params):
+        self._prune()
+        job = Job(params)
+        with self._lock:
+            self.jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self.jobs[job.id]
+            raise JobQueueFull("Job queue is full")
+        self.on_update(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if not job.finished:
+            job.cancel_event.set()
+            if job.status == 'queued':
+                self._finish(job, 'cancelled')
+                self.on_discard(job)
+        return job
+
+    def unfinished(self):
+        """Jobs still queued or running"""
+        with self._lock:
+            return [job for job in self.jobs.values() if not job.finished]
+
+    def counts(self):
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return {
+            'queued': sum(job.status == 'queued' for job in jobs),
+            'running': sum(job.status == 'running' for job in jobs),
+        }
+
+    def update_progress(self, job, frames_done, frames_total):
+        job.frames_done = frames_done
+        job.frames_total = max(frames_total, frames_done)
+        elapsed = time.time() - (job.started_at or time.time())
+        job.fps = frames_done / elapsed if elapsed > 0 else 0.0
+        now = time.time()
+        if now - job._last_progress >= PROGRESS_INTERVAL or frames_done >= frames_total:
+            job._last_progress = now
+            self.on_update(job)
+
+    def publish(self, job, event_type, **payload):
+        event = dict(payload, event=event_type, job_id=job.id, time=time.time())
+        with job._events_changed:
+            job.events.append(event)
+            job._events_changed.notify_all()
+        self.on_event(job, event)
+        return event
+
+    def _finish(self, job, status, result=None, error=None):
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.done_event.set()
+        with job._events_changed:
+            job._events_changed.notify_all()
+        self.on_update(job)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job.finished:
+                continue
+            if job.cancel_event.is_set():
+                self._finish(job, 'cancelled')
+                self.on_discard(job)
+                continue
+            job.status = 'running'
+            job.started_at = time.time()
+            self.on_update(job)
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                if job.cancel_event.is_set():
+                    self._finish(job, 'cancelled')
+                else:
+                    self._finish(job, 'failed', error=str(e))
+                continue
+            self._finish(job, 'completed', result=result)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self._lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished and job.finished_at < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
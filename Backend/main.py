@@ -1,23 +1,126 @@
 import cv2
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from ultralytics import YOLO
+import hashlib
+import logging
+import os
 import time
 import queue
+import threading
+from motion import MotionGate
+from video_io import open_video_reader, open_video_writer, package_hls
+from preprocessing import FramePreprocessor
+from incidents import IncidentAggregator, NdjsonWriter
+from tracking import WeaponTracker, track_weapons
+from metrics import FRAMES_PROCESSED, STAGE_SECONDS
+from backends import (VIOLENCE_BACKEND, WEAPON_BACKEND, QUANTIZED, VIOLENCE_ENCODER_ONNX,
+                      VIOLENCE_HEAD_ONNX, VIOLENCE_FULL_ONNX, create_violence_backend,
+                      create_weapon_backend, export_path, weapon_weights_path)
+
+logger = logging.getLogger(__name__)
 
 # =====================
 # Violence Detection (LSTM + MobileNet)
 # =====================
-violence_model = None
+VIOLENCE_MODEL_PATH = "best_lstm_mobilenet_model.h5"
+# Backend (see backends.py) selected by VIOLENCE_BACKEND. When the model splits
+# into a per-frame MobileNet encoder and an LSTM head, each frame is encoded
+# once instead of SEQUENCE_LENGTH times across the window. Installed by the
+# model registry below; the generation changes whenever it is swapped.
+violence_backend = None
+_violence_generation = 0
 SEQUENCE_LENGTH = 10
 IMG_SIZE = 224
-frame_buffer = queue.Queue(maxsize=SEQUENCE_LENGTH)
+# Model calls are serialized; callers on different threads (live streams,
+# upload jobs) each keep their own ViolenceState.
+_violence_lock = threading.Lock()
+_weapon_lock = threading.Lock()
+
+class SequenceBuffer:
+    # Preallocated ring over the last `length` items. Each item is written to
+    # slot i and slot i + length, so the items in arrival order are always the
+    # contiguous slice that window() returns as a view, without copying.
+    def __init__(self, length):
+        self.length = length
+        self._data = None
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def full(self):
+        return self._count == self.length
+
+    def push(self, item):
+        item = np.asarray(item)
+        if self._data is None or self._data.shape[1:] != item.shape:
+            self._data = np.empty((2 * self.length,) + item.shape, item.dtype)
+            self.clear()
+        self._data[self._next] = item
+        self._data[self._next + self.length] = item
+        self._next = (self._next + 1) % self.length
+        self._count = min(self._count + 1, self.length)
+
+    def last(self):
+        # Newest item; only valid until the next push
+        if not self._count:
+            return None
+        return self._data[(self._next - 1) % self.length]
+
+    def window(self):
+        # Oldest first; only valid until the next push
+        if self._data is None:
+            return np.empty((0,), np.float32)
+        end = self._next + self.length
+        return self._data[end - self._count:end]
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+class ViolenceState:
+    # Sequence window for one stream: cached embeddings when the model is split,
+    # preprocessed frames for the full-model fallback. A frame the motion gate
+    # skipped repeats the previous item, so the window always covers the last
+    # SEQUENCE_LENGTH frames of footage, as in training.
+    def __init__(self):
+        self.frames = SequenceBuffer(SEQUENCE_LENGTH)
+        self.embeddings = SequenceBuffer(SEQUENCE_LENGTH)
+        self.generation = 0
+        self.last_result = (False, 0)
+
+    def clear(self):
+        self.frames.clear()
+        self.embeddings.clear()
+        self.last_result = (False, 0)
+
+    def hold(self, buffer):
+        # Repeat the newest item for a frame that wasn't inferred
+        if len(buffer):
+            buffer.push(buffer.last())
 
-def load_violence_model():
-    global violence_model
+    def sync(self, generation):
+        # Windows built by a previous model are meaningless to a reloaded one
+        if self.generation != generation:
+            self.clear()
+            self.generation = generation
+
+# detect_violence() without a state keeps one window per calling thread
+_thread_states = threading.local()
+
+def _default_violence_state():
+    state = getattr(_thread_states, 'violence', None)
+    if state is None:
+        state = _thread_states.violence = ViolenceState()
+    return state
+
+def load_violence_model(backend=None):
+    return model_registry.load('violence', backend)
+
+def _create_violence_backend(backend=None):
     try:
-        violence_model = load_model("best_lstm_mobilenet_model.h5")
+        return create_violence_backend(VIOLENCE_MODEL_PATH, SEQUENCE_LENGTH, IMG_SIZE,
+                                       backend or VIOLENCE_BACKEND)
     except Exception as e:
         raise RuntimeError(f"Failed to load LSTM+MobileNet model: {e}")
 
@@ -26,125 +129,626 @@ def preprocess_violence_frame(frame):
     normalized = resized.astype('float32') / 255.0
     return normalized
 
-def detect_violence(frame, current_time=None):
-    global violence_model
-    frame_buffer_local = frame_buffer
-    if violence_model is None:
-        return False, 0
+def classify_violence(pred):
+    is_fight = np.argmax(pred)
+    confidence = pred[is_fight]
+    return is_fight == 0 and confidence > 0.7, confidence
+
+def _encode_frames(backend, inputs):
+    with _violence_lock, STAGE_SECONDS.time(stage='violence_inference'):
+        return backend.encode(inputs)
+
+def _predict_windows(backend, windows):
+    # windows: (n, SEQUENCE_LENGTH, embedding) array
+    with _violence_lock, STAGE_SECONDS.time(stage='violence_inference'):
+        return backend.head(windows)
+
+def _window_batch(count, state):
+    return np.empty((count,) + state.embeddings.window().shape, np.float32)
+
+def _predict_full_model(backend, processed_frame, state):
+    # Fallback when the model couldn't be split: full sequence through the model.
+    # A skipped frame (None) only keeps the window in step; a full-model call
+    # for it would cost what the motion gate saved, so it keeps the last verdict.
+    if processed_frame is None:
+        state.hold(state.frames)
+        return state.last_result
+    state.frames.push(processed_frame)
+    if state.frames.full():
+        sequence = state.frames.window()[np.newaxis]
+        with _violence_lock, STAGE_SECONDS.time(stage='violence_inference'):
+            pred = backend.predict_sequence(sequence)[0]
+        state.last_result = classify_violence(pred)
+        return state.last_result
+    return False, 0
+
+def _with_skipped(inputs, infer):
+    # One item per frame: the next input where infer is set, None where it isn't
+    inputs = iter(inputs)
+    return [next(inputs) if has_input else None for has_input in infer]
+
+def infer_violence_batch(inputs, states, infer=None):
+    # inputs: preprocessed (n, IMG_SIZE, IMG_SIZE, 3) float32, one frame per state,
+    # or with infer, one per state whose flag is set; the other states' frames were
+    # skipped and repeat their previous embedding. Frames from different streams
+    # share one encoder call and one head call over every window that is full.
+    if infer is None:
+        infer = [True] * len(states)
+    if not len(states):
+        return []
+    backend, generation = model_registry.violence()
+
+    try:
+        for state in states:
+            state.sync(generation)
+        if not backend.split:
+            return [_predict_full_model(backend, x, state)
+                    for x, state in zip(_with_skipped(inputs, infer), states)]
+
+        results = [(False, 0)] * len(states)
+        embeddings = _encode_frames(backend, inputs) if len(inputs) else []
+        for embedding, state in zip(_with_skipped(embeddings, infer), states):
+            if embedding is None:
+                state.hold(state.embeddings)
+            else:
+                state.embeddings.push(embedding)
+        full = [i for i, state in enumerate(states) if state.embeddings.full()]
+        if full:
+            # Each window is copied once, straight into the head's input batch
+            windows = _window_batch(len(full), states[full[0]])
+            for k, i in enumerate(full):
+                windows[k] = states[i].embeddings.window()
+            preds = _predict_windows(backend, windows)
+            for i, pred in zip(full, preds):
+                results[i] = classify_violence(pred)
+        return results
+    except Exception as e:
+        raise RuntimeError(f"Violence detection error: {e}")
+
+def infer_violence_sequence(inputs, state, infer=None):
+    # inputs: consecutive preprocessed frames of one stream, or with infer (one
+    # flag per frame) only those of the flagged frames; the others were skipped
+    # and repeat the previous embedding. All inputs are encoded in one call and
+    # every full window goes through the head in one call. One result per frame.
+    if infer is None:
+        infer = [True] * len(inputs)
+    if not len(infer):
+        return []
+    backend, generation = model_registry.violence()
 
     try:
-        processed_frame = preprocess_violence_frame(frame)
-        if frame_buffer_local.full():
-            frame_buffer_local.get()
-        frame_buffer_local.put(processed_frame)
-
-        if frame_buffer_local.qsize() == SEQUENCE_LENGTH:
-            sequence = np.expand_dims(np.array(list(frame_buffer_local.queue)), axis=0)
-            pred = violence_model.predict(sequence, verbose=0)[0]
-            is_fight = np.argmax(pred)
-            confidence = pred[is_fight]
-            return is_fight == 0 and confidence > 0.7, confidence
-
-        return False, 0
+        state.sync(generation)
+        if not backend.split:
+            return [_predict_full_model(backend, x, state) for x in _with_skipped(inputs, infer)]
+
+        results = [(False, 0)] * len(infer)
+        embeddings = _encode_frames(backend, inputs) if len(inputs) else []
+        positions = []
+        windows = None
+        for i, embedding in enumerate(_with_skipped(embeddings, infer)):
+            if embedding is None:
+                state.hold(state.embeddings)
+            else:
+                state.embeddings.push(embedding)
+            # Once full, every later frame has a window too
+            if state.embeddings.full():
+                if windows is None:
+                    windows = _window_batch(len(infer) - i, state)
+                windows[len(positions)] = state.embeddings.window()
+                positions.append(i)
+        if positions:
+            for i, pred in zip(positions, _predict_windows(backend, windows)):
+                results[i] = classify_violence(pred)
+        return results
     except Exception as e:
         raise RuntimeError(f"Violence detection error: {e}")
 
+def detect_violence(frame, current_time=None, state=None):
+    return detect_violence_batch([frame], [state or _default_violence_state()])[0]
+
+def detect_violence_batch(frames, states):
+    if not frames:
+        return []
+    inputs = np.stack([preprocess_violence_frame(frame) for frame in frames])
+    return infer_violence_batch(inputs, states)
+
 # =====================
 # Weapon Detection (YOLOv11)
 # =====================
-weapon_model = None
+WEAPON_MODEL_PATH = "best.pt"
+# Backend selected by WEAPON_BACKEND (PyTorch weights or an exported format)
+weapon_backend = None
+
+def load_weapon_model(backend=None):
+    return model_registry.load('weapon', backend)
 
-def load_weapon_model():
-    global weapon_model
+def _create_weapon_backend(backend=None):
     try:
-        weapon_model = YOLO("best.pt")
+        return create_weapon_backend(WEAPON_MODEL_PATH, backend or WEAPON_BACKEND)
     except Exception as e:
         raise RuntimeError(f"Failed to load YOLO model: {e}")
 
-def detect_weapons(frame, current_time=None):
-    if weapon_model is None:
+def parse_weapon_results(results, current_time=None):
+    boxes = []
+    for box, conf, cls in zip(*results):
+        if int(cls) == 1 and conf > 0.5:
+            timestamp = current_time if current_time is not None else time.time()
+            boxes.append({
+                'coordinates': tuple(map(int, box)),
+                'confidence': float(conf),
+                'timestamp': timestamp,
+            })
+    return boxes
+
+def infer_weapons_batch(rgb_frames, current_times=None):
+    # One model call for the whole batch; box lists come back in frame order
+    if not rgb_frames:
         return []
+    if current_times is None:
+        current_times = [None] * len(rgb_frames)
+    backend = model_registry.weapon()
     try:
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = weapon_model(rgb_frame)[0]
-        boxes = []
-        for box, conf, cls in zip(results.boxes.xyxy.cpu().numpy(),
-                                results.boxes.conf.cpu().numpy(),
-                                results.boxes.cls.cpu().numpy()):
-            if int(cls) == 1 and conf > 0.5:
-                timestamp = current_time if current_time is not None else time.time()
-                boxes.append({
-                    'coordinates': tuple(map(int, box)),
-                    'confidence': float(conf),
-                    'timestamp': timestamp,
-                })
-        return boxes
+        with _weapon_lock, STAGE_SECONDS.time(stage='yolo_inference'):
+            results = backend.predict(rgb_frames)
+        return [parse_weapon_results(result, current_time)
+                for result, current_time in zip(results, current_times)]
     except Exception as e:
         raise RuntimeError(f"Weapon detection error: {e}")
 
+def detect_weapons(frame, current_time=None):
+    return detect_weapons_batch([frame], [current_time])[0]
+
+def detect_weapons_batch(frames, current_times=None):
+    rgb_frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+    return infer_weapons_batch(rgb_frames, current_times)
+
+def model_version():
+    # Identifies the loaded weights for result caching; MODEL_VERSION overrides
+    if os.getenv('MODEL_VERSION'):
+        return os.getenv('MODEL_VERSION')
+    digest = hashlib.sha256(f"{VIOLENCE_BACKEND}:{WEAPON_BACKEND}:{QUANTIZED}".encode())
+    for path in (VIOLENCE_MODEL_PATH, WEAPON_MODEL_PATH):
+        stat = os.stat(path) if os.path.exists(path) else None
+        digest.update(f"{path}:{stat.st_size if stat else 0}:{stat.st_mtime_ns if stat else 0}".encode())
+    return digest.hexdigest()[:16]
+
 # =====================
-# Load models at startup
+# Model registry
 # =====================
-load_violence_model()
-load_weapon_model()
+# Nothing is loaded at import. Models load on first use, or up front when the
+# server calls model_registry.start() (MODEL_LOADING=background loads them in a
+# thread behind the readiness endpoint, eager blocks until they are ready).
+# Each model is warmed up with a dummy inference so the first real frame
+# doesn't pay for graph compilation. Reloading builds and warms the new
+# backend next to the running one and only then swaps it in.
+MODEL_LOADING = os.getenv('MODEL_LOADING', 'background')  # background, eager, lazy
+MODEL_WARMUP = os.getenv('MODEL_WARMUP', '1') == '1'
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', '0'))  # seconds, 0 disables
+MODEL_KINDS = ('violence', 'weapon')
+WARMUP_WEAPON_SIZE = 640
+
+def _weight_files(kind):
+    if kind == 'violence':
+        if VIOLENCE_BACKEND == 'keras':
+            return [VIOLENCE_MODEL_PATH]
+        if VIOLENCE_BACKEND in ('onnx', 'openvino'):
+            return [export_path(name, QUANTIZED)
+                    for name in (VIOLENCE_ENCODER_ONNX, VIOLENCE_HEAD_ONNX, VIOLENCE_FULL_ONNX)]
+        return []
+    if WEAPON_BACKEND in ('stub', 'remote'):
+        return []
+    return [weapon_weights_path(WEAPON_MODEL_PATH)]
+
+def _weights_signature(kind):
+    signature = []
+    for path in _weight_files(kind):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+def _warm_up(kind, backend):
+    if kind == 'violence':
+        frame = np.zeros((1, IMG_SIZE, IMG_SIZE, 3), np.float32)
+        if backend.split:
+            embedding = backend.encode(frame)
+            backend.head(np.repeat(embedding[np.newaxis], SEQUENCE_LENGTH, axis=1))
+        else:
+            backend.predict_sequence(np.repeat(frame[np.newaxis], SEQUENCE_LENGTH, axis=1))
+    else:
+        backend.predict([np.zeros((WARMUP_WEAPON_SIZE, WARMUP_WEAPON_SIZE, 3), np.uint8)])
+
+def _install(kind, backend):
+    global violence_backend, weapon_backend, _violence_generation
+    if kind == 'violence':
+        with _violence_lock:
+            violence_backend = backend
+            _violence_generation += 1
+    else:
+        with _weapon_lock:
+            weapon_backend = backend
+
+class ModelRegistry:
+    def __init__(self):
+        self._locks = {kind: threading.Lock() for kind in MODEL_KINDS}
+        self.models = {kind: {'status': 'unloaded', 'backend': None, 'error': None,
+                              'loaded_at': None, 'load_seconds': None}
+                       for kind in MODEL_KINDS}
+        self._weights = {}
+        self._watcher = None
+
+    def ready(self):
+        return all(model['status'] == 'ready' for model in self.models.values())
+
+    def describe(self):
+        return {'ready': self.ready(),
+                'models': {kind: dict(model) for kind, model in self.models.items()}}
+
+    def violence(self):
+        self.ensure('violence')
+        return violence_backend, _violence_generation
+
+    def weapon(self):
+        self.ensure('weapon')
+        return weapon_backend
+
+    def ensure(self, kind):
+        # Fast path once loaded; otherwise callers wait for (or do) the load
+        if self.models[kind]['status'] != 'ready':
+            with self._locks[kind]:
+                if self.models[kind]['status'] != 'ready':
+                    self._load(kind)
+
+    def load(self, kind, backend=None):
+        with self._locks[kind]:
+            return self._load(kind, backend)
+
+    def _load(self, kind, backend_name=None):
+        model = self.models[kind]
+        reloading = model['status'] == 'ready'
+        if not reloading:
+            model['status'] = 'loading'
+        weights = _weights_signature(kind)
+        start = time.perf_counter()
+        create = _create_violence_backend if kind == 'violence' else _create_weapon_backend
+        try:
+            backend = create(backend_name)
+            if MODEL_WARMUP:
+                try:
+                    _warm_up(kind, backend)
+                except Exception as e:
+                    raise RuntimeError(f"Failed to warm up {kind} model: {e}")
+        except RuntimeError as e:
+            # A failed reload leaves the running model in place
+            model['error'] = str(e)
+            if not reloading:
+                model['status'] = 'failed'
+            raise
+        _install(kind, backend)
+        self._weights[kind] = weights
+        model.update(status='ready', backend=backend.name, error=None, loaded_at=time.time(),
+                     load_seconds=round(time.perf_counter() - start, 3))
+        logger.info(f"Loaded {kind} model ({backend.name}) in {model['load_seconds']}s")
+        return backend
+
+    def load_all(self):
+        for kind in MODEL_KINDS:
+            self.ensure(kind)
+
+    def reload(self, kinds=None):
+        for kind in kinds or MODEL_KINDS:
+            if kind not in self.models:
+                raise RuntimeError(f"Unknown model: {kind}")
+            self.load(kind)
+        return self.describe()
+
+    def load_in_background(self):
+        thread = threading.Thread(target=self._load_quietly, name='model-loader', daemon=True)
+        thread.start()
+        return thread
+
+    def _load_quietly(self, kinds=MODEL_KINDS, reload=False):
+        for kind in kinds:
+            try:
+                if reload:
+                    self.load(kind)
+                else:
+                    self.ensure(kind)
+            except RuntimeError as e:
+                logger.error(str(e))
+
+    def watch(self, interval=MODEL_WATCH_INTERVAL):
+        # Reload a model once its weight files changed and then stayed the same
+        # for one interval, so a copy in progress isn't picked up half written
+        if self._watcher is not None or interval <= 0:
+            return self._watcher
+
+        def loop():
+            pending = {}
+            while True:
+                time.sleep(interval)
+                for kind in MODEL_KINDS:
+                    if self.models[kind]['status'] != 'ready':
+                        continue
+                    signature = _weights_signature(kind)
+                    if signature == self._weights.get(kind):
+                        pending.pop(kind, None)
+                    elif pending.get(kind) == signature:
+                        del pending[kind]
+                        self._load_quietly([kind], reload=True)
+                    else:
+                        pending[kind] = signature
+
+        self._watcher = threading.Thread(target=loop, name='model-watcher', daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def start(self, mode=MODEL_LOADING, watch_interval=MODEL_WATCH_INTERVAL):
+        if mode == 'eager':
+            self.load_all()
+        elif mode == 'background':
+            self.load_in_background()
+        elif mode != 'lazy':
+            raise RuntimeError(f"Unknown model loading mode: {mode}")
+        if watch_interval > 0:
+            self.watch(watch_interval)
+
+model_registry = ModelRegistry()
 
 # =====================
 # Main Detection Logic
 # =====================
-def run_detection(video_path, output_path):
-    cap = cv2.VideoCapture(video_path)
+WEAPON_BATCH_SIZE = int(os.getenv('WEAPON_BATCH_SIZE', '4'))
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '32'))
+_PIPELINE_END = object()
+
+def annotate_frame(display_frame, violence_detected, violence_confidence, weapon_boxes):
+    height, width = display_frame.shape[:2]
+    if violence_detected:
+        cv2.putText(display_frame, f"VIOLENCE DETECTED ({violence_confidence * 100:.2f}%)",
+                    (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
+        cv2.rectangle(display_frame, (0, 0), (width, height), (0, 0, 255), 5)
+
+    for box in weapon_boxes:
+        x1, y1, x2, y2 = box['coordinates']
+        label = f"WEAPON #{box['track_id']}" if box.get('track_id') is not None else "WEAPON"
+        cv2.rectangle(display_frame, (x1, y1), (x2, y2), (255, 0, 0), 3)
+        cv2.putText(display_frame, label, (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 0, 0), 2)
+    return display_frame
+
+def record_detections(add, frame_index, frame_time,
+                      violence_detected, violence_confidence, weapon_boxes):
+    # add: IncidentAggregator.add, or list.append to keep every record
+    if violence_detected:
+        add({
+            'type': 'violence',
+            'timestamp': f"{frame_time:.2f}s",
+            'time': frame_time,
+            'frame': frame_index,
+            'confidence': float(violence_confidence)
+        })
+    for box in weapon_boxes:
+        add({
+            'type': 'weapon',
+            'timestamp': f"{frame_time:.2f}s",
+            'time': frame_time,
+            'frame': frame_index,
+            'confidence': box['confidence'],
+            'coordinates': box['coordinates'],
+            'track_id': box.get('track_id')
+        })
+
+def _put(stage_queue, item, stop):
+    # Blocking put that gives up once the pipeline is stopping
+    while not stop.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(stage_queue, stop):
+    while not stop.is_set():
+        try:
+            return stage_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _PIPELINE_END
+
+class DetectionCancelled(RuntimeError):
+    pass
+
+def run_detection(video_path, output_path, batch_size=None, queue_size=None, stats=None,
+                  progress=None, cancel_event=None, encoder=None, detail_path=None,
+                  frame_range=None, warmup_frames=0, reader=None, first_track_id=1, hls_dir=None,
+                  on_incident=None, annotate=True):
+    # Decode -> inference -> annotate/encode run as three stages connected by
+    # bounded queues, so decoding and encoding overlap with model inference.
+    # Returns incidents (see incidents.py); per-frame detections go to
+    # detail_path as NDJSON when it is given.
+    # frame_range=(start, end) processes only those frames (end None: to the
+    # end of the video). Up to warmup_frames frames before start are run through
+    # the models to fill the sequence window but are not recorded or written.
+    # reader picks the frame source (see video_io.open_video_reader); the ffmpeg
+    # reader can downscale and decimate, and the output follows its size and fps.
+    # hls_dir also gets the output as HLS; the ffmpeg encoder writes it while
+    # encoding, other encoders have it remuxed from the finished file.
+    # on_incident(event, incident) reports incidents while the video is still
+    # being processed (see incidents.IncidentAggregator).
+    # output_path None runs detection only: nothing is annotated or encoded.
+    # annotate=False writes the frames without boxes and labels.
+    batch_size = max(1, batch_size or WEAPON_BATCH_SIZE)
+    queue_size = max(batch_size, queue_size or PIPELINE_QUEUE_SIZE)
+    cap = open_video_reader(video_path, reader)
     if not cap.isOpened():
         raise RuntimeError("Could not open video file")
 
     fps = cap.get(cv2.CAP_PROP_FPS)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    frames_total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    start_frame, end_frame = frame_range or (0, None)
+    first_frame = max(0, start_frame - warmup_frames)
+    if end_frame is not None:
+        frames_total = end_frame - start_frame
+    elif start_frame:
+        frames_total = max(0, frames_total - start_frame)
+    if first_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    try:
+        out = open_video_writer(output_path, fps, width, height, encoder, hls_dir) if output_path else None
+    except Exception:
+        cap.release()
+        raise
+
+    try:
+        detail = NdjsonWriter(detail_path) if detail_path else None
+    except Exception:
+        cap.release()
+        if out is not None:
+            out.release()
+        raise
+    # Partial runs (chunks) keep each incident's first and last box so tracks
+    # can be stitched across the chunk boundaries
+    aggregator = IncidentAggregator(detail=detail, listener=on_incident, edges=frame_range is not None)
+    motion_gate = MotionGate()
+    violence_state = ViolenceState()
+    weapon_tracker = WeaponTracker(first_id=first_track_id)
+    preprocessor = FramePreprocessor(IMG_SIZE, batch_size)
+    decoded = queue.Queue(maxsize=queue_size)
+    annotated = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def decode():
+        index = first_frame
+        try:
+            while not stop.is_set() and (end_frame is None or index < end_frame):
+                with STAGE_SECONDS.time(stage='decode'):
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                # The first recorded frame is always inferred, so a run starting mid-video
+                # (a chunk) has a fresh verdict there whatever the gate saw in the warm-up
+                infer = motion_gate.should_infer(frame, force=index == start_frame)
+                if not _put(decoded, (frame, frame_time, infer, index >= start_frame), stop):
+                    break
+                index += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(decoded, _PIPELINE_END, stop)
+
+    def write():
+        try:
+            while True:
+                item = _get(annotated, stop)
+                if item is _PIPELINE_END:
+                    break
+                if annotate:
+                    with STAGE_SECONDS.time(stage='annotate'):
+                        display_frame = annotate_frame(*item)
+                else:
+                    display_frame = item[0]
+                out.write(display_frame)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
 
-    detection_results = []
     frame_count = 0
+    frames_inferred = 0
+    batch = []
+    recording = False
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
+    last_verdict = (False, 0, [])
 
-        display_frame = frame.copy()
-        frame_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+    def flush_batch():
+        nonlocal frame_count, frames_inferred, last_verdict
+        # Only frames that passed the motion gate reach the models. Violence keeps
+        # per-frame sequence order, skipped frames included, and gets a verdict for
+        # every frame; weapons are tracked, with the frames that need full
+        # detection going to YOLO as one batch, and skipped frames keep the last boxes.
+        inferred = [(frame, frame_time) for frame, frame_time, infer, _ in batch if infer]
+        violence_inputs, weapon_inputs = preprocessor.prepare_batch([frame for frame, _ in inferred])
+        violence = iter(infer_violence_sequence(violence_inputs, violence_state,
+                                                [infer for _, _, infer, _ in batch]))
+        weapons = iter(track_weapons(weapon_tracker, weapon_inputs,
+                                     [frame_time for _, frame_time in inferred], infer_weapons_batch))
+        for frame, frame_time, infer, keep in batch:
+            last_verdict = next(violence) + (next(weapons) if infer else last_verdict[2],)
+            if not keep:
+                continue
+            frames_inferred += int(infer)
+            violence_detected, violence_confidence, weapon_boxes = last_verdict
+            aggregator.advance(frame_time)
+            record_detections(aggregator.add, start_frame + frame_count, frame_time,
+                              violence_detected, violence_confidence, weapon_boxes)
+            if out is not None and not _put(annotated, (frame, violence_detected, violence_confidence,
+                                                        weapon_boxes), stop):
+                break
+            frame_count += 1
+            FRAMES_PROCESSED.inc(source='upload')
+        batch.clear()
 
-        violence_detected, violence_confidence = detect_violence(display_frame, frame_time)
-        weapon_boxes = detect_weapons(display_frame, frame_time)
+    decoder = threading.Thread(target=decode, name="detection-decode", daemon=True)
+    writer = threading.Thread(target=write, name="detection-write", daemon=True)
+    decoder.start()
+    if out is not None:
+        writer.start()
 
-        if violence_detected:
-            detection_results.append({
-                'type': 'violence',
-                'timestamp': f"{frame_time:.2f}s",
-                'frame': frame_count,
-                'confidence': violence_confidence
-            })
-            cv2.putText(display_frame, f"VIOLENCE DETECTED ({violence_confidence * 100:.2f}%)",
-                        (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 255), 3)
-            cv2.rectangle(display_frame, (0, 0), (width, height), (0, 0, 255), 5)
-
-        for box in weapon_boxes:
-            detection_results.append({
-                'type': 'weapon',
-                'timestamp': f"{frame_time:.2f}s",
-                'frame': frame_count,
-                'confidence': box['confidence'],
-                'coordinates': box['coordinates']
-            })
-            x1, y1, x2, y2 = box['coordinates']
-            cv2.rectangle(display_frame, (x1, y1), (x2, y2), (255, 0, 0), 3)
-            cv2.putText(display_frame, "WEAPON", (x1, y1 - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 0, 0), 2)
-
-        out.write(display_frame)
-        frame_count += 1
-
-    cap.release()
-    out.release()
-    cv2.destroyAllWindows()
-    return detection_results
\ No newline at end of file
+    try:
+        while True:
+            item = _get(decoded, stop)
+            if item is _PIPELINE_END:
+                break
+            if cancel_event is not None and cancel_event.is_set():
+                raise DetectionCancelled("Detection cancelled")
+            if item[3] and not recording:
+                # Warm-up ends: finish its frames, then detect weapons on the first
+                # recorded frame instead of continuing the warm-up's tracking phase
+                recording = True
+                if batch:
+                    flush_batch()
+                weapon_tracker.force_detection()
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush_batch()
+                if progress is not None:
+                    progress(frame_count, frames_total)
+        if batch and not stop.is_set():
+            flush_batch()
+        if out is not None:
+            _put(annotated, _PIPELINE_END, stop)
+        if progress is not None:
+            progress(frame_count, frames_total)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        decoder.join()
+        if out is not None:
+            writer.join()
+        cap.release()
+        try:
+            if out is not None:
+                out.release()
+        except Exception as e:
+            errors.append(e)
+        if detail is not None:
+            detail.close()
+
+    if errors:
+        raise errors[0]
+    if out is not None and hls_dir and getattr(out, 'hls_dir', None) != hls_dir:
+        package_hls(output_path, hls_dir)
+    if stats is not None:
+        stats['frames_total'] = frame_count
+        stats['frames_inferred'] = frames_inferred
+        stats['frames_skipped'] = frame_count - frames_inferred
+    aggregator.close_all()
+    return aggregator.incidents()
@@ -0,0 +1,67 @@
+import os
+
+import cv2
+import numpy as np
+
+# =====================
+# Motion gating
+# =====================
+# A frame is sent to the models only if enough of the (downscaled, blurred)
+# scene differs from the last frame that was inferred, or if the last
+# inference is older than MOTION_REFRESH_FRAMES.
+MOTION_GATING = os.getenv('MOTION_GATING', '1') != '0'
+MOTION_THRESHOLD = float(os.getenv('MOTION_THRESHOLD', '0.01'))  # fraction of changed pixels
+MOTION_PIXEL_DELTA = int(os.getenv('MOTION_PIXEL_DELTA', '25'))  # per-pixel grey level change
+MOTION_REFRESH_FRAMES = int(os.getenv('MOTION_REFRESH_FRAMES', '30'))
+MOTION_SIZE = (160, 90)
+
+
+class MotionGate:
+    def __init__(self, threshold=None, pixel_delta=None, refresh_frames=None,
+                 enabled=None, size=MOTION_SIZE):
+        self.threshold = MOTION_THRESHOLD if threshold is None else threshold
+        self.pixel_delta = MOTION_PIXEL_DELTA if pixel_delta is None else pixel_delta
+        self.refresh_frames = MOTION_REFRESH_FRAMES if refresh_frames is None else refresh_frames
+        self.enabled = MOTION_GATING if enabled is None else enabled
+        self.size = size
+        self.reference = None
+        self.frames_since_inference = 0
+        self.frames_inferred = 0
+        self.frames_skipped = 0
+
+    def reset(self):
+        self.reference = None
+        self.frames_since_inference = 0
+
+    def changed_fraction(self, gray):
+        diff = cv2.absdiff(gray, self.reference)
+        return np.count_nonzero(diff > self.pixel_delta) / diff.size
+
+    def should_infer(self, frame, force=False):
+        # force infers this frame regardless of motion and makes it the new reference
+        if not self.enabled:
+            self.frames_inferred += 1
+            return True
+
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+        # Plain bool: callers count with it, and numpy scalars don't serialize to JSON
+        infer = bool(force or self.reference is None
+                     or self.frames_since_inference + 1 >= self.refresh_frames
+                     or self.changed_fraction(gray) > self.threshold)
+        if infer:
+            self.reference = gray
+            self.frames_since_inference = 0
+            self.frames_inferred += 1
+        else:
+            self.frames_since_inference += 1
+            self.frames_skipped += 1
+        return infer
+
+    def stats(self):
+        return {
+            'frames_inferred': self.frames_inferred,
+            'frames_skipped': self.frames_skipped,
+        }
@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+from metrics import STAGE_SECONDS
+
+# =====================
+# Shared frame preprocessing
+# =====================
+
+
+class FramePreprocessor:
+    """Build both model inputs from decoded BGR frames in reused buffers.
+
+    Violence inputs are resized to violence_size and scaled to [0, 1] float32
+    exactly once. Weapon inputs are the full frame converted to RGB, since
+    YOLO letterboxes internally. The returned arrays are views into buffers
+    that the next call overwrites, so consume or copy them first.
+    """
+
+    def __init__(self, violence_size, capacity=1):
+        self.violence_size = violence_size
+        self.capacity = 0
+        self.violence_batch = None
+        self._resized = np.empty((violence_size, violence_size, 3), np.uint8)
+        self._scale = np.float32(255.0)
+        self._weapon = []
+        self._ensure_capacity(capacity)
+
+    def _ensure_capacity(self, n):
+        if n > self.capacity:
+            size = self.violence_size
+            self.violence_batch = np.empty((n, size, size, 3), np.float32)
+            self.capacity = n
+
+    def _weapon_buffer(self, i, shape):
+        while len(self._weapon) <= i:
+            self._weapon.append(None)
+        buffer = self._weapon[i]
+        if buffer is None or buffer.shape != shape:
+            buffer = self._weapon[i] = np.empty(shape, np.uint8)
+        return buffer
+
+    def violence_input(self, frame, out):
+        size = self.violence_size
+        cv2.resize(frame, (size, size), dst=self._resized)
+        np.divide(self._resized, self._scale, out=out, dtype=np.float32)
+        return out
+
+    def weapon_input(self, frame, i=0):
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self._weapon_buffer(i, frame.shape))
+
+    def prepare_batch(self, frames):
+        """Returns (violence inputs as one (n, size, size, 3) array, list of RGB frames)"""
+        n = len(frames)
+        self._ensure_capacity(n)
+        violence_inputs = self.violence_batch[:n]
+        weapon_inputs = []
+        with STAGE_SECONDS.time(stage='preprocess'):
+            for i, frame in enumerate(frames):
+                self.violence_input(frame, violence_inputs[i])
+                weapon_inputs.append(self.weapon_input(frame, i))
+        return violence_inputs, weapon_inputs
+
+    def prepare(self, frame):
+        violence_inputs, weapon_inputs = self.prepare_batch([frame])
+        return violence_inputs[0], weapon_inputs[0]
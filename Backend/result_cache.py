@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# =====================
+# Content-addressed result cache for uploads
+# =====================
+CACHE_FOLDER = os.getenv('CACHE_FOLDER', 'cache')
+CACHE_QUOTA_BYTES = int(os.getenv('CACHE_QUOTA_BYTES', str(5 * 1024 * 1024 * 1024)))  # 5GB
+CACHE_GRACE_SECONDS = 600  # never evict files this recent; they may belong to jobs just finished
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(RuntimeError):
+    pass
+
+
+def save_upload(stream, path, max_size):
+    """Stream an upload to disk, hashing it on the way; returns (sha256, size)"""
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLarge("File too large")
+                digest.update(chunk)
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return digest.hexdigest(), size
+
+
+class ResultCache:
+    """Stored detection results keyed by upload content hash and model version.
+
+    Entries are small JSON files in cache_folder; the processed videos they
+    point to live in the managed folders. A cache hit touches only the entry,
+    never the files it points to: those are served as immutable, and their
+    mtime feeds the ETag and Last-Modified headers. evict() takes a file's
+    last use from the newer of its own mtime and its entry's, and removes the
+    least recently used files until the managed folders fit in quota_bytes.
+    """
+
+    def __init__(self, managed_folders, cache_folder=CACHE_FOLDER, quota_bytes=CACHE_QUOTA_BYTES):
+        self.cache_folder = cache_folder
+        self.managed_folders = list(managed_folders)
+        self.processed_folder = self.managed_folders[0]
+        self.quota_bytes = quota_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_folder, exist_ok=True)
+
+    @staticmethod
+    def key(content_hash, model_version):
+        return f"{content_hash}-{model_version}"
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_folder, f"{key}.json")
+
+    def get(self, key):
+        path = self._entry_path(key)
+        with self._lock:
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            video_path = os.path.join(self.processed_folder, entry['processed_file'])
+            if not os.path.exists(video_path):
+                os.remove(path)
+                return None
+            # Mark the entry, and through it its files, as recently used
+            os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        path = self._entry_path(key)
+        with self._lock:
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(entry, f)
+            os.replace(f"{path}.tmp", path)
+
+    def _last_used(self):
+        # Last cache hit per processed file and HLS directory, from the entries' mtimes
+        last_used = {}
+        for entry in os.scandir(self.cache_folder):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    cached = json.load(f)
+                used = entry.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            for name in (cached.get('processed_file'), cached.get('detail_file'), cached.get('hls_dir')):
+                if name:
+                    path = os.path.abspath(os.path.join(self.processed_folder, name))
+                    last_used[path] = max(used, last_used.get(path, 0))
+        return last_used
+
+    def evict(self, in_use=()):
+        """Remove least recently used files until the managed folders fit the quota.
+
+        in_use lists files and HLS directories of jobs still queued or running
+        (their uploads and outputs); they are never removed, however old.
+        """
+        in_use = {os.path.abspath(path) for path in in_use}
+        with self._lock:
+            last_used = self._last_used()
+            files = []
+            for folder in self.managed_folders:
+                for entry in os.scandir(folder):
+                    if os.path.abspath(entry.path) in in_use:
+                        continue
+                    used = max(entry.stat().st_mtime, last_used.get(os.path.abspath(entry.path), 0))
+                    if entry.is_file():
+                        files.append((used, entry.stat().st_size, entry.path))
+                    elif entry.is_dir():
+                        # HLS output directories are evicted as a whole
+                        size = sum(child.stat().st_size for child in os.scandir(entry.path) if child.is_file())
+                        files.append((used, size, entry.path))
+            total = sum(size for _, size, _ in files)
+            removed = []
+            cutoff = time.time() - CACHE_GRACE_SECONDS
+            for mtime, size, path in sorted(files):
+                if total <= self.quota_bytes or mtime > cutoff:
+                    break
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed.append(path)
+            # Entries whose video was evicted are dropped lazily by get()
+            return removed
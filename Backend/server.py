@@ -1,8 +1,8 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
+import shutil
 from werkzeug.utils import secure_filename
-import subprocess
 import logging
 import json
 import numpy as np
@@ -10,10 +10,16 @@ from datetime import datetime
 import cv2
 import uuid
 import time
-import base64
-from main import run_detection, detect_violence, detect_weapons
-from flask_socketio import SocketIO, emit
-from twilio.rest import Client
+from main import run_detection, model_version, model_registry
+from chunked import CHUNK_WORKERS, run_detection_chunked
+from streams import StreamLimitReached, StreamManager
+from jobs import JobManager, JobQueueFull
+from result_cache import ResultCache, UploadTooLarge, save_upload
+from frame_transport import FrameSender, decode_frame_payload
+from alerts import AlertDispatcher
+from video_io import FFPROBE_BINARY, HLS_OUTPUT, HLS_PLAYLIST, hls_dir_for, probe_video
+import metrics
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from dotenv import load_dotenv
 
 
@@ -33,29 +39,24 @@ UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'processed'
 ALLOWED_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
+# Processed files never change once written (every upload gets a new name),
+# so they are served as immutable. File bodies can be handed off to the
+# front-end web server: USE_X_SENDFILE for Apache/lighttpd, or
+# X_ACCEL_REDIRECT_PREFIX (the internal location mapped to PROCESSED_FOLDER) for nginx.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+X_ACCEL_REDIRECT_PREFIX = os.getenv('X_ACCEL_REDIRECT_PREFIX', '').rstrip('/')
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'
+# Partial job results: how often the HLS playlist is checked for new segments,
+# and how long an idle /jobs/<id>/events stream waits before a keep-alive line
+SEGMENT_CHECK_INTERVAL = 1.0
+EVENT_STREAM_KEEPALIVE = 15.0
 
-# Create directories if they don't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(PROCESSED_FOLDER, exist_ok=True)
-os.makedirs('debug', exist_ok=True)
-
-# Initialize Twilio client
-twilio_client = Client(os.getenv('TWILIO_ACCOUNT_SID'), os.getenv('TWILIO_AUTH_TOKEN'))
-
-# Logging configuration
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Global camera capture object
-camera_capture = None
-detection_active = False
+# Live streams
+DEFAULT_STREAM_ID = 'camera-0'
+DEFAULT_CAMERA_SOURCE = 0
+detection_loop_running = False
 
 # Utility functions
 def convert_numpy_types(obj):
@@ -73,8 +74,14 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def validate_video(file_path):
-    """Validate that the video file can be opened and has valid dimensions"""
+    """Validate that the file has a video stream with valid dimensions.
+
+    Uses an ffprobe metadata read when available instead of opening a decoder.
+    """
     try:
+        if shutil.which(FFPROBE_BINARY):
+            info = probe_video(file_path)
+            return info['width'] > 0 and info['height'] > 0
         cap = cv2.VideoCapture(file_path)
         if not cap.isOpened():
             return False
@@ -86,53 +93,43 @@ def validate_video(file_path):
         logger.error(f"Video validation failed: {str(e)}")
         return False
 
-def convert_to_web_format(input_path, output_path):
-    try:
-        logger.info(f"Starting conversion: {input_path} -> {output_path}")
-        
-        cmd = [
-            'ffmpeg', '-y', '-i', input_path,
-            '-c:v', 'libx264', '-profile:v', 'main',
-            '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
-            '-preset', 'fast', '-crf', '23',
-            '-c:a', 'aac', '-b:a', '128k',
-            '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
-            '-f', 'mp4', output_path
-        ]
-        
-        result = subprocess.run(
-            cmd,
-            check=True,
-            timeout=300,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        logger.info("Conversion successful")
-        return True
-
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFmpeg failed: {e.stderr}")
-        return False
-    except Exception as e:
-        logger.error(f"Conversion error: {str(e)}")
-        return False
-
-def preprocess_frame(frame):
-    # Resize to expected input size (e.g., 640x480 for YOLO)
-    resized = cv2.resize(frame, (640, 640))
-    # Normalize if required (e.g., to [0,1] range)
-    normalized = resized / 255.0
-    return normalized.astype(np.float32)
-
-def is_valid_frame(frame):
-    """Check if frame is valid (not blank)"""
-    if frame is None:
-        return False
-    if np.mean(frame) < 10:  # Very dark frame
-        return False
-    return True
+# Created by start_services() when the server starts
+stream_manager = None
+frame_sender = None
+alert_dispatcher = None
+job_manager = None
+result_cache = None
+
+def parse_control(payload):
+    """Controls are either a bare status string (default camera) or a dict with
+    status, stream_id, source and max_fps"""
+    if isinstance(payload, dict):
+        return (payload.get('status'),
+                payload.get('stream_id') or DEFAULT_STREAM_ID,
+                payload.get('source', DEFAULT_CAMERA_SOURCE),
+                payload.get('max_fps'),
+                False)
+    return payload, DEFAULT_STREAM_ID, DEFAULT_CAMERA_SOURCE, None, True
+
+def stream_status(status, stream_id, legacy, error=None):
+    if legacy:
+        return status
+    return {'stream_id': stream_id, 'status': status, **({'error': error} if error else {})}
+
+def emit_stream_error(event, stream_id, legacy, error):
+    """Report a failed control: the status event (with the reason unless legacy) and stream_error"""
+    emit(event, stream_status('error', stream_id, legacy, error))
+    emit('stream_error', {'stream_id': stream_id, 'error': error})
+
+def client_stream_id(sid):
+    """Stream ID for frames a browser client pushes over 'video_frame'"""
+    return f"client-{sid}"
+
+def ensure_detection_loop():
+    global detection_loop_running
+    if not detection_loop_running:
+        detection_loop_running = True
+        socketio.start_background_task(target=detection_loop)
 
 # Socket.IO event handlers
 @socketio.on('connect') 
@@ -149,224 +146,207 @@ def handle_disconnect():
     """Handle client disconnection"""
     logger.info(f"Client disconnected: {request.sid}")
     emit('connection_status', {'status': 'disconnected'})
-    global camera_capture, detection_active
-    if camera_capture:
-        camera_capture.release()
-        camera_capture = None
-    detection_active = False
+    # Only streams nobody else is watching are closed
+    closed = stream_manager.remove_client(request.sid)
+    frame_sender.remove(request.sid)
+    if closed:
+        logger.info(f"Closed streams: {closed}")
+
+@socketio.on('stream_settings')
+def handle_stream_settings(settings):
+    """Per-client frame transport: binary, quality, max_width and ack (backpressure)"""
+    if not isinstance(settings, dict):
+        return
+    emit('stream_settings', frame_sender.configure(request.sid, settings))
 
 @socketio.on('camera_control')
-def handle_camera_control(status):
+def handle_camera_control(payload):
     """Handle camera start/stop control"""
-    global camera_capture
-    logger.info(f"Camera control: {status}")
+    status, stream_id, source, max_fps, legacy = parse_control(payload)
+    logger.info(f"Camera control: {status} ({stream_id})")
     
     if status == 'active':
         try:
-            camera_capture = cv2.VideoCapture(0, cv2.CAP_DSHOW)  # Use DirectShow for Windows compatibility
-            
-            # Set camera parameters
-            camera_capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-            camera_capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-            camera_capture.set(cv2.CAP_PROP_FPS, 30)
-            
-            if not camera_capture.isOpened():
-                emit('camera_status', 'error')
-                logger.error("Failed to open camera")
+            session = stream_manager.open_stream(stream_id, source, max_fps)
+            if not session.is_open() and not session.open():
+                stream_manager.close_stream(stream_id)
+                emit('camera_status', stream_status('error', stream_id, legacy))
+                logger.error(f"Failed to open camera: {source}")
                 return
-            
-            # Warm-up camera
-            for _ in range(5):
-                camera_capture.read()
-                
-            emit('camera_status', 'active')
-            logger.info("Camera activated")
+
+            session.subscribers.add(request.sid)
+            join_room(stream_id)
+            emit('camera_status', stream_status('active', stream_id, legacy))
+            logger.info(f"Camera activated: {stream_id}")
+        except StreamLimitReached as e:
+            emit_stream_error('camera_status', stream_id, legacy, str(e))
+            logger.warning(f"Camera {stream_id} refused: {str(e)}")
         except Exception as e:
-            emit('camera_status', 'error')
+            emit_stream_error('camera_status', stream_id, legacy, 'Camera activation failed')
             logger.error(f"Camera activation error: {str(e)}")
     else:
-        if camera_capture:
-            camera_capture.release()
-            camera_capture = None
-        emit('camera_status', 'inactive')
-        logger.info("Camera deactivated")
+        session = stream_manager.get(stream_id)
+        if session:
+            session.subscribers.discard(request.sid)
+            session.detectors.discard(request.sid)
+            if not session.subscribers:
+                stream_manager.close_stream(stream_id)
+        leave_room(stream_id)
+        emit('camera_status', stream_status('inactive', stream_id, legacy))
+        logger.info(f"Camera deactivated: {stream_id}")
 
 @socketio.on('detection_control')
-def handle_detection_control(status):
+def handle_detection_control(payload):
     """Handle detection start/stop"""
-    global detection_active, camera_capture
-    logger.info(f"Detection control: {status}")
+    status, stream_id, _, _, legacy = parse_control(payload)
+    logger.info(f"Detection control: {status} ({stream_id})")
     
-    if not camera_capture or not camera_capture.isOpened():
-        emit('detection_status', 'error')
+    session = stream_manager.get(stream_id)
+    if not session or not session.is_open():
+        emit_stream_error('detection_status', stream_id, legacy, 'Camera is not active')
         logger.error("Cannot start detection without active camera")
         return
-    
-    detection_active = status == 'active'
-    emit('detection_status', status)
-    
-    if detection_active:
-        socketio.start_background_task(target=detection_loop)
 
-def detection_loop():
-    """Background task for detection processing"""
-    global camera_capture, detection_active
-    frame_count = 0
-    last_alert_time = 0
-    alert_cooldown = 60  # seconds between alerts
-    
-    logger.info("Detection loop started")
-    
-    while detection_active and camera_capture and camera_capture.isOpened():
+    # Frames the browser pushes over 'video_frame' get their own stream
+    push_id = client_stream_id(request.sid)
+    if status == 'active':
         try:
-            # Get frame with retry logic
-            MAX_RETRIES = 3
-            retry_count = 0
-            frame = None
-            
-            while retry_count < MAX_RETRIES and detection_active:
-                success, frame = camera_capture.read()
-                if success and is_valid_frame(frame):
-                    break
-                retry_count += 1
-                time.sleep(0.1)
-            else:
-                if detection_active:
-                    socketio.emit('frame_error', {'error': 'Failed to get valid frame'})
-                continue
-            
-            frame_count += 1
-            debug_frame = frame.copy()
-            
-            # Run detection
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_violence = preprocess_frame(frame_rgb)
-            frame_weapon = cv2.resize(frame, (640, 640)) 
-            violence_raw = detect_violence(frame_violence)
-            weapons_raw = detect_weapons(frame_weapon)
-            
-            # Convert numpy types
-            violence_raw = convert_numpy_types(violence_raw)
-            weapons_raw = convert_numpy_types(weapons_raw)
-            
-            # Determine detection status
-            violence_detected = bool(violence_raw[0]) if isinstance(violence_raw, list) and len(violence_raw) > 0 else False
-            weapons_detected = len(weapons_raw) > 0 if isinstance(weapons_raw, list) else False
-            
-            # Get confidence score
-            violence_confidence = violence_raw[1] if isinstance(violence_raw, list) and len(violence_raw) > 1 else 0
-            current_time = time.time()
-            
-            # Create detection data
-            detection_data = {
+            push_session = stream_manager.open_stream(push_id)
+        except StreamLimitReached as e:
+            emit_stream_error('detection_status', stream_id, legacy, str(e))
+            logger.warning(f"Detection on {stream_id} refused: {str(e)}")
+            return
+        session.detectors.add(request.sid)
+        push_session.subscribers.add(request.sid)
+        push_session.detectors.add(request.sid)
+        join_room(push_id)
+    else:
+        session.detectors.discard(request.sid)
+        stream_manager.close_stream(push_id)
+        leave_room(push_id)
+
+    emit('detection_status', stream_status(status, stream_id, legacy))
+    if status == 'active':
+        ensure_detection_loop()
+
+def emit_stream_result(result):
+    """Send one scheduler result to the clients subscribed to its stream"""
+    session = result['session']
+    room = session.stream_id
+    if result['error']:
+        socketio.emit('frame_error', {'stream_id': room, 'error': result['error']}, to=room)
+        return
+
+    frame = result['frame']
+    violence_raw = convert_numpy_types(result['violence'])
+    weapons_raw = convert_numpy_types(result['weapons'])
+
+    # Determine detection status
+    violence_detected = bool(violence_raw[0]) if isinstance(violence_raw, list) and len(violence_raw) > 0 else False
+    weapons_detected = len(weapons_raw) > 0 if isinstance(weapons_raw, list) else False
+
+    # Get confidence score
+    violence_confidence = violence_raw[1] if isinstance(violence_raw, list) and len(violence_raw) > 1 else 0
+
+    detection_data = {
+        'stream_id': room,
+        'violence_detected': violence_detected,
+        'weapons_detected': weapons_detected,
+        'violence_confidence': violence_confidence,
+        'weapon_confidence': 0.8 if weapons_detected else 0,
+        'timestamp': datetime.now().isoformat(),
+        'skipped': result['skipped'],
+        'frames_skipped': session.motion_gate.frames_skipped,
+        **session.controller.describe()
+    }
+    socketio.emit('detection_data', detection_data, to=room)
+
+    # Queued for the alert dispatcher, which coalesces and rate limits
+    if violence_detected or weapons_detected:
+        send_direct_alert(
+            phone_number=os.getenv('DEFAULT_ALERT_PHONE'),
+            detection_type="violence" if violence_detected else "weapon",
+            confidence=violence_confidence if violence_detected else 0.8,
+            stream_id=room
+        )
+
+    # Frames go per client so slow clients only get the newest one
+    if session.pushed:
+        event, meta = 'video_frame_processed', {}
+    else:
+        event, meta = 'video_frame', {
+            'stream_id': room,
+            'detection': {
                 'violence_detected': violence_detected,
                 'weapons_detected': weapons_detected,
-                'violence_confidence': violence_confidence,
-                'weapon_confidence': 0.8 if weapons_detected else 0,
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            # Emit detection data to client
-            socketio.emit('detection_data', detection_data)
-
-            # Check if we should send alert
-            if (violence_detected or weapons_detected) and (current_time - last_alert_time > alert_cooldown):
-                send_direct_alert(
-                    phone_number=os.getenv('DEFAULT_ALERT_PHONE'),
-                    detection_type="violence" if violence_detected else "weapon",
-                    confidence=violence_confidence if violence_detected else 0.8
-                )
-                last_alert_time = current_time
-
-            # Visual debugging for weapons
-            if weapons_detected and isinstance(weapons_raw, list):
-                for box in weapons_raw:
-                    if isinstance(box, dict) and 'coordinates' in box:
-                        x1, y1, x2, y2 = map(int, box['coordinates'])
-                        cv2.rectangle(debug_frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-                        cv2.putText(debug_frame, "Weapon", (x1, y1-10),
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-
-            # Encode and send frame
-            _, buffer = cv2.imencode('.jpg', frame)
-            socketio.emit('video_frame', {
-                'frame': base64.b64encode(buffer).decode('utf-8'),
-                'detection': {
-                    'violence_detected': violence_detected,
-                    'weapons_detected': weapons_detected,
-                    'boxes': weapons_raw if weapons_detected else []
-                },
-                'frame_num': frame_count
-            })
-
-            socketio.sleep(0.033)  # ~30fps
-            
-        except Exception as e:
-            logger.error(f"Detection loop error: {str(e)}")
-            if detection_active:
-                socketio.emit('detection_status', 'error')
-                detection_active = False
+                'boxes': weapons_raw if weapons_detected else []
+            },
+            'frame_num': session.frame_count
+        }
+    send_started = time.time()
+    for sid in list(session.subscribers):
+        frame_sender.send(sid, event, frame, meta, quality=session.controller.jpeg_quality)
+    now = time.time()
+    session.frame_done(now, now - result['captured_at'], result['cost'] + now - send_started)
+
+def detection_loop():
+    """Background task driving the shared inference scheduler for all streams"""
+    global detection_loop_running
+    logger.info("Detection loop started")
+    
+    try:
+        while stream_manager.has_active():
+            try:
+                for result in stream_manager.step():
+                    emit_stream_result(result)
+            except Exception as e:
+                logger.error(f"Detection loop error: {str(e)}")
+                for session in stream_manager.active_sessions():
+                    socketio.emit('detection_status', 'error', to=session.stream_id)
+                    session.detectors.clear()
+
+            socketio.sleep(min(stream_manager.seconds_until_due(), 0.033) or 0.005)
+    finally:
+        detection_loop_running = False
     
     logger.info("Detection loop ended")
-    if detection_active:
-        socketio.emit('detection_status', 'inactive')
-        detection_active = False
 
 @socketio.on('video_frame')
 def handle_video_frame(data):
-    global detection_active
-    if not hasattr(handle_video_frame, "last_alert_time"):
-        handle_video_frame.last_alert_time = 0
-    alert_cooldown = 60  # seconds
-
-    if not detection_active:
+    session = stream_manager.get(client_stream_id(request.sid))
+    if session is None or not session.detection_active:
         return
     try:
-        frame_data = data['frame'].split(',')[1]
-        img_bytes = base64.b64decode(frame_data)
+        img_bytes = decode_frame_payload(data['frame'])
         nparr = np.frombuffer(img_bytes, np.uint8)
         frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         if frame is None:
             return
 
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        frame_violence = preprocess_frame(frame_rgb)
-        frame_weapon = cv2.resize(frame, (640, 640))
-        violence_raw = detect_violence(frame_violence)
-        weapons_raw = detect_weapons(frame_weapon)
-        violence_raw = convert_numpy_types(violence_raw)
-        weapons_raw = convert_numpy_types(weapons_raw)
-        violence_detected = bool(violence_raw[0]) if isinstance(violence_raw, list) and len(violence_raw) > 0 else False
-        weapons_detected = len(weapons_raw) > 0 if isinstance(weapons_raw, list) else False
-        violence_confidence = violence_raw[1] if isinstance(violence_raw, list) and len(violence_raw) > 1 else 0
-
-        detection_data = {
-            'violence_detected': violence_detected,
-            'weapons_detected': weapons_detected,
-            'violence_confidence': violence_confidence,
-            'weapon_confidence': 0.8 if weapons_detected else 0,
-            'timestamp': datetime.now().isoformat()
-        }
-        socketio.emit('detection_data', detection_data)
-
-        _, buffer = cv2.imencode('.jpg', frame)
-        frame_b64 = base64.b64encode(buffer).decode('utf-8')
-        socketio.emit('video_frame_processed', {'frame': frame_b64})
-
-        current_time = time.time()
-        if weapons_detected and (current_time - handle_video_frame.last_alert_time > alert_cooldown):
-            send_direct_alert(
-                phone_number=os.getenv('DEFAULT_ALERT_PHONE'),
-                detection_type="weapon",
-                confidence=0.8
-            )
-            handle_video_frame.last_alert_time = current_time
+        # The shared scheduler picks up the newest pushed frame
+        session.push(frame)
+        ensure_detection_loop()
 
     except Exception as e:
         logger.error(f"Error processing video frame: {e}")
 
 # API Routes
 
+def send_processed(relative_path, mimetype, cache_control=IMMUTABLE_CACHE_CONTROL):
+    """Serve a file under PROCESSED_FOLDER with ETag, range and cache headers"""
+    if X_ACCEL_REDIRECT_PREFIX:
+        # nginx serves the body, ranges and conditionals itself
+        response = Response(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{X_ACCEL_REDIRECT_PREFIX}/{relative_path}"
+    else:
+        # Werkzeug answers Range and If-None-Match from the file's ETag and
+        # sets Content-Length to match the (partial) body
+        response = send_from_directory(PROCESSED_FOLDER, relative_path, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, ETag'
+    return response
+
 @app.route('/processed/<filename>')
 def serve_video(filename):
     try:
@@ -381,63 +361,271 @@ def serve_video(filename):
             logger.error(f"Invalid file type: {safe_filename}")
             return jsonify({'error': 'Invalid file type'}), 400
 
-        file_size = os.path.getsize(file_path)
-
-        response = send_from_directory(
-            PROCESSED_FOLDER,
-            safe_filename,
-            mimetype='video/mp4',
-            conditional=True
-        )
-
-        response.headers['Content-Length'] = str(file_size)
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
-        response.headers['Access-Control-Expose-Headers'] = 'Content-Length'
-
-        return response
+        return send_processed(safe_filename, 'video/mp4')
 
     except Exception as e:
         logger.error(f"Video serving error: {str(e)}")
         return jsonify({'error': str(e)}), 500
+
+@app.route('/hls/<dirname>/<filename>')
+def serve_hls(dirname, filename):
+    """HLS playlist and segments of a processed upload"""
+    safe_dirname, safe_filename = secure_filename(dirname), secure_filename(filename)
+    if not safe_dirname.endswith('_hls'):
+        return jsonify({'error': 'Invalid playlist'}), 400
+    file_path = os.path.join(PROCESSED_FOLDER, safe_dirname, safe_filename)
+    if not os.path.exists(file_path):
+        return jsonify({'error': 'Playlist not found'}), 404
+    relative_path = f"{safe_dirname}/{safe_filename}"
+    if safe_filename.endswith('.ts'):
+        return send_processed(relative_path, 'video/mp2t')
+    if safe_filename != HLS_PLAYLIST:
+        return jsonify({'error': 'Invalid file type'}), 400
+    # The playlist grows while the job is encoding; it is final once it has an end tag
+    with open(file_path, 'rb') as f:
+        finished = b'#EXT-X-ENDLIST' in f.read()
+    return send_processed(relative_path, 'application/vnd.apple.mpegurl',
+                          IMMUTABLE_CACHE_CONTROL if finished else 'no-cache')
     
+def hls_url(host_url, hls_dirname):
+    return f"{host_url}hls/{hls_dirname}/{HLS_PLAYLIST}"
+
+def detail_filename(processed_filename):
+    return f"{os.path.splitext(processed_filename)[0]}.detections.ndjson"
+
+def unfinished_job_files():
+    """Uploads and outputs of queued and running jobs, which cache eviction must leave alone"""
+    paths = []
+    for job in job_manager.unfinished():
+        processed_path = os.path.join(PROCESSED_FOLDER, job.params['processed_filename'])
+        paths += [job.params['input_path'], processed_path, hls_dir_for(processed_path),
+                  os.path.join(PROCESSED_FOLDER, detail_filename(job.params['processed_filename']))]
+    return paths
+
+@app.route('/detections/<filename>')
+def serve_detections(filename):
+    """Per-frame detections of a processed upload, one JSON object per line"""
+    safe_filename = secure_filename(filename)
+    if not safe_filename.endswith('.detections.ndjson'):
+        return jsonify({'error': 'Invalid file type'}), 400
+    if not os.path.exists(os.path.join(PROCESSED_FOLDER, safe_filename)):
+        return jsonify({'error': 'Detections not found'}), 404
+    return send_from_directory(PROCESSED_FOLDER, safe_filename, mimetype='application/x-ndjson')
+
 # Alert functions
 @app.route('/test-alert')
 def test_alert():
     logger.info("Test alert triggered manually.")
     result = send_direct_alert("+919390501063", "violence", 95, filename="test.mp4")
-    return f"Test alert sent: {result}"
+    return f"Test alert queued: {result}"
+
+def send_direct_alert(phone_number, detection_type, confidence, filename=None, stream_id=None):
+    """Queue an alert for delivery; returns False if it couldn't be queued"""
+    return alert_dispatcher.submit(phone_number, detection_type, confidence,
+                                   stream_id=stream_id, filename=filename)
+
+def process_job(job):
+    """Run detection, encoding and alerting for one queued upload"""
+    params = job.params
+    filename = params['filename']
+    input_path = params['input_path']
+    processed_filename = params['processed_filename']
+    processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
+    detail_file = detail_filename(processed_filename) if params.get('detail') else None
+    detail_path = os.path.join(PROCESSED_FOLDER, detail_file) if detail_file else None
+    hls_path = hls_dir_for(processed_path) if HLS_OUTPUT else None
+    first_detection = []
+    published_segments = set()
+    last_segment_check = [0.0]
+
+    def on_incident(event, incident):
+        # Alerts go out as incidents open instead of after the whole video;
+        # the dispatcher coalesces them per job and type
+        incident = convert_numpy_types(incident)
+        if event == 'opened':
+            if not first_detection:
+                first_detection.append(time.time() - job.started_at)
+                metrics.TIME_TO_FIRST_DETECTION.observe(first_detection[0])
+            send_direct_alert(
+                phone_number=params['contact_phone'],
+                detection_type=incident['type'],
+                confidence=incident['confidence'],
+                filename=filename,
+                stream_id=job.id
+            )
+        job_manager.publish(job, 'incident', status=event, incident=incident)
+
+    def publish_segments(force=False):
+        # Segments listed in the playlist are complete and already playable
+        now = time.time()
+        if not hls_path or (not force and now - last_segment_check[0] < SEGMENT_CHECK_INTERVAL):
+            return
+        last_segment_check[0] = now
+        try:
+            with open(os.path.join(hls_path, HLS_PLAYLIST)) as f:
+                segments = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        except OSError:
+            return
+        for segment in segments:
+            if segment not in published_segments:
+                published_segments.add(segment)
+                job_manager.publish(
+                    job, 'segment',
+                    segment_url=f"{params['host_url']}hls/{os.path.basename(hls_path)}/{segment}",
+                    playlist_url=hls_url(params['host_url'], os.path.basename(hls_path)),
+                    segments=len(published_segments))
+
+    def on_progress(done, total):
+        job_manager.update_progress(job, done, total)
+        publish_segments()
 
-def send_direct_alert(phone_number, detection_type, confidence, filename=None):
     try:
-        if not phone_number:
-            logger.warning("No phone number provided for alert")
-            return False
+        frame_stats = {}
+        # Annotated frames are encoded once, straight to web-playable H.264.
+        # Detections come back merged into incidents. With CHUNK_WORKERS set,
+        # long videos are split across worker processes.
+        detect = run_detection_chunked if CHUNK_WORKERS else run_detection
+        detection_results = detect(
+            input_path, processed_path, stats=frame_stats, progress=on_progress,
+            cancel_event=job.cancel_event, detail_path=detail_path, hls_dir=hls_path,
+            on_incident=on_incident)
+        detection_results = convert_numpy_types(detection_results)
+        publish_segments(force=True)
+        frame_stats = convert_numpy_types(frame_stats)
+        logger.info(f"Frame stats: {frame_stats}")
+        logger.info(f"Detected {len(detection_results)} incidents in {filename}")
+        if first_detection:
+            frame_stats['time_to_first_detection'] = round(first_detection[0], 3)
 
-        message = f"""🚨 SECURITY ALERT 🚨
-        Type: {detection_type.upper()}
-        Time: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}"""
-        if filename:
-            message += f"\nFile: {filename}"
+        if not os.path.exists(processed_path):
+            raise RuntimeError("Processed video not created")
 
-        logger.info(f"Attempting to send alert to {phone_number}")
+        result_cache.put(params['cache_key'], {
+            'processed_file': processed_filename,
+            'detail_file': detail_file,
+            'hls_dir': os.path.basename(hls_path) if hls_path else None,
+            'detection_results': detection_results,
+            'frame_stats': frame_stats
+        })
+        result_cache.evict(in_use=unfinished_job_files())
+        
+        result = {
+            'status': 'completed',
+            'video_url': f"{params['host_url']}processed/{processed_filename}",
+            'processed_file': processed_filename,
+            'detection_results': detection_results,
+            'frame_stats': frame_stats
+        }
+        if detail_file:
+            result['detail_url'] = f"{params['host_url']}detections/{detail_file}"
+        if hls_path:
+            result['hls_url'] = hls_url(params['host_url'], os.path.basename(hls_path))
+        return result
 
-        message = twilio_client.messages.create(
-            body=message,
-            from_=os.getenv('TWILIO_PHONE_NUMBER'),
-            to=phone_number
-        )
+    except Exception as e:
+        logger.error(f"Processing failed for job {job.id}: {str(e)}")
+        for path in (processed_path, detail_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        if hls_path:
+            shutil.rmtree(hls_path, ignore_errors=True)
+        raise
 
-        logger.info(f"Twilio response: SID: {message.sid}, Status: {message.status}")
+    finally:
+        remove_upload(job)
 
-        return True
+def remove_upload(job):
+    """Delete the job's uploaded input once it has run or was cancelled in the queue"""
+    input_path = job.params['input_path']
+    try:
+        if os.path.exists(input_path):
+            os.remove(input_path)
     except Exception as e:
-        logger.error(f"Twilio API Error: {str(e)}")
-        if hasattr(e, 'more_info'):
-            logger.error(f"Twilio Error Details: {e.more_info}")
-        return False
+        logger.warning(f"Could not remove {input_path}: {str(e)}")
+
+def emit_job_update(job):
+    """Push job status and progress to every connected client"""
+    socketio.emit('job_progress', job.to_dict())
+
+def emit_job_event(job, event):
+    """Push a partial result (incident or encoded segment) as soon as it is available"""
+    socketio.emit(f"job_{event['event']}", event)
+
+def start_services():
+    """Folders, logging, stream and job workers, alert client and metrics.
+
+    Called when the server starts instead of at import: the spawn workers of
+    chunked.py re-import the main module (as __mp_main__) to find their
+    target and must not start job threads or Twilio clients of their own.
+    """
+    global stream_manager, frame_sender, alert_dispatcher, job_manager, result_cache
+
+    # Create directories if they don't exist
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+    os.makedirs('debug', exist_ok=True)
+
+    # Logging configuration
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('app.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+    stream_manager = StreamManager()
+    frame_sender = FrameSender(socketio)
+    alert_dispatcher = AlertDispatcher()
+    job_manager = JobManager(process_job, on_update=emit_job_update, on_event=emit_job_event,
+                             on_discard=remove_upload)
+    result_cache = ResultCache([PROCESSED_FOLDER, UPLOAD_FOLDER])
+
+    metrics.ACTIVE_STREAMS.set_function(lambda: len(stream_manager.active_sessions()))
+    metrics.JOBS.set_function(job_manager.counts)
+    metrics.ALERTS_PENDING.set_function(alert_dispatcher.pending)
+    metrics.MODEL_READY.set_function(
+        lambda: {kind: int(model['status'] == 'ready') for kind, model in model_registry.models.items()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health')
+def health():
+    """Liveness: the process is up, whether or not the models are loaded"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready')
+def ready():
+    """Readiness: 200 once both models are loaded and warmed up, 503 until then"""
+    status = model_registry.describe()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/models/reload', methods=['POST'])
+def reload_models():
+    """Load new weights and swap them in; the running models keep serving meanwhile"""
+    kinds = (request.get_json(silent=True) or {}).get('models')
+    try:
+        return jsonify(model_registry.reload(kinds))
+    except RuntimeError as e:
+        logger.error(f"Model reload failed: {e}")
+        return jsonify(dict(model_registry.describe(), error=str(e))), 500
+
+def job_response(job):
+    """Final job payload in the shape /process-video used to return synchronously"""
+    if job.status == 'completed':
+        return jsonify(dict(job.result, job_id=job.id))
+    if job.finished:
+        return jsonify({
+            'status': job.status,
+            'job_id': job.id,
+            'error': job.error or 'Job cancelled',
+            'message': 'Video processing failed'
+        }), 500 if job.status == 'failed' else 409
+    return jsonify(job.to_dict()), 202
 
 @app.route('/process-video', methods=['POST'])
 def process_video():
@@ -448,83 +636,129 @@ def process_video():
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({'status': 'failed', 'error': 'Invalid file'}), 400
 
-    file.seek(0, os.SEEK_END)
-    file_size = file.tell()
-    file.seek(0)
-    if file_size > MAX_FILE_SIZE:
-        return jsonify({'status': 'failed', 'error': 'File too large'}), 400
-
     filename = secure_filename(file.filename)
     unique_id = str(uuid.uuid4())
     processed_filename = f"{unique_id}_{filename}"
-
-    input_path = os.path.join(UPLOAD_FOLDER, filename)
-    temp_output = os.path.join(PROCESSED_FOLDER, f"temp_{processed_filename}")
-    processed_path = os.path.join(PROCESSED_FOLDER, processed_filename)
+    input_path = os.path.join(UPLOAD_FOLDER, processed_filename)
 
     try:
-        file.save(input_path)
-        logger.info(f"Saved input file to {input_path}")
+        # Hash while streaming to disk so repeat uploads are served from cache
+        content_hash, file_size = save_upload(file.stream, input_path, MAX_FILE_SIZE)
+        logger.info(f"Saved input file to {input_path} ({file_size} bytes, sha256 {content_hash})")
+
+        # ?detail=1 also writes every per-frame detection as NDJSON
+        detail = (request.values.get('detail') or '').lower() in ('1', 'true', 'yes')
+        cache_key = ResultCache.key(content_hash, model_version())
+        cached = result_cache.get(cache_key)
+        if cached is not None and detail and not (
+                cached.get('detail_file') and os.path.exists(os.path.join(PROCESSED_FOLDER, cached['detail_file']))):
+            cached = None
+        if cached is not None:
+            os.remove(input_path)
+            logger.info(f"Cache hit for {filename}: {cached['processed_file']}")
+            response = dict(
+                cached,
+                status='completed',
+                cached=True,
+                video_url=f"{request.host_url}processed/{cached['processed_file']}"
+            )
+            if cached.get('detail_file'):
+                response['detail_url'] = f"{request.host_url}detections/{cached['detail_file']}"
+            if cached.get('hls_dir') and os.path.isdir(os.path.join(PROCESSED_FOLDER, cached['hls_dir'])):
+                response['hls_url'] = hls_url(request.host_url, cached['hls_dir'])
+            return jsonify(response)
 
         if not validate_video(input_path):
             raise RuntimeError("Invalid input video file")
 
-        detection_results = run_detection(input_path, temp_output)
-        detection_results = convert_numpy_types(detection_results)
-        logger.info(f"Detection results: {detection_results}")
-
-        violence_detected = False
-        weapons_detected = False
-        confidence = 0.0
-
-        for result in detection_results:
-            if isinstance(result, dict):
-                if result.get('type') == 'violence':
-                    violence_detected = True
-                    confidence = max(confidence, result.get('confidence', 0))
-                elif result.get('type') == 'weapon':
-                    weapons_detected = True
-                    confidence = max(confidence, result.get('confidence', 0))
-
-        if violence_detected or weapons_detected:
-            send_direct_alert(
-                phone_number=request.form.get('contact_phone', os.getenv('DEFAULT_ALERT_PHONE')),
-                detection_type="violence" if violence_detected else "weapon",
-                confidence=confidence,
-                filename=filename
-            )
-
-        if not convert_to_web_format(temp_output, processed_path):
-            raise RuntimeError("Video format conversion failed")
-
-        if not os.path.exists(processed_path):
-            raise RuntimeError("Processed video not created")
-        
-        video_url = f"{request.host_url}processed/{processed_filename}"
-        return jsonify({
-            'status': 'completed',
-            'video_url': video_url,
-            'processed_file': processed_filename,
-            'detection_results': detection_results
-        })
-
+        job = job_manager.submit(
+            cache_key=cache_key,
+            filename=filename,
+            input_path=input_path,
+            processed_filename=processed_filename,
+            detail=detail,
+            contact_phone=request.form.get('contact_phone', os.getenv('DEFAULT_ALERT_PHONE')),
+            host_url=request.host_url
+        )
+    except UploadTooLarge as e:
+        return jsonify({'status': 'failed', 'error': str(e)}), 400
+    except JobQueueFull as e:
+        os.remove(input_path)
+        return jsonify({'status': 'failed', 'error': str(e)}), 503
     except Exception as e:
         logger.error(f"Processing failed: {str(e)}")
+        if os.path.exists(input_path):
+            os.remove(input_path)
         return jsonify({
             'status': 'failed',
             'error': str(e),
             'message': 'Video processing failed'
         }), 500
 
-    finally:
-        for path in [input_path, temp_output]:
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except Exception as e:
-                logger.warning(f"Could not remove {path}: {str(e)}")
+    logger.info(f"Queued job {job.id} for {filename}")
+
+    # ?wait=1 keeps the old blocking behaviour for clients that need it
+    if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+        job.done_event.wait()
+        return job_response(job)
+
+    return jsonify({
+        'status': 'queued',
+        'job_id': job.id,
+        'status_url': f"{request.host_url}jobs/{job.id}",
+        'events_url': f"{request.host_url}jobs/{job.id}/events",
+        'result_url': f"{request.host_url}jobs/{job.id}/result"
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Partial results as NDJSON while the job runs, ending with the final status"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        sent = 0
+        while True:
+            finished = job.finished
+            events = job.wait_events(sent, timeout=EVENT_STREAM_KEEPALIVE)
+            for event in events:
+                yield json.dumps(event) + '\n'
+            sent += len(events)
+            if finished and not events:
+                yield json.dumps(dict(job.to_dict(), event='status')) + '\n'
+                return
+            if not events and not job.finished:
+                yield '\n'  # keeps proxies from closing an idle stream
+
+    return Response(generate(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return job_response(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
 
 if __name__ == '__main__':
+    start_services()
+    model_registry.start()
     socketio.run(app, 
                 host='0.0.0.0', 
                 port=5000, 
@@ -0,0 +1,312 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from adaptive import AdaptiveController
+from main import IMG_SIZE, ViolenceState, infer_violence_batch, infer_weapons_batch
+from motion import MotionGate
+from preprocessing import FramePreprocessor
+from tracking import WeaponTracker
+from metrics import FRAME_READ_RETRIES, FRAMES_PROCESSED, STAGE_SECONDS
+
+# =====================
+# Stream sessions and shared inference scheduler
+# =====================
+MAX_STREAMS = int(os.getenv('MAX_STREAMS', '16'))
+STREAM_MAX_FPS = float(os.getenv('STREAM_MAX_FPS', '15'))
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '16'))
+MAX_READ_FAILURES = 3  # failed reads in a row before the stream reports an error
+READ_RETRY_DELAY = 0.05  # seconds between failed camera reads
+
+
+class StreamLimitReached(RuntimeError):
+    pass
+
+
+def is_valid_frame(frame):
+    """Check if frame is valid (not blank)"""
+    if frame is None:
+        return False
+    if np.mean(frame) < 10:  # Very dark frame
+        return False
+    return True
+
+
+def parse_source(source):
+    """Camera indices arrive from clients as strings; RTSP URLs and files stay as-is"""
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def open_capture(source):
+    if isinstance(source, int):
+        capture = cv2.VideoCapture(source, cv2.CAP_DSHOW)  # Use DirectShow for Windows compatibility
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        capture.set(cv2.CAP_PROP_FPS, 30)
+    else:
+        capture = cv2.VideoCapture(source)
+    return capture
+
+
+class StreamSession:
+    """Capture, sequence and motion state for one camera/stream.
+
+    A session with no source is fed by clients through push() instead of
+    reading from a capture. Captures are drained by a reader thread into the
+    same single-frame slot, so the scheduler always gets the newest frame and
+    stale frames never queue up in the capture buffer.
+    """
+
+    def __init__(self, stream_id, source=None, max_fps=None):
+        self.stream_id = stream_id
+        self.source = parse_source(source)
+        self.max_fps = float(max_fps or STREAM_MAX_FPS)
+        self.capture = None
+        self.violence_state = ViolenceState()
+        self.motion_gate = MotionGate()
+        self.weapon_tracker = WeaponTracker()
+        self.controller = AdaptiveController(self.max_fps)
+        self.subscribers = set()
+        self.detectors = set()
+        self.last_verdict = ((False, 0), [])
+        self.next_due = 0.0
+        self.frame_count = 0
+        self.read_failures = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._reader = None
+        self._stop = threading.Event()
+
+    @property
+    def pushed(self):
+        return self.source is None
+
+    @property
+    def detection_active(self):
+        return bool(self.detectors)
+
+    def open(self):
+        if self.pushed:
+            return True
+        self.capture = open_capture(self.source)
+        if not self.capture.isOpened():
+            self.release()
+            return False
+        # Warm-up camera
+        for _ in range(5):
+            self.capture.read()
+        self._stop.clear()
+        self._reader = threading.Thread(target=self._read_loop, name=f"capture-{self.stream_id}", daemon=True)
+        self._reader.start()
+        return True
+
+    def is_open(self):
+        if self.pushed:
+            return True
+        return self.capture is not None and self.capture.isOpened()
+
+    def push(self, frame, captured_at=None):
+        # Only the newest frame is kept
+        with self._lock:
+            self._pending = (frame, captured_at or time.time())
+
+    def _read_loop(self):
+        capture = self.capture
+        while not self._stop.is_set():
+            with STAGE_SECONDS.time(stage='decode'):
+                success, frame = capture.read()
+            if success and is_valid_frame(frame):
+                self.read_failures = 0
+                self.push(frame)
+                continue
+            self.read_failures += 1
+            FRAME_READ_RETRIES.inc()
+            self._stop.wait(READ_RETRY_DELAY)
+
+    def has_frame(self):
+        return self._pending is not None
+
+    def read(self):
+        """Return (newest frame scaled to the current quality level, capture time), or (None, None)"""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is None:
+            return None, None
+        frame, captured_at = pending
+        max_width = self.controller.max_width
+        if max_width and frame.shape[1] > max_width:
+            height = int(frame.shape[0] * max_width / frame.shape[1])
+            frame = cv2.resize(frame, (max_width, height), interpolation=cv2.INTER_AREA)
+        return frame, captured_at
+
+    def frame_done(self, now, lag, cost):
+        """Report a delivered frame to the quality controller"""
+        if self.controller.frame_done(now, lag, cost):
+            # Frame size may have changed: motion references and track boxes are stale
+            self.motion_gate.reset()
+            self.weapon_tracker.reset()
+
+    def release(self):
+        self._stop.set()
+        if self._reader is not None:
+            self._reader.join(timeout=2.0)
+            self._reader = None
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+        with self._lock:
+            self._pending = None
+        self.violence_state.clear()
+        self.motion_gate.reset()
+
+
+class StreamManager:
+    """Owns every stream session and batches their frames into shared model calls.
+
+    Each step() picks, in round-robin order, up to batch_size sessions whose
+    fps cap allows another frame, reads one frame from each and runs both
+    models once for the whole batch.
+    """
+
+    def __init__(self, max_streams=MAX_STREAMS, batch_size=SCHEDULER_BATCH_SIZE):
+        self.max_streams = max_streams
+        self.batch_size = batch_size
+        self.preprocessor = FramePreprocessor(IMG_SIZE, batch_size)
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self._cursor = 0
+
+    def get(self, stream_id):
+        with self._lock:
+            return self.sessions.get(stream_id)
+
+    def open_stream(self, stream_id, source=None, max_fps=None):
+        with self._lock:
+            session = self.sessions.get(stream_id)
+            if session is None:
+                if len(self.sessions) >= self.max_streams:
+                    raise StreamLimitReached(f"Stream limit reached ({self.max_streams})")
+                session = StreamSession(stream_id, source, max_fps)
+                self.sessions[stream_id] = session
+            elif max_fps:
+                session.max_fps = float(max_fps)
+                session.controller.target_fps = session.max_fps
+            return session
+
+    def close_stream(self, stream_id):
+        with self._lock:
+            session = self.sessions.pop(stream_id, None)
+        if session is not None:
+            session.release()
+        return session
+
+    def remove_client(self, sid):
+        """Drop a client from every session and close the ones nobody uses anymore"""
+        with self._lock:
+            sessions = list(self.sessions.values())
+        closed = []
+        for session in sessions:
+            session.subscribers.discard(sid)
+            session.detectors.discard(sid)
+            if not session.subscribers:
+                self.close_stream(session.stream_id)
+                closed.append(session.stream_id)
+        return closed
+
+    def active_sessions(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+        return [s for s in sessions if s.detection_active and s.is_open()]
+
+    def has_active(self):
+        return bool(self.active_sessions())
+
+    def next_batch(self, now):
+        sessions = self.active_sessions()
+        if not sessions:
+            return []
+        # Rotate the starting stream every round so no stream is always served last
+        start = self._cursor % len(sessions)
+        self._cursor = start + 1
+        ordered = sessions[start:] + sessions[:start]
+        # Streams whose reads keep failing are picked too, so the error gets reported
+        due = [s for s in ordered
+               if now >= s.next_due and (s.has_frame() or s.read_failures >= MAX_READ_FAILURES)]
+        return due[:self.batch_size]
+
+    def seconds_until_due(self, now=None):
+        now = now or time.time()
+        sessions = self.active_sessions()
+        if not sessions:
+            return 0
+        return max(0.0, min(s.next_due for s in sessions) - now)
+
+    def _track_weapons(self, inferred, weapon_inputs, now):
+        # Streams whose tracker is due, or that lose a track while being
+        # propagated, share one YOLO batch; the rest only run their tracker
+        trackers = [result['session'].weapon_tracker for result in inferred]
+        weapons = [None if tracker.due(now) else tracker.propagate(frame, now)
+                   for tracker, frame in zip(trackers, weapon_inputs)]
+        detect = [i for i, boxes in enumerate(weapons) if boxes is None]
+        if detect:
+            detections = infer_weapons_batch([weapon_inputs[i] for i in detect], [now] * len(detect))
+            for i, boxes in zip(detect, detections):
+                weapons[i] = trackers[i].update(weapon_inputs[i], boxes, now)
+        return weapons
+
+    def step(self):
+        """Process one batch; returns a result dict per session served.
+
+        Each frame's result carries its capture time and its share of the
+        step's processing time, for the session's quality controller.
+        """
+        now = time.time()
+        results = []
+        inferred = []
+        for session in self.next_batch(now):
+            session.next_due = now + 1.0 / session.max_fps
+            frame, captured_at = session.read()
+            if frame is None:
+                if session.read_failures >= MAX_READ_FAILURES:
+                    session.read_failures = 0
+                    results.append({'session': session, 'error': 'Failed to get valid frame'})
+                continue
+
+            session.frame_count += 1
+            FRAMES_PROCESSED.inc(source='live')
+            # Stride first: the motion gate only sees (and keeps its reference from)
+            # frames the stride would infer, so a scene change isn't absorbed unseen
+            infer = session.controller.should_infer() and session.motion_gate.should_infer(frame)
+            result = {'session': session, 'frame': frame, 'error': None, 'captured_at': captured_at,
+                      'skipped': not infer}
+            results.append(result)
+            if not result['skipped']:
+                inferred.append(result)
+
+        # Every delivered frame advances its stream's violence window (skipped
+        # frames repeat the last embedding, see main.ViolenceState); only the
+        # inferred ones are encoded and get new weapon boxes
+        served = [result for result in results if result['error'] is None]
+        if served:
+            violence_inputs, weapon_inputs = self.preprocessor.prepare_batch(
+                [result['frame'] for result in inferred])
+            violence = infer_violence_batch(violence_inputs,
+                                            [result['session'].violence_state for result in served],
+                                            [not result['skipped'] for result in served])
+            weapons = iter(self._track_weapons(inferred, weapon_inputs, now))
+            for result, violence_raw in zip(served, violence):
+                session = result['session']
+                weapons_raw = session.last_verdict[1] if result['skipped'] else next(weapons)
+                session.last_verdict = (violence_raw, weapons_raw)
+
+        cost = (time.time() - now) / max(1, len(results))
+        for result in results:
+            if result['error'] is None:
+                result['violence'], result['weapons'] = result['session'].last_verdict
+                result['cost'] = cost
+        return results
@@ -0,0 +1,24 @@
+import os
+import sys
+
+# The stub backends need no weights, so the pipeline runs without TensorFlow,
+# PyTorch or the model files. Set before the Backend modules read them.
+os.environ.setdefault('VIOLENCE_BACKEND', 'stub')
+os.environ.setdefault('WEAPON_BACKEND', 'stub')
+os.environ.setdefault('MODEL_WARMUP', '0')
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(BACKEND_DIR)
+FIGHT_VIDEO = os.path.join(REPO_DIR, 'fight.mp4')
+sys.path.insert(0, BACKEND_DIR)
+
+
+def write_clip(path, frames, size=(320, 240), fps=25):
+    """Write BGR frames (uint8 arrays) as an MJPG AVI that cv2 can read back"""
+    import cv2
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    for frame in frames:
+        out.write(frame)
+    out.release()
+    return path
@@ -0,0 +1,50 @@
+from incidents import IncidentAggregator
+from main import record_detections, run_detection
+from test_motion_gating import flicker_clip
+
+FPS = 25
+
+
+def feed(aggregator, frames, detected, clock=None):
+    """One frame at a time, the way run_detection drives the aggregator"""
+    for frame in range(frames):
+        frame_time = frame / FPS
+        if clock is not None:
+            clock.append(frame_time)
+        aggregator.advance(frame_time)
+        record_detections(aggregator.add, frame, frame_time, frame in detected, 0.9, [])
+
+
+def test_incident_closes_once_the_gap_passes_without_detections():
+    clock = []
+    events = []
+    aggregator = IncidentAggregator(gap_seconds=1.0, listener=lambda event, incident: events.append(
+        (event, incident['end_time'], clock[-1])))
+    # Detections up to 0.36 s, then 100 s of frames with nothing detected
+    feed(aggregator, 100 * FPS, detected=range(10), clock=clock)
+
+    assert [event for event, _, _ in events] == ['opened', 'closed']
+    _, end_time, closed_at = events[1]
+    assert end_time == 0.36
+    # Closed on the first frame more than the gap after the last detection
+    assert 1.0 < closed_at - end_time <= 1.0 + 1.0 / FPS
+
+
+def test_close_all_closes_the_last_incidents():
+    events = []
+    aggregator = IncidentAggregator(gap_seconds=1.0, listener=lambda event, incident: events.append(event))
+    feed(aggregator, 50, detected=range(40, 50))
+
+    assert events == ['opened']
+    aggregator.close_all()
+    assert events == ['opened', 'closed']
+    assert [incident['end_frame'] for incident in aggregator.incidents()] == [49]
+
+
+def test_run_detection_closes_every_incident(tmp_path):
+    events = []
+    video_path = flicker_clip(str(tmp_path / 'flicker.avi'))
+    incidents = run_detection(video_path, None, on_incident=lambda event, incident: events.append(event))
+
+    assert incidents
+    assert events.count('opened') == events.count('closed') == len(incidents)
@@ -0,0 +1,18 @@
+import pytest
+
+import inference_server
+
+
+def test_serve_refuses_to_start_without_authkey():
+    with pytest.raises(RuntimeError, match='INFERENCE_AUTHKEY'):
+        inference_server.serve('127.0.0.1:0', '', 'stub', 'stub')
+
+
+def test_client_refuses_to_connect_without_authkey():
+    with pytest.raises(RuntimeError, match='INFERENCE_AUTHKEY'):
+        inference_server.InferenceClient('127.0.0.1:1', '')
+
+
+def test_default_address_is_loopback():
+    assert inference_server.parse_address(inference_server.INFERENCE_SERVER)[0] == '127.0.0.1'
+    assert inference_server.parse_address(':50055') == ('127.0.0.1', 50055)
@@ -0,0 +1,41 @@
+import numpy as np
+
+import motion
+from conftest import write_clip
+from main import run_detection
+
+MOTION_START, MOTION_END, CLIP_FRAMES = 20, 80, 120
+
+
+def flicker_clip(path):
+    """A large block jumping between two spots from MOTION_START to MOTION_END, static otherwise"""
+    frames = []
+    for i in range(CLIP_FRAMES):
+        frame = np.full((240, 320, 3), 40, np.uint8)
+        if MOTION_START <= i < MOTION_END:
+            x = 0 if i % 2 else 160
+            frame[60:180, x:x + 120] = 255
+        frames.append(frame)
+    return write_clip(path, frames)
+
+
+def violence_spans(video_path, gating, monkeypatch):
+    monkeypatch.setattr(motion, 'MOTION_GATING', gating)
+    stats = {}
+    incidents = run_detection(video_path, None, stats=stats)
+    spans = [(incident['start_frame'], incident['end_frame'])
+             for incident in incidents if incident['type'] == 'violence']
+    return spans, stats
+
+
+def test_gated_incidents_match_ungated(tmp_path, monkeypatch):
+    video_path = flicker_clip(str(tmp_path / 'flicker.avi'))
+    ungated, ungated_stats = violence_spans(video_path, False, monkeypatch)
+    gated, gated_stats = violence_spans(video_path, True, monkeypatch)
+
+    assert ungated_stats['frames_skipped'] == 0
+    assert gated_stats['frames_skipped'] > 0
+    assert len(ungated) == 1
+    assert gated == ungated
+    # The incident ends within one sequence window of the motion stopping
+    assert MOTION_END <= ungated[0][1] < MOTION_END + 10
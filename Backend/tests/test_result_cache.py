@@ -0,0 +1,43 @@
+import os
+import time
+
+from result_cache import ResultCache
+
+
+def write_file(path, size=1024, age=3600):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    old = time.time() - age
+    os.utime(path, (old, old))
+    return path
+
+
+def test_evict_leaves_files_of_unfinished_jobs(tmp_path):
+    processed, uploads = tmp_path / 'processed', tmp_path / 'uploads'
+    processed.mkdir()
+    uploads.mkdir()
+    cache = ResultCache([str(processed), str(uploads)], cache_folder=str(tmp_path / 'cache'), quota_bytes=0)
+    queued_upload = write_file(str(uploads / 'queued.mp4'))
+    orphan_upload = write_file(str(uploads / 'orphan.mp4'))
+    old_output = write_file(str(processed / 'old.mp4'))
+
+    removed = cache.evict(in_use=[queued_upload])
+
+    assert sorted(removed) == sorted([orphan_upload, old_output])
+    assert os.path.exists(queued_upload)
+
+
+def test_cache_hit_keeps_served_files_untouched(tmp_path):
+    processed = tmp_path / 'processed'
+    processed.mkdir()
+    cache = ResultCache([str(processed)], cache_folder=str(tmp_path / 'cache'), quota_bytes=1024)
+    used = write_file(str(processed / 'used.mp4'), age=7200)
+    unused = write_file(str(processed / 'unused.mp4'), age=3600)
+    cache.put('used', {'processed_file': 'used.mp4', 'hls_dir': None})
+    mtime = os.stat(used).st_mtime
+
+    assert cache.get('used')['processed_file'] == 'used.mp4'
+    assert os.stat(used).st_mtime == mtime
+    # Older on disk, but just served from the cache: the other file goes first
+    assert cache.evict() == [unused]
+    assert os.path.exists(used)
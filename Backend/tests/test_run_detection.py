@@ -0,0 +1,30 @@
+import os
+
+import cv2
+import pytest
+
+from conftest import FIGHT_VIDEO
+from main import run_detection
+
+
+@pytest.mark.skipif(not os.path.exists(FIGHT_VIDEO), reason='fight.mp4 not available')
+def test_run_detection_on_headless_opencv(tmp_path):
+    # Real cv2 (the headless build in requirements.txt), no stubs
+    stats = {}
+    output_path = str(tmp_path / 'out.mp4')
+    # The OpenCV encoder, so the test doesn't need ffmpeg on PATH
+    incidents = run_detection(FIGHT_VIDEO, output_path, stats=stats, encoder='opencv')
+
+    assert isinstance(incidents, list)
+    assert stats['frames_total'] == 84
+    cap = cv2.VideoCapture(output_path)
+    assert cap.isOpened()
+    assert int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) == 84
+    cap.release()
+
+
+@pytest.mark.skipif(not os.path.exists(FIGHT_VIDEO), reason='fight.mp4 not available')
+def test_run_detection_without_output():
+    stats = {}
+    run_detection(FIGHT_VIDEO, None, stats=stats)
+    assert stats['frames_total'] == 84
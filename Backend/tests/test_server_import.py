@@ -0,0 +1,16 @@
+import os
+import runpy
+import threading
+
+from conftest import BACKEND_DIR
+
+
+def test_worker_reimport_starts_nothing(tmp_path, monkeypatch):
+    # What a chunked.py spawn worker does with the server's main module
+    monkeypatch.chdir(tmp_path)
+    threads = threading.active_count()
+    namespace = runpy.run_path(os.path.join(BACKEND_DIR, 'server.py'), run_name='__mp_main__')
+
+    assert threading.active_count() == threads
+    assert namespace['job_manager'] is None and namespace['alert_dispatcher'] is None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,245 @@
+import os
+
+import cv2
+import numpy as np
+
+from metrics import WEAPON_TRACK_EVENTS
+
+# =====================
+# Weapon tracking between detections
+# =====================
+# Full-frame YOLO runs every WEAPON_DETECT_INTERVAL inferred frames. In
+# between, each track's box is moved by its constant-velocity prediction
+# and re-verified with template matching in a small search window around it.
+# A track that fails verification triggers a full detection on that frame.
+# The interval counts inferred frames, which motion gating can space far
+# apart, so detection also runs once WEAPON_DETECT_MAX_SECONDS have passed
+# since the last one; a weapon entering a quiet scene is found within that time.
+# Detections are matched to tracks by IoU, so a weapon keeps its track_id for
+# as long as it stays in view.
+WEAPON_DETECT_INTERVAL = max(1, int(os.getenv('WEAPON_DETECT_INTERVAL', '5')))  # 1 detects every frame
+WEAPON_DETECT_MAX_SECONDS = float(os.getenv('WEAPON_DETECT_MAX_SECONDS', '0.5'))  # frame time between detections
+TRACK_IOU_THRESHOLD = float(os.getenv('TRACK_IOU_THRESHOLD', '0.3'))
+TRACK_MAX_MISSES = int(os.getenv('TRACK_MAX_MISSES', '2'))  # detections a track may miss before it is dropped
+TRACK_VERIFY_THRESHOLD = float(os.getenv('TRACK_VERIFY_THRESHOLD', '0.6'))  # normalized correlation
+TRACK_VERIFY_WIDTH = 320  # frames are verified at this width
+TRACK_SEARCH_MARGIN = 0.5  # search window padding, as a fraction of the box size
+TRACK_MIN_TEMPLATE = 6  # boxes smaller than this (verify pixels) are only predicted
+VELOCITY_GAIN = 0.5  # weight of the newest measurement in the velocity estimate
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    def __init__(self, track_id, box, confidence):
+        self.id = track_id
+        self.box = np.asarray(box, np.float32)
+        self.velocity = np.zeros(2, np.float32)
+        self.confidence = confidence
+        self.misses = 0
+        self.age = 0  # frames since the box was last measured
+        self.template = None
+
+    def predicted(self):
+        dx, dy = self.velocity * (self.age + 1)
+        return self.box + np.array([dx, dy, dx, dy], np.float32)
+
+    def measure(self, box):
+        box = np.asarray(box, np.float32)
+        shift = ((box[:2] + box[2:]) - (self.box[:2] + self.box[2:])) / 2 / (self.age + 1)
+        self.velocity += VELOCITY_GAIN * (shift - self.velocity)
+        self.box = box
+        self.age = 0
+
+    def to_box(self, current_time):
+        return {
+            'coordinates': tuple(int(round(v)) for v in self.box),
+            'confidence': float(self.confidence),
+            'timestamp': current_time,
+            'track_id': self.id,
+        }
+
+
+class WeaponTracker:
+    """Tracks for one stream; feed it every inferred frame in order.
+
+    Frames are RGB (the weapon model input). Call due() to learn whether the
+    next frame needs full detection, then update() with that frame's
+    detections, or propagate() otherwise; propagate() returns None when a
+    track was lost and the frame should be detected after all.
+    """
+
+    def __init__(self, interval=WEAPON_DETECT_INTERVAL, first_id=1, max_seconds=WEAPON_DETECT_MAX_SECONDS):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.tracks = []
+        self.next_id = first_id
+        self.since_detection = None  # None until the first detection
+        self.detected_at = None  # frame time of the last detection
+
+    def _due(self, since, detected_at, current_time):
+        return (since is None or since + 1 >= self.interval
+                or (current_time is not None and detected_at is not None
+                    and current_time - detected_at >= self.max_seconds))
+
+    def due(self, current_time=None):
+        return self._due(self.since_detection, self.detected_at, current_time)
+
+    def plan(self, current_times):
+        """due() for the next frames (given by their times), assuming no track is lost"""
+        since, detected_at = self.since_detection, self.detected_at
+        planned = []
+        for current_time in current_times:
+            due = self._due(since, detected_at, current_time)
+            planned.append(due)
+            if due:
+                since, detected_at = 0, current_time if current_time is not None else detected_at
+            else:
+                since += 1
+        return planned
+
+    def _gray(self, frame):
+        scale = min(1.0, TRACK_VERIFY_WIDTH / frame.shape[1])
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return gray, scale
+
+    @staticmethod
+    def _crop(gray, box, scale):
+        height, width = gray.shape
+        x1, y1, x2, y2 = (np.asarray(box) * scale).round().astype(int)
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(width, x2), min(height, y2)
+        if x2 - x1 < TRACK_MIN_TEMPLATE or y2 - y1 < TRACK_MIN_TEMPLATE:
+            return None
+        return gray[y1:y2, x1:x2].copy()
+
+    def update(self, frame, detections, current_time=None):
+        """Match a full detection's boxes to tracks; returns boxes with track_id"""
+        WEAPON_TRACK_EVENTS.inc(event='detection')
+        self.since_detection = 0
+        if current_time is not None:
+            self.detected_at = current_time
+        gray, scale = self._gray(frame)
+        pairs = sorted(((iou(track.predicted(), det['coordinates']), t, d)
+                        for t, track in enumerate(self.tracks)
+                        for d, det in enumerate(detections)), reverse=True)
+        matched_tracks, matched_detections = set(), {}
+        for overlap, t, d in pairs:
+            if overlap < TRACK_IOU_THRESHOLD:
+                break
+            if t in matched_tracks or d in matched_detections:
+                continue
+            track = self.tracks[t]
+            matched_tracks.add(t)
+            matched_detections[d] = track.id
+            track.measure(detections[d]['coordinates'])
+            track.confidence = detections[d]['confidence']
+            track.misses = 0
+            track.template = self._crop(gray, track.box, scale)
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                track.age += 1
+                if track.misses > TRACK_MAX_MISSES:
+                    WEAPON_TRACK_EVENTS.inc(event='ended')
+                    continue
+            survivors.append(track)
+        self.tracks = survivors
+
+        for d, det in enumerate(detections):
+            if d not in matched_detections:
+                track = Track(self.next_id, det['coordinates'], det['confidence'])
+                track.template = self._crop(gray, track.box, scale)
+                self.next_id += 1
+                self.tracks.append(track)
+                matched_detections[d] = track.id
+                WEAPON_TRACK_EVENTS.inc(event='started')
+
+        # Tracks that missed this detection are kept but not reported
+        return [dict(det, track_id=matched_detections[d]) for d, det in enumerate(detections)]
+
+    def propagate(self, frame, current_time=None):
+        """Predict and verify every reported track; None if any of them was lost"""
+        if self.since_detection is not None:
+            self.since_detection += 1
+        visible = []
+        for track in self.tracks:
+            if track.misses == 0:
+                visible.append(track)
+            else:
+                track.age += 1
+        if not visible:
+            return []
+        gray, scale = self._gray(frame)
+        for track in visible:
+            predicted = track.predicted()
+            if track.template is None:
+                track.box, track.age = predicted, 0
+                continue
+            if not self._verify(gray, scale, track, predicted):
+                WEAPON_TRACK_EVENTS.inc(event='lost')
+                return None
+        WEAPON_TRACK_EVENTS.inc(event='propagated')
+        return [track.to_box(current_time) for track in visible]
+
+    def _verify(self, gray, scale, track, predicted):
+        template = track.template
+        t_height, t_width = template.shape
+        height, width = gray.shape
+        cx, cy = (predicted[:2] + predicted[2:]) / 2 * scale
+        pad_x, pad_y = t_width * (0.5 + TRACK_SEARCH_MARGIN), t_height * (0.5 + TRACK_SEARCH_MARGIN)
+        x1, y1 = max(0, int(cx - pad_x)), max(0, int(cy - pad_y))
+        x2, y2 = min(width, int(cx + pad_x) + 1), min(height, int(cy + pad_y) + 1)
+        if x2 - x1 < t_width or y2 - y1 < t_height:
+            return False
+        scores = cv2.matchTemplate(gray[y1:y2, x1:x2], template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (bx, by) = cv2.minMaxLoc(scores)
+        if best < TRACK_VERIFY_THRESHOLD:
+            return False
+        box_width, box_height = track.box[2] - track.box[0], track.box[3] - track.box[1]
+        left, top = (x1 + bx) / scale, (y1 + by) / scale
+        track.measure((left, top, left + box_width, top + box_height))
+        return True
+
+    def force_detection(self):
+        """Run full detection on the next frame; existing tracks keep their ids"""
+        self.since_detection = None
+
+    def reset(self):
+        self.tracks = []
+        self.since_detection = None
+        self.detected_at = None
+
+
+def track_weapons(tracker, rgb_frames, current_times, detect):
+    """Weapon boxes for consecutive inferred frames of one stream.
+
+    detect(rgb_frames, current_times) is the batched full detector; the frames
+    the tracker plans to detect go to it in one call, and frames where
+    verification loses a track are detected on the spot.
+    """
+    planned = tracker.plan(current_times)
+    indices = [i for i, due in enumerate(planned) if due]
+    detected = dict(zip(indices, detect([rgb_frames[i] for i in indices],
+                                        [current_times[i] for i in indices]))) if indices else {}
+    results = []
+    for i, frame in enumerate(rgb_frames):
+        if i in detected or tracker.due(current_times[i]):
+            detections = detected[i] if i in detected else detect([frame], [current_times[i]])[0]
+            results.append(tracker.update(frame, detections, current_times[i]))
+            continue
+        boxes = tracker.propagate(frame, current_times[i])
+        if boxes is None:
+            boxes = tracker.update(frame, detect([frame], [current_times[i]])[0], current_times[i])
+        results.append(boxes)
+    return results
@@ -0,0 +1,341 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+
+from metrics import STAGE_SECONDS
+
+# =====================
+# Video output
+# =====================
+OUTPUT_ENCODER = os.getenv('OUTPUT_ENCODER', 'ffmpeg')  # 'ffmpeg' or 'opencv'
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+DEFAULT_FPS = 25.0
+# Segmented HLS next to the MP4, so players can start before the whole file
+# has downloaded. The ffmpeg writer produces both from one encode (tee muxer).
+HLS_OUTPUT = os.getenv('HLS_OUTPUT', '1') == '1'
+HLS_SEGMENT_SECONDS = int(os.getenv('HLS_SEGMENT_SECONDS', '4'))
+HLS_PLAYLIST = 'index.m3u8'
+
+
+def hls_dir_for(output_path):
+    return f"{os.path.splitext(output_path)[0]}_hls"
+
+
+def _tee_escape(path):
+    return ''.join('\\' + c if c in '\\|[]' else c for c in path)
+
+
+class FFmpegWriter:
+    """Encode raw BGR frames straight to web-playable H.264 MP4.
+
+    Frames are piped into a single ffmpeg libx264 process, so the annotated
+    output is encoded once and no intermediate file is written. With hls_dir
+    the same encode is also written as an HLS playlist and segments, which
+    become playable while encoding is still running.
+    """
+
+    def __init__(self, output_path, fps, width, height, hls_dir=None):
+        if shutil.which(FFMPEG_BINARY) is None:
+            raise RuntimeError("ffmpeg not found on PATH")
+        self.output_path = output_path
+        self.hls_dir = hls_dir
+        self.frame_size = (width, height)
+        self._stderr = tempfile.TemporaryFile()
+        cmd = [
+            FFMPEG_BINARY, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+            '-s', f"{width}x{height}", '-r', f"{fps or DEFAULT_FPS}",
+            '-i', '-',
+            '-an',
+            '-c:v', 'libx264', '-profile:v', 'main',
+            '-pix_fmt', 'yuv420p',
+            '-preset', 'fast', '-crf', '23',
+            '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+        ]
+        if hls_dir:
+            os.makedirs(hls_dir, exist_ok=True)
+            # Keyframes on segment boundaries so every segment starts cleanly
+            cmd += [
+                '-force_key_frames', f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+                '-map', '0:v', '-f', 'tee',
+                f"[f=mp4:movflags=+faststart]{_tee_escape(output_path)}|"
+                f"[f=hls:hls_time={HLS_SEGMENT_SECONDS}:hls_playlist_type=event]"
+                f"{_tee_escape(os.path.join(hls_dir, HLS_PLAYLIST))}"
+            ]
+        else:
+            cmd += ['-movflags', '+faststart', '-f', 'mp4', output_path]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def isOpened(self):
+        return self.process.poll() is None
+
+    def write(self, frame):
+        try:
+            with STAGE_SECONDS.time(stage='ffmpeg_encode'):
+                self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except (BrokenPipeError, ValueError):
+            raise RuntimeError(f"FFmpeg failed: {self._error_output()}")
+
+    def release(self):
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        with STAGE_SECONDS.time(stage='ffmpeg_encode'):
+            returncode = self.process.wait()
+        error = self._error_output()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"FFmpeg failed: {error}")
+
+    def _error_output(self):
+        if self._stderr.closed:
+            return ''
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', errors='replace').strip()
+
+
+def open_video_writer(output_path, fps, width, height, encoder=None, hls_dir=None):
+    # hls_dir only applies to the ffmpeg writer; see package_hls for the rest
+    encoder = encoder or OUTPUT_ENCODER
+    if encoder == 'ffmpeg':
+        return FFmpegWriter(output_path, fps, width, height, hls_dir)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+
+def package_hls(video_path, hls_dir):
+    """Remux a finished video into HLS without re-encoding"""
+    if shutil.which(FFMPEG_BINARY) is None:
+        raise RuntimeError("ffmpeg not found on PATH")
+    os.makedirs(hls_dir, exist_ok=True)
+    with STAGE_SECONDS.time(stage='hls_package'):
+        result = subprocess.run(
+            [FFMPEG_BINARY, '-y', '-loglevel', 'error', '-i', video_path, '-map', '0:v', '-c', 'copy',
+             '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+             os.path.join(hls_dir, HLS_PLAYLIST)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        shutil.rmtree(hls_dir, ignore_errors=True)
+        raise RuntimeError(f"FFmpeg HLS packaging failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+
+
+def concat_videos(segment_paths, output_path, encoder=None):
+    """Join segments written with the same encoder settings, in order.
+
+    ffmpeg segments are joined without re-encoding; anything else is decoded
+    and re-written with OpenCV.
+    """
+    encoder = encoder or OUTPUT_ENCODER
+    if encoder == 'ffmpeg':
+        if shutil.which(FFMPEG_BINARY) is None:
+            raise RuntimeError("ffmpeg not found on PATH")
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as listing:
+            for path in segment_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                listing.write(f"file '{escaped}'\n")
+        try:
+            with STAGE_SECONDS.time(stage='ffmpeg_concat'):
+                result = subprocess.run(
+                    [FFMPEG_BINARY, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                     '-i', listing.name, '-c', 'copy', '-movflags', '+faststart', output_path],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        finally:
+            os.remove(listing.name)
+        if result.returncode != 0:
+            raise RuntimeError(f"FFmpeg concat failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+        return
+
+    out = None
+    try:
+        for path in segment_paths:
+            cap = cv2.VideoCapture(path)
+            if out is None:
+                out = open_video_writer(output_path, cap.get(cv2.CAP_PROP_FPS),
+                                        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), encoder)
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                out.write(frame)
+            cap.release()
+    finally:
+        if out is not None:
+            out.release()
+
+
+# =====================
+# Video input
+# =====================
+# The ffmpeg reader decodes with ffmpeg's own threads and does the downscale
+# and frame-rate decimation inside ffmpeg, so full-resolution frames never
+# reach Python. It mimics the parts of cv2.VideoCapture the pipeline uses.
+VIDEO_READER = os.getenv('VIDEO_READER', 'opencv')  # 'opencv' or 'ffmpeg'
+FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', 'ffprobe')
+DECODE_MAX_WIDTH = int(os.getenv('DECODE_MAX_WIDTH', '0'))  # 0 keeps the source width
+DECODE_FPS = float(os.getenv('DECODE_FPS', '0'))  # 0 keeps every frame
+DECODE_THREADS = int(os.getenv('DECODE_THREADS', '0'))  # 0 lets ffmpeg decide
+PROBE_TIMEOUT = 10
+
+
+def _parse_rate(rate):
+    try:
+        num, _, den = str(rate).partition('/')
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+    return value if value > 0 else 0.0
+
+
+def probe_video(path):
+    """Stream metadata from ffprobe without decoding any frames.
+
+    Returns {'width', 'height', 'fps', 'frames', 'duration', 'codec'}; raises
+    RuntimeError if ffprobe is missing or finds no video stream.
+    """
+    if shutil.which(FFPROBE_BINARY) is None:
+        raise RuntimeError("ffprobe not found on PATH")
+    result = subprocess.run(
+        [FFPROBE_BINARY, '-v', 'error', '-select_streams', 'v:0',
+         '-show_entries', 'stream=width,height,codec_name,avg_frame_rate,r_frame_rate,nb_frames,duration'
+                          ':format=duration',
+         '-of', 'json', path],
+        capture_output=True, timeout=PROBE_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+    info = json.loads(result.stdout or b'{}')
+    streams = info.get('streams') or []
+    if not streams:
+        raise RuntimeError("No video stream found")
+    stream = streams[0]
+    fps = _parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate'))
+    try:
+        duration = float(stream.get('duration') or info.get('format', {}).get('duration') or 0)
+    except ValueError:
+        duration = 0.0
+    frames = int(stream.get('nb_frames') or 0) or int(round(duration * fps))
+    return {
+        'width': int(stream.get('width') or 0),
+        'height': int(stream.get('height') or 0),
+        'fps': fps,
+        'frames': frames,
+        'duration': duration,
+        'codec': stream.get('codec_name'),
+    }
+
+
+class FFmpegReader:
+    """Raw BGR frames from an ffmpeg pipe, optionally scaled and decimated.
+
+    max_width caps the output width (aspect ratio kept, even dimensions) and
+    fps drops frames inside ffmpeg. Frame counts, positions and timestamps
+    are in output frames.
+    """
+
+    def __init__(self, path, max_width=DECODE_MAX_WIDTH, fps=DECODE_FPS, threads=DECODE_THREADS):
+        if shutil.which(FFMPEG_BINARY) is None:
+            raise RuntimeError("ffmpeg not found on PATH")
+        self.path = path
+        self.threads = threads
+        self.process = None
+        self._stderr = None
+        self._start_frame = 0
+        self._frames_read = 0
+        try:
+            info = probe_video(path)
+        except RuntimeError:
+            self.info = None
+            return
+        self.info = info
+        self.source_fps = info['fps'] or DEFAULT_FPS
+        self.fps = min(fps, self.source_fps) if fps else self.source_fps
+        self.width, self.height = info['width'], info['height']
+        if max_width and self.width > max_width:
+            self.height = max(2, int(round(self.height * max_width / self.width / 2)) * 2)
+            self.width = max_width
+        self.frame_count = int(info['frames'] * self.fps / self.source_fps)
+        self._frame_bytes = self.width * self.height * 3
+
+    def _start(self):
+        filters = []
+        if self.fps != self.source_fps:
+            filters.append(f"fps={self.fps}")
+        if (self.width, self.height) != (self.info['width'], self.info['height']):
+            filters.append(f"scale={self.width}:{self.height}:flags=area")
+        cmd = [FFMPEG_BINARY, '-loglevel', 'error', '-threads', str(self.threads)]
+        if self._start_frame:
+            cmd += ['-ss', f"{self._start_frame / self.fps:.6f}"]
+        cmd += ['-i', self.path, '-an', '-sn']
+        if filters:
+            cmd += ['-vf', ','.join(filters)]
+        cmd += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=self._stderr, bufsize=self._frame_bytes)
+
+    def isOpened(self):
+        return self.info is not None and self.width > 0 and self.height > 0
+
+    def read(self):
+        if not self.isOpened():
+            return False, None
+        if self.process is None:
+            self._start()
+        frame = np.empty((self.height, self.width, 3), np.uint8)
+        if self.process.stdout.readinto(memoryview(frame).cast('B')) != self._frame_bytes:
+            return False, None
+        self._frames_read += 1
+        return True, frame
+
+    def get(self, prop):
+        if not self.isOpened():
+            return 0
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.frame_count
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self._start_frame + self._frames_read
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            # Timestamp of the frame last read
+            return max(0, self._start_frame + self._frames_read - 1) / self.fps * 1000
+        return 0
+
+    def set(self, prop, value):
+        # Seeking is only supported before the first read
+        if prop != cv2.CAP_PROP_POS_FRAMES or self.process is not None:
+            return False
+        self._start_frame = max(0, int(value))
+        return True
+
+    def release(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.stdout.close()
+            self.process.wait()
+            self.process = None
+        if self._stderr is not None:
+            self._stderr.close()
+            self._stderr = None
+
+
+def open_video_reader(path, reader=None, max_width=None, fps=None):
+    """FFmpegReader or cv2.VideoCapture, chosen by VIDEO_READER"""
+    reader = reader or VIDEO_READER
+    if reader == 'ffmpeg':
+        return FFmpegReader(path, DECODE_MAX_WIDTH if max_width is None else max_width,
+                            DECODE_FPS if fps is None else fps)
+    return cv2.VideoCapture(path)
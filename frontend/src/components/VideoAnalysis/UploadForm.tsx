@@ -11,7 +11,9 @@ import {
   CardTitle,
 } from "@/components/ui/card";
 import { Textarea } from "@/components/ui/textarea";
-import { Upload } from "lucide-react";
+import { Progress } from "@/components/ui/progress";
+import { Upload, XCircle } from "lucide-react";
+import { io } from "socket.io-client";
 import { supabase } from "@/integrations/supabase/client";
 import { useToast } from "@/hooks/use-toast";
 import { validateVideoFile } from "@/utils/videoValidation";
@@ -19,15 +21,72 @@ import { VideoPreview } from "./VideoPreview";
 import { UploadPlaceholder } from "./UploadPlaceholder";
 import { incrementAnalyticsCounter } from "@/services/analyticsService";
 
+const BACKEND_URL = "http://localhost:5000";
+
 interface UploadFormProps {
   onUploadComplete: (uploadId: string) => void;
 }
 
+// Job state as sent in job_progress events and by GET /jobs/<id>
+interface JobStatus {
+  job_id: string;
+  status: "queued" | "running" | "completed" | "failed" | "cancelled";
+  frames_done: number;
+  frames_total: number;
+  fps: number;
+  error: string | null;
+}
+
+const isFinished = (job: JobStatus) =>
+  ["completed", "failed", "cancelled"].includes(job.status);
+
+// Follows a queued job over Socket.IO until it finishes. job_progress carries
+// status and progress, job_incident each incident as it opens; the status is
+// also fetched on every (re)connect, in case events were missed meanwhile.
+const watchJob = (
+  jobId: string,
+  onProgress: (job: JobStatus) => void,
+  onIncident: () => void
+): Promise<JobStatus> =>
+  new Promise((resolve) => {
+    const socket = io(BACKEND_URL, {
+      reconnection: true,
+      transports: ["websocket"],
+    });
+    let done = false;
+
+    const handle = (job: JobStatus) => {
+      if (done || job.job_id !== jobId) return;
+      onProgress(job);
+      if (isFinished(job)) {
+        done = true;
+        socket.disconnect();
+        resolve(job);
+      }
+    };
+
+    socket.on("job_progress", handle);
+    socket.on("job_incident", (event: { job_id: string; status: string }) => {
+      if (event.job_id === jobId && event.status === "opened") onIncident();
+    });
+    socket.on("connect", async () => {
+      try {
+        const response = await fetch(`${BACKEND_URL}/jobs/${jobId}`);
+        if (response.ok) handle(await response.json());
+      } catch (error) {
+        console.error("Job status error:", error);
+      }
+    });
+  });
+
 export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
   const [file, setFile] = useState<File | null>(null);
   const [title, setTitle] = useState("");
   const [description, setDescription] = useState("");
   const [uploading, setUploading] = useState(false);
+  const [job, setJob] = useState<JobStatus | null>(null);
+  const [incidentCount, setIncidentCount] = useState(0);
+  const [cancelling, setCancelling] = useState(false);
   const { toast } = useToast();
 
   const handleFileChange = (event: React.ChangeEvent<HTMLInputElement>) => {
@@ -60,6 +119,9 @@ export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
     }
 
     setUploading(true);
+    setJob(null);
+    setIncidentCount(0);
+    let uploadId: string | null = null;
 
     try {
       // Step 1: Create a database entry for this upload
@@ -76,6 +138,7 @@ export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
         .single();
 
       if (dbError) throw dbError;
+      uploadId = uploadEntry.id;
 
       // Notify parent component with the upload ID right away
       onUploadComplete(uploadEntry.id);
@@ -88,20 +151,42 @@ export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
         })
         .eq("id", uploadEntry.id);
 
-      // Step 3: Upload the file to Flask backend
+      // Step 3: Upload the file to Flask backend. It answers 202 with a job id
+      // (or 200 with the result straight away when the video is cached).
       const formData = new FormData();
       formData.append("video", file);
 
-      const response = await fetch("http://localhost:5000/process-video", {
+      const response = await fetch(`${BACKEND_URL}/process-video`, {
         method: "POST",
         body: formData,
       });
 
-      if (!response.ok) {
-        throw new Error(`HTTP error ${response.status}`);
+      let result = await response.json().catch(() => ({}));
+      if (!response.ok && response.status !== 202) {
+        throw new Error(result.error || `HTTP error ${response.status}`);
       }
 
-      const result = await response.json();
+      if (response.status === 202) {
+        // Step 3b: Follow the job, then fetch its result
+        const finished = await watchJob(result.job_id, setJob, () =>
+          setIncidentCount((count) => count + 1)
+        );
+        if (finished.status === "cancelled") {
+          await supabase
+            .from("video_uploads")
+            .update({ status: "failed", error: "Cancelled" })
+            .eq("id", uploadEntry.id);
+          toast({
+            title: "Processing cancelled",
+            description: "The video was not analysed",
+          });
+          return;
+        }
+        const resultResponse = await fetch(
+          `${BACKEND_URL}/jobs/${result.job_id}/result`
+        );
+        result = await resultResponse.json();
+      }
 
       // Step 4: Update the database entry with the processing status and result
       if (result.status === "completed") {
@@ -125,20 +210,20 @@ export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
           variant: "default",
         });
       } else {
-        throw new Error(result.message || "Processing failed");
+        throw new Error(result.error || result.message || "Processing failed");
       }
     } catch (error) {
       console.error("Processing error:", error);
       
       // Update status to failed if there was an error
-      if (currentUploadId) {
+      if (uploadId) {
         await supabase
           .from("video_uploads")
           .update({
             status: "failed",
             error: error instanceof Error ? error.message : "Unknown error",
           })
-          .eq("id", currentUploadId);
+          .eq("id", uploadId);
       }
       
       toast({
@@ -151,11 +236,35 @@ export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
       });
     } finally {
       setUploading(false);
+      setJob(null);
+      setCancelling(false);
     }
   };
 
-  // Track current upload ID
-  const [currentUploadId, setCurrentUploadId] = useState<string | null>(null);
+  const handleCancel = async () => {
+    if (!job) return;
+    setCancelling(true);
+    try {
+      // The job_progress event that follows ends the wait in handleSubmit
+      const response = await fetch(`${BACKEND_URL}/jobs/${job.job_id}/cancel`, {
+        method: "POST",
+      });
+      if (!response.ok) throw new Error(`HTTP error ${response.status}`);
+    } catch (error) {
+      setCancelling(false);
+      toast({
+        title: "Cancel failed",
+        description:
+          error instanceof Error ? error.message : "Could not cancel the job",
+        variant: "destructive",
+      });
+    }
+  };
+
+  const progressPercent =
+    job && job.frames_total > 0
+      ? Math.min(100, (job.frames_done / job.frames_total) * 100)
+      : 0;
 
   return (
     <Card className="h-full">
@@ -200,6 +309,33 @@ export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
             </div>
           </div>
 
+          {job && (
+            <div className="space-y-2">
+              <div className="flex justify-between text-sm text-muted-foreground">
+                <span>
+                  {job.status === "queued"
+                    ? "Waiting in queue..."
+                    : `Processing ${job.frames_done}/${job.frames_total} frames` +
+                      (job.fps ? ` (${job.fps.toFixed(1)} fps)` : "")}
+                </span>
+                <span>
+                  {incidentCount} incident{incidentCount === 1 ? "" : "s"} so far
+                </span>
+              </div>
+              <Progress value={progressPercent} />
+              <Button
+                type="button"
+                variant="outline"
+                onClick={handleCancel}
+                disabled={cancelling || isFinished(job)}
+                className="w-full"
+              >
+                <XCircle className="mr-2 h-4 w-4" />
+                {cancelling ? "Cancelling..." : "Cancel processing"}
+              </Button>
+            </div>
+          )}
+
           <Button
             type="submit"
             disabled={!file || !title || uploading}
@@ -227,7 +363,7 @@ export const UploadForm: React.FC<UploadFormProps> = ({ onUploadComplete }) => {
                     d="M4 12a8 8 0 018-8V0C5.373 0 0 5.373 0 12h4zm2 5.291A7.962 7.962 0 014 12H0c0 3.042 1.135 5.824 3 7.938l3-2.647z"
                   ></path>
                 </svg>
-                Uploading...
+                {job ? "Processing..." : "Uploading..."}
               </>
             ) : (
               <>
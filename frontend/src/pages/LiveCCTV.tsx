@@ -46,6 +46,8 @@ const LiveCCTV = () => {
     // Connection Events
     socket.on("connect", () => {
       setConnectionState("connected");
+      // Acknowledge processed frames so the server only sends the newest one
+      socket.emit("stream_settings", { ack: true });
       toast({ title: "Connected to detection server" });
     });
 
@@ -77,6 +79,15 @@ const LiveCCTV = () => {
       if (status === "active") toast({ title: "Detection system activated" });
     });
 
+    // Why a camera or detection request failed (e.g. the stream limit)
+    socket.on("stream_error", (data: { stream_id: string; error: string }) => {
+      toast({
+        variant: "destructive",
+        title: "Stream error",
+        description: data.error,
+      });
+    });
+
     socket.on(
       "detection_data",
       (data: {
@@ -102,9 +113,13 @@ const LiveCCTV = () => {
       }
     );
 
-    socket.on("video_frame_processed", (data: { frame: string }) => {
-      setProcessedFrame(`data:image/jpeg;base64,${data.frame}`);
-    });
+    socket.on(
+      "video_frame_processed",
+      (data: { frame: string }, ack?: () => void) => {
+        setProcessedFrame(`data:image/jpeg;base64,${data.frame}`);
+        ack?.();
+      }
+    );
 
     return () => {
       socket.disconnect();